@@ -1,19 +1,164 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, stream_with_context, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+import atexit
+import bisect
 import random
 import json
+import functools
+import hashlib
+import logging
+import logging.handlers
 import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from types import MappingProxyType
 import shortuuid
 from flask_cors import CORS
 
 app = Flask(__name__)
 # Добавляем поддержку CORS для работы с React-приложением
-CORS(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///game.db'
+# ETag нужен клиенту для условных запросов к /state
+CORS(app, expose_headers=['ETag'])
+
+def sqlite_storage(database_url, pool_size=10, busy_timeout=5.0):
+    """База из DATABASE_URL; файл SQLite настраивается для параллельной работы воркеров.
+
+    Журнал WAL (см. set_sqlite_pragmas) позволяет читать во время записи, писатели
+    ждут друг друга до busy_timeout секунд вместо немедленной ошибки
+    "database is locked". Соединения берутся из пула, у каждого свой кэш
+    подготовленных запросов.
+    """
+    if not database_url.startswith('sqlite'):
+        return database_url, {"pool_size": pool_size, "pool_pre_ping": True}
+    return database_url, {
+        "pool_size": pool_size,
+        "max_overflow": pool_size * 2,
+        "connect_args": {"timeout": busy_timeout, "cached_statements": 256, "check_same_thread": False}
+    }
+
+# Базы в памяти процесса, открытые memory_storage: имя -> соединение, которое
+# держит базу, пока пул закрывает и открывает свои соединения
+MEMORY_DATABASES = {}
+
+def memory_storage(database_url=None, pool_size=10, busy_timeout=5.0):
+    """SQLite в памяти для тестов и бенчмарков.
+
+    База открывается через VFS memdb: у каждого потока свое соединение из
+    пула, а писатели ждут друг друга до busy_timeout секунд, как с файлом.
+    (Одно соединение на все потоки ломается при параллельных запросах, а
+    общий кэш cache=shared сразу отвечает "database table is locked".)
+    У каждого процесса своя база, поэтому с несколькими воркерами gunicorn
+    не использовать.
+    """
+    name = '/starke-verben-duell'
+    uri = f'file:{name}?vfs=memdb'
+    if name not in MEMORY_DATABASES:
+        MEMORY_DATABASES[name] = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    return f'sqlite:///{uri}&uri=true', {
+        "pool_size": pool_size,
+        "max_overflow": pool_size * 2,
+        "connect_args": {"timeout": busy_timeout, "check_same_thread": False}
+    }
+
+def is_memory_database(database_url):
+    return database_url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in database_url
+
+STORAGE_BACKENDS = {
+    'sqlite': sqlite_storage,
+    'memory': memory_storage,
+}
+
+def configure_storage(config, backend, database_url):
+    """Выбирает хранилище игр (GAME_STORAGE) и настраивает подключение SQLAlchemy"""
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Неизвестное хранилище {backend!r}, доступны: {', '.join(STORAGE_BACKENDS)}")
+    # SQLite в памяти (DATABASE_URL=sqlite:///:memory:) — то же, что GAME_STORAGE=memory
+    if backend == 'sqlite' and is_memory_database(database_url):
+        backend = 'memory'
+    uri, engine_options = STORAGE_BACKENDS[backend](
+        database_url,
+        pool_size=config.get('DATABASE_POOL_SIZE', 10),
+        busy_timeout=config.get('DATABASE_BUSY_TIMEOUT', 5.0)
+    )
+    config['GAME_STORAGE'] = backend
+    config['SQLALCHEMY_DATABASE_URI'] = uri
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настройки каждого нового соединения с файлом SQLite"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # В режиме WAL fsync при каждом коммите не нужен для целостности базы
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+app.config['DATABASE_BUSY_TIMEOUT'] = float(os.environ.get('DATABASE_BUSY_TIMEOUT', 5.0))
+configure_storage(app.config, os.environ.get('GAME_STORAGE', 'sqlite'), os.environ.get('DATABASE_URL', 'sqlite:///game.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Сколько игр держать в памяти процесса и сколько секунд хранить неактивную игру
+app.config['GAME_CACHE_SIZE'] = int(os.environ.get('GAME_CACHE_SIZE', 1000))
+app.config['GAME_CACHE_TTL'] = float(os.environ.get('GAME_CACHE_TTL', 1800))
+# Для скольких игр хранить готовые ответы /state и /events (см. StateViewCache)
+app.config['STATE_CACHE_SIZE'] = int(os.environ.get('STATE_CACHE_SIZE', 2000))
+# Лобби (см. WaitingRoom): как часто перечитывать из базы ожидающие игры других
+# воркеров (в секундах) и сколько ожидающих игр держать в памяти
+app.config['LOBBY_REFRESH'] = float(os.environ.get('LOBBY_REFRESH', 2.0))
+app.config['LOBBY_SIZE'] = int(os.environ.get('LOBBY_SIZE', 200))
+# Фоновая архивация игр: период в секундах (0 — выключена), через сколько секунд
+# бросать ожидающую игру или билет подбора и сколько хранить завершенную игру
+app.config['ARCHIVE_INTERVAL'] = float(os.environ.get('ARCHIVE_INTERVAL', 0))
+app.config['WAITING_GAME_TTL'] = float(os.environ.get('WAITING_GAME_TTL', 24 * 3600))
+app.config['FINISHED_GAME_GRACE'] = float(os.environ.get('FINISHED_GAME_GRACE', 300))
+# Стратегия бота по умолчанию (см. BOT_STRATEGIES), бюджет времени на ход бота
+# в миллисекундах и сколько оцененных позиций помнить
+app.config['BOT_STRATEGY'] = os.environ.get('BOT_STRATEGY', 'first')
+app.config['BOT_MOVE_BUDGET_MS'] = float(os.environ.get('BOT_MOVE_BUDGET_MS', 50))
+app.config['BOT_CACHE_SIZE'] = int(os.environ.get('BOT_CACHE_SIZE', 10000))
+# Сколько потоков делают ходы бота в фоне (0 — ход бота внутри запроса игрока)
+app.config['BOT_WORKERS'] = int(os.environ.get('BOT_WORKERS', 4))
+# Поток /events: период пульса, как часто перечитывать версию игры, через сколько
+# секунд закрывать поток и сколько потоков держать в одном воркере одновременно.
+# Поток занимает поток воркера gthread, поэтому лимит должен быть заметно меньше
+# числа потоков (--threads), иначе ходам и /health не останется потоков
+app.config['SSE_HEARTBEAT'] = float(os.environ.get('SSE_HEARTBEAT', 15))
+app.config['STATE_RECHECK'] = float(os.environ.get('STATE_RECHECK', 1.0))
+app.config['SSE_MAX_AGE'] = float(os.environ.get('SSE_MAX_AGE', 300))
+app.config['SSE_MAX_STREAMS'] = int(os.environ.get('SSE_MAX_STREAMS', 12))
+# Длинный опрос /state: наибольшее ожидание в секундах и сколько опросов может ждать
+# одновременно (сверх лимита опрос отвечает сразу, тоже чтобы не занять все потоки)
+app.config['LONG_POLL_MAX_WAIT'] = float(os.environ.get('LONG_POLL_MAX_WAIT', 30))
+app.config['LONG_POLL_MAX_WAITERS'] = int(os.environ.get('LONG_POLL_MAX_WAITERS', 12))
+# Через сколько ходов из журнала записывать в GameState полный снимок игры
+app.config['GAME_SNAPSHOT_INTERVAL'] = int(os.environ.get('GAME_SNAPSHOT_INTERVAL', 20))
+# Журнал игры (см. GameLog): уровень, формат строк (text или json), доли сообщений
+# ниже WARNING, которые пишутся с маршрутов ("get_game_state=0.01,game_events=0.01"),
+# и игры, для которых пишется всё, включая DEBUG ("id1,id2")
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'text')
+app.config['LOG_SAMPLE_RATES'] = os.environ.get('LOG_SAMPLE_RATES', 'get_game_state=0.01,game_events=0.01')
+app.config['LOG_TRACE_GAMES'] = os.environ.get('LOG_TRACE_GAMES', '')
 db = SQLAlchemy(app)
 
+def utcnow():
+    """Текущее время UTC без часового пояса, как его хранит SQLite"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class GameState(db.Model):
+    # Индекс для лобби: ожидающие мультиплеерные игры по времени создания
+    __table_args__ = (db.Index('ix_game_state_lobby', 'game_type', 'game_status', 'created_at'),)
+
     id = db.Column(db.String(10), primary_key=True)
     deck = db.Column(db.JSON)
     player_cards = db.Column(db.JSON)
@@ -26,42 +171,839 @@ class GameState(db.Model):
     no_valid_moves_count = db.Column(db.Integer)
     game_status = db.Column(db.String(20))  # 'waiting', 'active', 'finished'
     auto_draw_cards = db.Column(db.Boolean, default=False)  # По умолчанию не добирать карты автоматически
+    bot_strategy = db.Column(db.String(20))  # Стратегия бота; None — BOT_STRATEGY из конфигурации
+    # Сид генератора игры: с ним и ходами игрока партию можно сыграть заново так же
+    seed = db.Column(db.BigInteger)
+    # Растет при каждом изменении записи, используется как ETag для /state
+    # и для обнаружения устаревших копий игры в памяти воркеров
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Колода, руки и сброс — снимок игры после хода snapshot_seq из журнала GameMove;
+    # текущее состояние — снимок плюс ходы после него (до move_seq включительно)
+    move_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    snapshot_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+    __mapper_args__ = {"version_id_col": version}
+
+class GameMove(db.Model):
+    """Запись журнала ходов игры. Журнал только дополняется.
+
+    kind: create и snapshot (полное состояние в data), join, play, draw,
+    bot_play, bot_draw, replace_top (новая колода в data). current_turn и
+    no_valid_moves_count — значения сразу после хода.
+    """
+    __table_args__ = (db.UniqueConstraint('game_id', 'seq'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.String(10), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(12), nullable=False)
+    actor = db.Column(db.String(10))
+    card = db.Column(db.Integer)
+    data = db.Column(db.JSON)
+    current_turn = db.Column(db.String(10))
+    no_valid_moves_count = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+class MatchTicket(db.Model):
+    """Игрок в очереди автоматического подбора соперника (/game/matchmake)"""
+    # Голова очереди — ожидающий билет (game_id IS NULL) с наименьшим id
+    __table_args__ = (db.Index('ix_match_ticket_queue', 'game_id', 'id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    player_name = db.Column(db.String(20), nullable=False, index=True)
+    auto_draw_cards = db.Column(db.Boolean, default=False)
+    game_id = db.Column(db.String(10))  # Заполняется, когда игроку нашелся соперник
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+class GameArchive(db.Model):
+    """Игра, вынесенная из game_state архиватором: только итог и журнал ходов"""
+    id = db.Column(db.String(10), primary_key=True)
+    player_name = db.Column(db.String(20))
+    opponent_name = db.Column(db.String(20))
+    game_type = db.Column(db.String(10))
+    outcome = db.Column(db.String(10))  # 'player', 'opponent' или 'expired' (никто не присоединился)
+    # Ходы GameMove списками [seq, kind, actor, card, data, current_turn, no_valid_moves_count]
+    moves = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=utcnow)
+
+class StaleGameError(Exception):
+    """Копия игры в памяти устарела: запись в базе уже изменил другой запрос"""
+
+def upgrade_schema():
+    """Добавляет в существующую таблицу колонки и индексы, появившиеся в модели позже"""
+    table = GameState.__table__
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table(table.name):
+        return
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    with db.engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}'
+            if column.server_default is not None:
+                ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+            connection.execute(db.text(ddl))
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+class GameNotifier:
+    """Будит запросы, ждущие изменения игры (SSE и длинный опрос).
+
+    У каждой игры своё условие ожидания, поэтому ход в одной игре не будит
+    подписчиков остальных. Оповещения действуют в пределах процесса: ожидающие
+    дополнительно перечитывают версию из базы, чтобы увидеть ходы,
+    сохраненные другими воркерами.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conditions = {}
+        self._waiters = {}
+        self._versions = {}
+
+    def publish(self, game_id, version):
+        with self._lock:
+            if game_id not in self._conditions:
+                return
+            self._versions[game_id] = version
+            self._conditions[game_id].notify_all()
+
+    def wait(self, game_id, since, timeout):
+        """Ждет версию больше since не дольше timeout секунд; возвращает True, если дождался"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            condition = self._conditions.get(game_id)
+            if condition is None:
+                condition = self._conditions[game_id] = threading.Condition(self._lock)
+            self._waiters[game_id] = self._waiters.get(game_id, 0) + 1
+            try:
+                while self._versions.get(game_id, since) <= since:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    condition.wait(remaining)
+                return True
+            finally:
+                self._waiters[game_id] -= 1
+                if not self._waiters[game_id]:
+                    del self._waiters[game_id]
+                    del self._conditions[game_id]
+                    self._versions.pop(game_id, None)
+
+    def waiting(self):
+        """Число запросов, ожидающих изменений"""
+        with self._lock:
+            return sum(self._waiters.values())
+
+game_notifier = GameNotifier()
+
+def escape_label(value):
+    """Значение метки в текстовом формате Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metric:
+    """Метрика для /metrics в текстовом формате Prometheus; значения хранятся по наборам меток"""
+    kind = 'untyped'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self.label_text(labels), value) for labels, value in items]
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{labels} {value}' for name, labels, value in self.samples()]
+        return lines
+
+class CounterMetric(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class GaugeMetric(Metric):
+    """Текущее значение: задается inc/dec или читается функцией при каждом сборе"""
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=(), function=None):
+        super().__init__(name, description, labels)
+        self.function = function
+        if not labels:
+            self._values[()] = 0
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, '', self.function())]
+        return super().samples()
+
+class HistogramMetric(Metric):
+    """Число наблюдений по корзинам (не больше границы), их сумма и количество"""
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Счетчики корзин, затем +Inf, сумма
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._values.items()]
+        result = []
+        for labels, series in items:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                total += count
+                result.append((f'{self.name}_bucket', self.label_text(labels, [('le', bound)]), total))
+            result.append((f'{self.name}_sum', self.label_text(labels), series[-1]))
+            result.append((f'{self.name}_count', self.label_text(labels), total))
+        return result
+
+class MetricsRegistry:
+    """Метрики процесса для /metrics.
+
+    Каждый воркер gunicorn считает свои запросы: при нескольких воркерах
+    сборщик видит тот воркер, который ответил на /metrics. Запись значения —
+    одна короткая блокировка, поэтому метрики можно обновлять на каждом запросе.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self.add(CounterMetric(name, description, labels))
+
+    def gauge(self, name, description, labels=(), function=None):
+        return self.add(GaugeMetric(name, description, labels, function))
+
+    def histogram(self, name, description, labels=(), **options):
+        return self.add(HistogramMetric(name, description, labels, **options))
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.expose()
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+request_seconds = metrics.histogram('http_request_duration_seconds', 'Время обработки запроса', ('route', 'method'))
+request_total = metrics.counter('http_requests_total', 'Запросы по маршрутам и кодам ответа', ('route', 'method', 'status'))
+request_queries = metrics.histogram('http_request_db_queries', 'Запросов к базе за один HTTP-запрос', ('route',), buckets=QUERY_BUCKETS)
+request_db_seconds = metrics.histogram('http_request_db_seconds', 'Время запросов к базе за один HTTP-запрос', ('route',))
+save_seconds = metrics.histogram('game_save_seconds', 'Время записи игры в базу (flush и commit в save_state)')
+bot_decision_seconds = metrics.histogram('bot_decision_seconds', 'Время выбора хода ботом', ('strategy',))
+sse_streams = metrics.gauge('sse_streams_active', 'Открытые потоки /events')
+long_requests_rejected = metrics.counter('long_requests_rejected_total',
+                                         'Долгие запросы, отклоненные из-за лимита', ('kind',))
+long_polls = metrics.gauge('long_polls_active', 'Длинные опросы /state, ждущие изменения игры')
+metrics.gauge('state_waiters', 'Потоки, ждущие изменения игры (SSE и длинный опрос)', function=game_notifier.waiting)
+
+class RequestSlots:
+    """Лимит одновременных долгих запросов одного вида в процессе.
+
+    Поток SSE и длинный опрос держат поток воркера всё время ожидания. Сверх
+    limit такие запросы не ждут, а сразу получают ответ (см. game_events и
+    get_game_state), чтобы остальным маршрутам хватало потоков.
+    """
+
+    def __init__(self, kind, limit, gauge):
+        self.kind = kind
+        self.limit = limit
+        self.gauge = gauge
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def acquire(self):
+        """Занимает место; False, если лимит исчерпан"""
+        with self._lock:
+            if self.active >= self.limit:
+                long_requests_rejected.inc(self.kind)
+                return False
+            self.active += 1
+        self.gauge.inc()
+        return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self.gauge.dec()
+
+sse_slots = RequestSlots('sse', app.config['SSE_MAX_STREAMS'], sse_streams)
+long_poll_slots = RequestSlots('long_poll', app.config['LONG_POLL_MAX_WAITERS'], long_polls)
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    """Считает запросы к базе и их время для текущего HTTP-запроса"""
+    if has_request_context():
+        timing = g.get('db_timing')
+        if timing is not None:
+            timing[0] += 1
+            timing[1] += time.perf_counter() - context.query_started
+
+def parse_sample_rates(value):
+    """Доли выборки по маршрутам из строки вида get_game_state=0.01,game_events=0.1"""
+    rates = {}
+    for item in value.split(','):
+        if item.strip():
+            route, _, rate = item.partition('=')
+            rates[route.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+class StructuredFormatter(logging.Formatter):
+    """Запись журнала одной строкой: поля события как key=value или объектом JSON"""
+
+    def __init__(self, style='text'):
+        super().__init__()
+        self.json = style == 'json'
+
+    def format(self, record):
+        fields = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        fields.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            fields["exception"] = self.formatException(record.exc_info)
+        if self.json:
+            return json.dumps(fields, ensure_ascii=False, default=str)
+        head = f"{fields.pop('time')} {fields.pop('level')} {fields.pop('logger')} {fields.pop('message')}"
+        return ' '.join([head] + [f"{key}={json.dumps(value, ensure_ascii=False, default=str)}"
+                                  for key, value in fields.items()])
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Кладет запись в очередь как есть: строка собирается в потоке QueueListener.
+
+    Обычный QueueHandler форматирует сообщение еще в потоке запроса, поэтому
+    поля события должны быть неизменяемыми копиями, а не живыми объектами игры.
+    """
+
+    def prepare(self, record):
+        return record
+
+class GameLog:
+    """Структурированный журнал игры.
+
+    Событие — короткое сообщение и поля (game_id, маршрут и т.п.). Проверка
+    уровня делается до создания записи, поэтому выключенный DEBUG стоит одно
+    сравнение. Сообщения ниже WARNING с маршрутов из sample_rates пишутся
+    с заданной долей, а для игр из traced пишется всё, включая DEBUG, без
+    выборки. Записи уходят в очередь, а форматирует и выводит их фоновый поток,
+    так что запрос не ждет записи в stderr.
+    """
+
+    def __init__(self, logger, level=logging.INFO, sample_rates=None, traced=()):
+        self.logger = logger
+        self.level = level
+        self.sample_rates = sample_rates or {}
+        self.traced = frozenset(traced)
+
+    def trace(self, game_id, enabled=True):
+        """Включает или выключает полную трассировку одной игры"""
+        self.traced = self.traced | {game_id} if enabled else self.traced - {game_id}
+
+    def enabled(self, level, game_id=None):
+        """Будет ли записано событие уровня level (без учета выборки)"""
+        return level >= self.level or game_id in self.traced
+
+    def log(self, level, message, game_id=None, exc_info=None, **fields):
+        traced = game_id in self.traced
+        if level < self.level and not traced:
+            return
+        route = request.endpoint if has_request_context() else None
+        if level < logging.WARNING and not traced:
+            rate = self.sample_rates.get(route)
+            if rate is not None and random.random() >= rate:
+                return
+        if game_id is not None:
+            fields["game_id"] = game_id
+        if route is not None:
+            fields["route"] = route
+        record = self.logger.makeRecord(self.logger.name, level, __name__, 0, message, (), exc_info,
+                                        extra={"fields": fields})
+        self.logger.handle(record)
+
+    def debug(self, message, game_id=None, **fields):
+        self.log(logging.DEBUG, message, game_id, **fields)
+
+    def info(self, message, game_id=None, **fields):
+        self.log(logging.INFO, message, game_id, **fields)
+
+    def warning(self, message, game_id=None, **fields):
+        self.log(logging.WARNING, message, game_id, **fields)
+
+    def error(self, message, game_id=None, **fields):
+        self.log(logging.ERROR, message, game_id, **fields)
+
+    def exception(self, message, game_id=None, **fields):
+        self.log(logging.ERROR, message, game_id, exc_info=sys.exc_info(), **fields)
+
+def configure_game_log(config, stream=None):
+    """Журнал 'game': очередь в памяти и поток, который пишет строки в stream (stderr)"""
+    logger = logging.getLogger('game')
+    logger.propagate = False
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(StructuredFormatter(config['LOG_FORMAT']))
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(DeferredQueueHandler(records))
+    traced = [game_id.strip() for game_id in config['LOG_TRACE_GAMES'].split(',') if game_id.strip()]
+    return GameLog(logger, logging.getLevelName(config['LOG_LEVEL']),
+                   parse_sample_rates(config['LOG_SAMPLE_RATES']), traced)
+
+game_log = configure_game_log(app.config)
+
+# Ключи форм глагола в verbs.json в порядке индекса формы на карточке (0–3)
+FORM_KEYS = ('infinitive', 'prasens_3', 'prateritum', 'partizip_2')
+FORMS_PER_VERB = len(FORM_KEYS)
+
+# Неизменяемый снимок каталога со всеми индексами; подменяется одним присваиванием
+VerbCatalog = namedtuple('VerbCatalog', 'verbs deck_template verb_ids version by_infinitive by_form by_translation')
+
+class VerbRegistry:
+    """Каталог глаголов, общий для всего процесса.
+
+    Файл verbs.json читается один раз, данные доступны только для чтения.
+    При изменении mtime файла каталог перечитывается и подменяется целиком
+    одним присваиванием ссылки на VerbCatalog. Каждая операция берет ссылку
+    на снимок один раз, поэтому не смешивает старый и новый каталог.
+
+    Каждая карточка кодируется целым числом verb_id * 4 + form_index, где
+    verb_id — позиция глагола в verbs.json. Эти номера хранятся в базе,
+    поэтому новые глаголы можно добавлять только в конец файла: перезагрузка,
+    которая меняет, удаляет или переставляет уже известные глаголы, отклоняется
+    и процесс продолжает работать со старым каталогом.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._catalog = None
+        self._checked_at = 0.0
+        self._load()
+
+    def _load(self):
+        """Читает файл и подменяет каталог. False, если новый каталог отклонен"""
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        verbs = tuple(MappingProxyType(dict(verb)) for verb in data['verbs'])
+        if self._catalog is not None:
+            known = [verb['infinitive'] for verb in self._catalog.verbs]
+            if [verb['infinitive'] for verb in verbs[:len(known)]] != known:
+                # Номера карточек в сохраненных играх стали бы значить другие глаголы
+                self._mtime = mtime
+                game_log.error("Каталог глаголов отклонен: известные глаголы изменены или переставлены",
+                               path=self.path, known=len(known), loaded=len(verbs))
+                return False
+        by_infinitive = {}
+        by_form = tuple({} for _ in FORM_KEYS)
+        by_translation = {}
+        for verb in verbs:
+            by_infinitive[verb['infinitive']] = verb
+            for form_index, key in enumerate(FORM_KEYS):
+                by_form[form_index].setdefault(verb[key], verb)
+            by_translation.setdefault(verb['translation'], []).append(verb)
+        # Эталонная колода: по 4 карточки на глагол, (форма, инфинитив, индекс формы, перевод)
+        # Порядок карточек совпадает с их номерами: deck_template[card_id]
+        deck_template = tuple(
+            (verb[key], verb['infinitive'], form_index, verb['translation'])
+            for verb in verbs
+            for form_index, key in enumerate(FORM_KEYS)
+        )
+        verb_ids = {verb['infinitive']: verb_id for verb_id, verb in enumerate(verbs)}
+        catalog_version = hashlib.sha1(
+            json.dumps(deck_template, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()[:12]
+
+        # Подменяем все индексы разом, чтобы не смешивать старый и новый каталог
+        self._catalog = VerbCatalog(
+            verbs=verbs,
+            deck_template=deck_template,
+            verb_ids=MappingProxyType(verb_ids),
+            version=catalog_version,
+            by_infinitive=MappingProxyType(by_infinitive),
+            by_form=tuple(MappingProxyType(index) for index in by_form),
+            by_translation=MappingProxyType(
+                {translation: tuple(items) for translation, items in by_translation.items()}
+            ),
+        )
+        self._mtime = mtime
+        return True
+
+    def refresh(self, force=False):
+        """Перечитывает файл, если он изменился. Возвращает True при перезагрузке"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return False
+            if not force and mtime == self._mtime:
+                return False
+            return self._load()
+
+    @property
+    def catalog(self):
+        """Текущий снимок каталога; для нескольких полей берите его один раз"""
+        self.refresh()
+        return self._catalog
+
+    @property
+    def verbs(self):
+        return self.catalog.verbs
+
+    @property
+    def deck_template(self):
+        """Неперемешанная колода; новая игра копирует и перемешивает её"""
+        return self.catalog.deck_template
+
+    @property
+    def catalog_version(self):
+        """Хэш каталога карточек, меняется вместе с содержимым verbs.json"""
+        return self.catalog.version
+
+    def card_id(self, card):
+        """Номер карточки по кортежу (форма, инфинитив, индекс формы, перевод)"""
+        catalog = self._catalog
+        if isinstance(card, int) and not isinstance(card, bool):
+            if not 0 <= card < len(catalog.deck_template):
+                raise ValueError(f"Неизвестная карточка: {card}")
+            return card
+        form_index = int(card[2])
+        verb_id = catalog.verb_ids.get(card[1])
+        if verb_id is None or not 0 <= form_index < FORMS_PER_VERB:
+            raise ValueError(f"Неизвестная карточка: {card}")
+        return verb_id * FORMS_PER_VERB + form_index
+
+    def card(self, card_id):
+        """Карточка по её номеру"""
+        return self._catalog.deck_template[card_id]
+
+    def get(self, infinitive):
+        """Глагол по инфинитиву или None"""
+        return self.catalog.by_infinitive.get(infinitive)
+
+    def by_form(self, form, form_index):
+        """Глагол, у которого форма с индексом form_index равна form"""
+        return self.catalog.by_form[form_index].get(form)
+
+    def by_translation(self, translation):
+        """Все глаголы с данным переводом (кортеж, возможно пустой)"""
+        return self.catalog.by_translation.get(translation, ())
+
+    def form(self, infinitive, form_index):
+        """Форма глагола по инфинитиву и индексу формы"""
+        verb = self.get(infinitive)
+        return verb[FORM_KEYS[form_index]] if verb else None
+
+    def __len__(self):
+        return len(self.verbs)
+
+    def __iter__(self):
+        return iter(self.verbs)
+
+    def __contains__(self, infinitive):
+        return self.get(infinitive) is not None
+
+verb_registry = VerbRegistry(os.path.join(app.static_folder, 'data', 'verbs.json'))
 
 def load_verbs():
-    with open(os.path.join(app.static_folder, 'data', 'verbs.json'), 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        return data['verbs']
+    return list(verb_registry.verbs)
+
+def encode_card(card):
+    return verb_registry.card_id(card)
+
+def decode_card(value):
+    """Карточка из номера; старые записи в базе хранят карточку списком"""
+    if isinstance(value, int):
+        return verb_registry.card(value)
+    return tuple(value)
+
+def encode_cards(cards):
+    return [encode_card(card) for card in cards]
+
+def decode_cards(values):
+    return [decode_card(value) for value in values or []]
+
+def parse_card(value):
+    """Карточка из запроса (номер или список) или None, если она некорректна"""
+    try:
+        return verb_registry.card(encode_card(value))
+    except (TypeError, ValueError, IndexError, KeyError):
+        return None
+
+def is_playable_on(card, top_card):
+    """Карточку можно положить, если совпадает глагол или форма"""
+    return card[2] == top_card[2] or card[1] == top_card[1]
+
+def format_state_cards(state, card_format):
+    """При card_format == 'ids' заменяет карточки в ответе их номерами"""
+    if card_format == 'ids':
+        state["player_cards"] = encode_cards(state["player_cards"])
+        if state.get("discard_pile") is not None:
+            state["discard_pile"] = encode_card(state["discard_pile"])
+    return state
+
+# Поле снимка (см. Game.snapshot) с рукой каждой роли
+HAND_FIELDS = {"player": "player_cards", "opponent": "opponent_cards"}
+
+def new_seed():
+    """Случайный сид для новой игры (53 бита — без потерь в числах JavaScript)"""
+    return random.SystemRandom().getrandbits(53)
+
+def parse_seed(value):
+    """Сид из запроса: неотрицательное целое меньше 2**63, иначе None"""
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value < 2 ** 63:
+        return None
+    return value
+
+def copy_state(state):
+    return {field: list(value) if isinstance(value, list) else value for field, value in state.items()}
+
+def apply_move(state, move):
+    """Применяет запись журнала GameMove к закодированному снимку игры на месте"""
+    if move.kind in ('create', 'snapshot'):
+        state.update(copy_state(move.data))
+    elif move.kind in ('play', 'bot_play'):
+        state[HAND_FIELDS[move.actor]].remove(move.card)
+        state["discard_pile"].append(move.card)
+    elif move.kind in ('draw', 'bot_draw'):
+        if move.card is not None:
+            state["deck"].pop()
+            state[HAND_FIELDS[move.actor]].append(move.card)
+    elif move.kind == 'replace_top':
+        if move.data["returned"]:
+            state["discard_pile"].pop(-2)
+        state["discard_pile"].append(move.card)
+        state["deck"] = list(move.data["deck"])
+    state["current_turn"] = move.current_turn
+    state["no_valid_moves_count"] = move.no_valid_moves_count
+
+def replay_moves(state, moves):
+    """Снимок игры после ходов moves, примененных к копии state"""
+    state = copy_state(state)
+    for move in moves:
+        apply_move(state, move)
+    return state
+
+def replay_game(game_id, seq=None):
+    """Состояние игры после хода seq (по умолчанию последнего), восстановленное только по журналу"""
+    query = GameMove.query.filter(GameMove.game_id == game_id)
+    if seq is not None:
+        query = query.filter(GameMove.seq <= seq)
+    start = query.filter(GameMove.kind.in_(('create', 'snapshot'))).order_by(GameMove.seq.desc()).first()
+    if start is None:
+        return None
+    moves = query.filter(GameMove.seq > start.seq).order_by(GameMove.seq).all()
+    return replay_moves({}, [start] + moves)
+
+class Hand(list):
+    """Рука игрока: обычный список карточек плюс индексы по глаголу и по форме.
+
+    Индексы обновляются при каждом добавлении и удалении карточки, поэтому
+    проверка «есть ли чем сходить на верхнюю карточку» и выбор такой карточки
+    не требуют перебора руки. Порядок карточек в списке сохраняется.
+    """
+
+    def __init__(self, cards=()):
+        super().__init__(cards)
+        self._rebuild()
+
+    def _rebuild(self):
+        self._by_verb = {}
+        self._by_form = {}
+        for card in self:
+            self._index(card)
+
+    def _index(self, card):
+        for index, key in ((self._by_verb, card[1]), (self._by_form, card[2])):
+            bucket = index.setdefault(key, {})
+            bucket[card] = bucket.get(card, 0) + 1
+
+    def _unindex(self, card):
+        for index, key in ((self._by_verb, card[1]), (self._by_form, card[2])):
+            bucket = index[key]
+            if bucket[card] > 1:
+                bucket[card] -= 1
+            else:
+                del bucket[card]
+                if not bucket:
+                    del index[key]
+
+    def playable_card(self, top_card):
+        """Карточка, которую можно положить на top_card, или None.
+
+        Сначала ищется совпадение по глаголу, затем по форме.
+        """
+        cards = self._by_verb.get(top_card[1]) or self._by_form.get(top_card[2])
+        return next(iter(cards)) if cards else None
+
+    def has_playable(self, top_card):
+        return top_card[1] in self._by_verb or top_card[2] in self._by_form
+
+    def __contains__(self, card):
+        try:
+            return card in self._by_verb.get(card[1], ())
+        except (TypeError, IndexError):
+            return list.__contains__(self, card)
+
+    def append(self, card):
+        super().append(card)
+        self._index(card)
+
+    def insert(self, position, card):
+        super().insert(position, card)
+        self._index(card)
+
+    def extend(self, cards):
+        cards = list(cards)
+        super().extend(cards)
+        for card in cards:
+            self._index(card)
+
+    def __iadd__(self, cards):
+        self.extend(cards)
+        return self
+
+    def remove(self, card):
+        super().remove(card)
+        self._unindex(card)
+
+    def pop(self, position=-1):
+        card = super().pop(position)
+        self._unindex(card)
+        return card
+
+    def clear(self):
+        super().clear()
+        self._rebuild()
+
+    def __setitem__(self, position, value):
+        super().__setitem__(position, value)
+        self._rebuild()
+
+    def __delitem__(self, position):
+        super().__delitem__(position)
+        self._rebuild()
+
+    def __imul__(self, times):
+        super().__imul__(times)
+        self._rebuild()
+        return self
+
+class Seats(dict):
+    """Словарь рук игроков; любой присвоенный список превращается в Hand"""
+
+    def __init__(self, hands=()):
+        super().__init__()
+        for role, cards in dict(hands).items():
+            self[role] = cards
+
+    def __setitem__(self, role, cards):
+        super().__setitem__(role, cards if isinstance(cards, Hand) else Hand(cards))
 
 @app.route("/")
 def index():
     return render_template('index.html')
 
 class Game:
-    def __init__(self, game_id=None):
-        self.verbs = load_verbs()
+    # Правила: сколько карт сдается каждому и после скольких ходов подряд
+    # без возможности сходить заменяется верхняя карта сброса
+    HAND_SIZE = 10
+    PASS_LIMIT = 2
+    # Записывать ли ходы в журнал (без журнала игру нельзя сохранить в базу)
+    record_moves = True
+    # Идентификатор игры в базе (None, пока игра не загружена и не сохранена)
+    game_id = None
+
+    @property
+    def players(self):
+        return self._players
+
+    @players.setter
+    def players(self, hands):
+        self._players = Seats(hands)
+
+    @property
+    def rng(self):
+        """Генератор игры. После загрузки из базы восстанавливается при первом обращении"""
+        if self._rng is None:
+            self._rng = self.restore_rng()
+        return self._rng
+
+    @rng.setter
+    def rng(self, rng):
+        self._rng = rng
+
+    def __init__(self, game_id=None, seed=None):
+        self.verbs = verb_registry.verbs
         if game_id:
             game_state = GameState.query.get(game_id)
             if game_state:
-                self.deck = game_state.deck
-                self.players = {
-                    "player": game_state.player_cards,
-                    "opponent": game_state.opponent_cards
-                }
-                self.discard_pile = game_state.discard_pile
-                self.current_turn = game_state.current_turn
-                self.game_type = game_state.game_type
-                self.no_valid_moves_count = game_state.no_valid_moves_count if hasattr(game_state, 'no_valid_moves_count') else 0
+                self.load_state(game_state)
                 return
-        
-        self.deck = []
-        for verb in self.verbs:
-            self.deck.extend([
-                (verb['infinitive'], verb['infinitive'], 0, verb['translation']),
-                (verb['prasens_3'], verb['infinitive'], 1, verb['translation']),
-                (verb['prateritum'], verb['infinitive'], 2, verb['translation']),
-                (verb['partizip_2'], verb['infinitive'], 3, verb['translation'])
-            ])
-        random.shuffle(self.deck)
+        self.seed = new_seed() if seed is None else seed
+        self.rng = random.Random(self.seed)
+        # Игра и номер хода журнала, по которым восстанавливается генератор (см. restore_rng)
+        self._rng_source = None
+        # Версия записи GameState, из которой загружена или в которую сохранена игра
+        self.version = None
+        self.auto_draw_cards = False
+        self.bot_strategy = None
+        # Закодированное состояние на момент последней загрузки или сохранения
+        self._saved = None
+        # Ходы, сделанные после этого и еще не записанные в журнал GameMove
+        self.pending_moves = []
+        self.deck = self.build_deck()
         self.players = {"player": [], "opponent": []}
         self.discard_pile = []
         self.current_turn = "player"  # Всегда начинает игрок
@@ -69,8 +1011,149 @@ class Game:
         self.no_valid_moves_count = 0
         self.deal_cards()
 
+    @classmethod
+    def from_state(cls, game_state, moves=None):
+        """Игра из записи GameState (см. load_state) без сборки и сдачи новой колоды"""
+        game = cls.__new__(cls)
+        game.verbs = verb_registry.verbs
+        game.load_state(game_state, moves)
+        return game
+
+    def load_state(self, game_state, moves=None):
+        """Загружает снимок из GameState и применяет к нему ходы журнала после снимка"""
+        if moves is None:
+            moves = GameMove.query.filter(
+                GameMove.game_id == game_state.id,
+                GameMove.seq > game_state.snapshot_seq
+            ).order_by(GameMove.seq).all()
+        self.deck = decode_cards(game_state.deck)
+        self.players = {
+            "player": decode_cards(game_state.player_cards),
+            "opponent": decode_cards(game_state.opponent_cards)
+        }
+        self.discard_pile = decode_cards(game_state.discard_pile)
+        self.current_turn = game_state.current_turn
+        self.game_type = game_state.game_type
+        self.no_valid_moves_count = game_state.no_valid_moves_count or 0
+        self.auto_draw_cards = bool(game_state.auto_draw_cards)
+        self.bot_strategy = game_state.bot_strategy
+        self.version = game_state.version
+        self.seed = game_state.seed
+        self.rng = None
+        self._rng_source = (game_state.id, game_state.move_seq)
+        self.game_id = game_state.id
+        if moves:
+            self.restore(replay_moves(self.snapshot(), moves))
+        self.pending_moves = []
+        self._saved = self.snapshot()
+
+    def restore_rng(self):
+        """Генератор в том состоянии, в котором его оставили ходы журнала до загрузки игры.
+
+        Генератор тратится только на перемешивание колоды при создании игры и на
+        возврат карты в колоду в replace_top_card, поэтому достаточно повторить
+        эти вызовы: длины колоды берутся из записей replace_top журнала, а размер
+        исходной колоды — из снимка create (каталог с тех пор мог вырасти).
+        У старых игр без сида — новый случайный генератор.
+        """
+        if self.seed is None or self._rng_source is None:
+            return random.Random()
+        game_id, seq = self._rng_source
+        created = db.session.query(GameMove.data).filter_by(game_id=game_id, kind='create').scalar()
+        if created is not None:
+            deck_size = sum(len(created[field]) for field in ("deck", "player_cards", "opponent_cards", "discard_pile"))
+        else:
+            deck_size = len(verb_registry.deck_template)
+        rng = random.Random(self.seed)
+        # Число вызовов генератора в shuffle зависит только от длины колоды
+        rng.shuffle(list(range(deck_size)))
+        replacements = db.session.query(GameMove.data).filter(
+            GameMove.game_id == game_id,
+            GameMove.kind == 'replace_top',
+            GameMove.seq <= seq
+        ).order_by(GameMove.seq)
+        for data, in replacements:
+            if data["returned"]:
+                rng.randrange(len(data["deck"]) + 1)
+        return rng
+
+    def restore(self, state):
+        """Устанавливает поля игры из закодированного снимка"""
+        self.deck = decode_cards(state["deck"])
+        self.players = {
+            "player": decode_cards(state["player_cards"]),
+            "opponent": decode_cards(state["opponent_cards"])
+        }
+        self.discard_pile = decode_cards(state["discard_pile"])
+        self.current_turn = state["current_turn"]
+        self.no_valid_moves_count = state["no_valid_moves_count"] or 0
+
+    def snapshot(self):
+        """Изменяемые поля игры в том виде, в котором они хранятся в GameState"""
+        return {
+            "deck": encode_cards(self.deck),
+            "player_cards": encode_cards(self.players["player"]),
+            "opponent_cards": encode_cards(self.players["opponent"]),
+            "discard_pile": encode_cards(self.discard_pile),
+            "current_turn": self.current_turn,
+            "no_valid_moves_count": self.no_valid_moves_count
+        }
+
+    def is_dirty(self):
+        """Есть ли в игре изменения, еще не записанные в базу"""
+        return self._saved is None or bool(self.pending_moves) or self.snapshot() != self._saved
+
+    def record(self, kind, actor=None, card=None, data=None):
+        """Добавляет ход в журнал игры.
+
+        Очередь хода и счетчик у записи заполняются перед следующим ходом
+        или при сохранении, когда ход уже полностью выполнен.
+        """
+        if not self.record_moves:
+            return
+        self._close_move()
+        self.pending_moves.append({"kind": kind, "actor": actor, "card": card, "data": data})
+
+    def _close_move(self):
+        if self.pending_moves:
+            self.pending_moves[-1]["current_turn"] = self.current_turn
+            self.pending_moves[-1]["no_valid_moves_count"] = self.no_valid_moves_count
+
+    def _move_rows(self, game_id, seq):
+        """Записи GameMove для несохраненных ходов, начиная с номера seq + 1"""
+        self._close_move()
+        rows = []
+        for move in self.pending_moves:
+            seq += 1
+            data = move["data"]
+            if move["kind"] == 'replace_top':
+                data = dict(data, deck=encode_cards(data["deck"]))
+            card = encode_card(move["card"]) if move["card"] is not None else None
+            rows.append(GameMove(game_id=game_id, seq=seq, **dict(move, card=card, data=data)))
+        return rows
+
+    def discard_card(self, player, card, kind="play"):
+        """Перекладывает карту из руки в сброс"""
+        self.players[player].remove(card)
+        self.discard_pile.append(card)
+        self.record(kind, player, card)
+
+    def take_card(self, player, kind="draw"):
+        """Берет карту из колоды в руку; возвращает её или None, если колода пуста"""
+        card = self.deck.pop() if self.deck else None
+        if card is not None:
+            self.players[player].append(card)
+        self.record(kind, player, card)
+        return card
+
+    def build_deck(self):
+        """Копирует эталонную колоду из каталога и перемешивает её генератором игры"""
+        deck = list(verb_registry.deck_template)
+        self.rng.shuffle(deck)
+        return deck
+
     def deal_cards(self):
-        for _ in range(10):
+        for _ in range(self.HAND_SIZE):
             self.players["player"].append(self.deck.pop())
             self.players["opponent"].append(self.deck.pop())
         self.discard_pile.append(self.deck.pop())
@@ -83,16 +1166,14 @@ class Game:
                 # Предотвращаем немедленный ход бота, просто меняя ход обратно на игрока
                 self.current_turn = "player"
 
-    def play_card(self, player, card):
+    def play_card(self, player, card, bot_reply=True):
+        """Ход картой card. В игре с ботом при bot_reply бот сразу отвечает своим ходом"""
         if player != self.current_turn:
             return False, "Не ваш ход!"
         if card not in self.players[player]:
             return False, "У вас нет такой карты!"
-        top_form, top_verb, top_index, _ = self.discard_pile[-1]
-        card_form, card_verb, card_index, _ = card
-        if card_index == top_index or card_verb == top_verb:
-            self.players[player].remove(card)
-            self.discard_pile.append(card)
+        if is_playable_on(card, self.discard_pile[-1]):
+            self.discard_card(player, card)
             
             # Проверяем, остались ли у игрока карты
             if len(self.players[player]) == 0:
@@ -104,8 +1185,8 @@ class Game:
             self.no_valid_moves_count = 0
             
             # Если игра с ботом, сразу делаем ход ботом
-            if self.game_type == "bot" and self.current_turn == "opponent":
-                print("Делаем ход ботом")  # Отладка
+            if bot_reply and self.game_type == "bot" and self.current_turn == "opponent":
+                game_log.debug("Ход бота после хода игрока", self.game_id)
                 return self.bot_move()
             
             return True, "Карта успешно сыграна."
@@ -115,54 +1196,79 @@ class Game:
         if self.game_type != "bot" or self.current_turn != "opponent":
             return False, "Не ход бота!"
         
-        print("Ход бота, проверяем карты")  # Отладка
-        
-        top_form, top_verb, top_index, _ = self.discard_pile[-1]
-        for card in self.players["opponent"]:
-            if card[2] == top_index or card[1] == top_verb:
-                self.players["opponent"].remove(card)
-                self.discard_pile.append(card)
-                
-                # Проверяем, остались ли у бота карты
-                if len(self.players["opponent"]) == 0:
-                    self.current_turn = "over"  # Игра закончена
-                    return True, "Бот выиграл, избавившись от всех карточек!"
-                
-                self.current_turn = "player"
-                self.no_valid_moves_count = 0
-                print("Бот сделал ход, передаем ход игроку")  # Отладка
-                return True, "Бот сделал ход."
+        return self.apply_bot_move(self.choose_bot_card())
+
+    def choose_bot_card(self):
+        """Карта для хода бота по его стратегии (None — подходящей нет)"""
+        strategy = self.bot_strategy or app.config['BOT_STRATEGY']
+        # Время решения пишем только для настоящих игр, не для симуляций и доигрываний
+        if not self.record_moves:
+            return bot_strategy(strategy).choose(self)
+        started = time.perf_counter()
+        card = bot_strategy(strategy).choose(self)
+        bot_decision_seconds.observe(time.perf_counter() - started, strategy)
+        return card
+
+    def apply_bot_move(self, card):
+        """Ход бота картой card, выбранной стратегией (None — подходящей карты нет)"""
+        if card is not None:
+            self.discard_card("opponent", card, kind="bot_play")
+            
+            # Проверяем, остались ли у бота карты
+            if len(self.players["opponent"]) == 0:
+                self.current_turn = "over"  # Игра закончена
+                return True, "Бот выиграл, избавившись от всех карточек!"
+            
+            self.current_turn = "player"
+            self.no_valid_moves_count = 0
+            game_log.debug("Бот сыграл карту", self.game_id, card=card)
+            return True, "Бот сделал ход."
 
         # если у бота нет возможности сходить
-        print("У бота нет возможности сходить, берет карту")  # Отладка
-        self.pull_one_more_card("opponent")
+        game_log.debug("Бот берет карту", self.game_id, passes=self.no_valid_moves_count + 1)
+        self.pull_one_more_card("opponent", kind="bot_draw")
         self.no_valid_moves_count += 1
-        if self.no_valid_moves_count >= 2:
+        if self.no_valid_moves_count >= self.PASS_LIMIT:
             self.replace_top_card()
             self.no_valid_moves_count = 0
             return True, "После двух ходов без возможности сходить, верхняя карточка заменена"
         return True, "У бота нет возможности сходить. Он берет карту и пропускает ход"
 
-    def pull_one_more_card(self, player_name):
-        if len(self.deck) > 0:
-            self.players[player_name].append(self.deck.pop())
+    def pull_one_more_card(self, player_name, kind="draw"):
+        self.take_card(player_name, kind)
         self.current_turn = "opponent" if player_name == "player" else "player"
 
+    def pass_turn(self, player):
+        """Игроку нечем сходить: берет карту и передает ход.
+
+        После PASS_LIMIT таких ходов подряд вместо передачи хода заменяется
+        верхняя карта сброса. Возвращает сообщение для игрока.
+        """
+        self.take_card(player)
+        self.no_valid_moves_count += 1
+        if self.no_valid_moves_count >= self.PASS_LIMIT:
+            self.replace_top_card()
+            self.no_valid_moves_count = 0
+            return "После двух ходов без возможности сходить, верхняя карточка заменена"
+        self.current_turn = "opponent" if player == "player" else "player"
+        return "Карта взята, ход переходит к другому игроку"
+
     def replace_top_card(self):
         """Заменяет верхнюю карту в стопке сброса на новую карту из колоды"""
         if len(self.deck) > 0:
+            returned = len(self.discard_pile) > 1
             # Если в стопке сброса больше одной карты
-            if len(self.discard_pile) > 1:
+            if returned:
                 # Берем карту, которую собираемся скрыть (предпоследнюю)
                 card_to_return = self.discard_pile.pop(-2)
-                # Возвращаем её в колоду
-                self.deck.append(card_to_return)
-                # Перемешиваем колоду
-                random.shuffle(self.deck)
+                # Возвращаем её в колоду на случайное место: колода и так перемешана,
+                # поэтому это равносильно перемешиванию, но без перестановки всей колоды
+                self.deck.insert(self.rng.randrange(len(self.deck) + 1), card_to_return)
             
             # Заменяем верхнюю карту на новую из колоды
             new_card = self.deck.pop()
             self.discard_pile.append(new_card)
+            self.record('replace_top', card=new_card, data={"returned": returned, "deck": list(self.deck)})
             
             return new_card
         return None
@@ -179,25 +1285,45 @@ class Game:
             "winner": "player" if len(self.players["player"]) == 0 else ("opponent" if len(self.players["opponent"]) == 0 else None)
         }
 
-    def check_if_playable(self):
-        top_form, top_verb, top_index, _ = self.discard_pile[-1]
-        for card in self.players["player"]:
-            if card[2] == top_index or card[1] == top_verb:
-                return True
-        return False
+    def check_if_playable(self, player="player"):
+        return self.players[player].has_playable(self.discard_pile[-1])
+
+    def save_state(self, game_id, player_name=None, opponent_name=None, game_type=None, auto_draw_cards=False):
+        """Сохраняет игру одним коммитом.
 
-    def save_state(self, game_id, player_name=None, opponent_name=None, game_type="bot", auto_draw_cards=False):
+        Новые ходы дописываются в журнал GameMove, а в GameState обновляются
+        только очередь хода и счетчики. Полный снимок колоды, рук и сброса
+        пишется раз в GAME_SNAPSHOT_INTERVAL ходов, а также если игру изменили
+        в обход журнала. Если не изменилось ничего, коммита нет.
+        Имена и тип игры меняются, только если переданы; новая игра без
+        game_type получает тип self.game_type.
+        """
+        self.game_id = game_id
         # Получаем текущее состояние из базы данных, если оно существует
         existing_state = GameState.query.get(game_id)
         
+        if existing_state and self.version is not None and existing_state.version != self.version:
+            raise StaleGameError(game_id)
+        
+        current = self.snapshot()
         if existing_state:
-            # Обновляем существующую запись
-            existing_state.deck = self.deck
-            existing_state.player_cards = self.players["player"]
-            existing_state.opponent_cards = self.players["opponent"]
-            existing_state.discard_pile = self.discard_pile
-            existing_state.current_turn = self.current_turn
-            existing_state.no_valid_moves_count = self.no_valid_moves_count
+            seq = existing_state.move_seq
+            moves = self._move_rows(game_id, seq)
+            # Изменения, не объяснимые ходами журнала, записываем в журнал целым снимком
+            if self._saved is None or replay_moves(self._saved, moves) != current:
+                moves.append(GameMove(game_id=game_id, seq=seq + len(moves) + 1, kind='snapshot', data=current,
+                                      current_turn=self.current_turn, no_valid_moves_count=self.no_valid_moves_count))
+            if moves:
+                db.session.add_all(moves)
+                existing_state.move_seq = seq = moves[-1].seq
+                if moves[-1].kind == 'snapshot' or seq - existing_state.snapshot_seq >= app.config['GAME_SNAPSHOT_INTERVAL']:
+                    # SQLAlchemy не обновит колонки, значение которых не изменилось
+                    for field, value in current.items():
+                        setattr(existing_state, field, value)
+                    existing_state.snapshot_seq = seq
+                else:
+                    existing_state.current_turn = self.current_turn
+                    existing_state.no_valid_moves_count = self.no_valid_moves_count
             
             # Проверяем, закончилась ли игра
             if len(self.players["player"]) == 0 or len(self.players["opponent"]) == 0:
@@ -216,28 +1342,814 @@ class Game:
                 existing_state.game_type = game_type
             # Всегда сохраняем значение auto_draw_cards, независимо от того, True оно или False
             existing_state.auto_draw_cards = auto_draw_cards
+            
+            if not db.session.is_modified(existing_state):
+                self.auto_draw_cards = auto_draw_cards
+                self._saved = current
+                return
+            state = existing_state
         else:
-            # Создаем новую запись
-            game_state = GameState(
+            # Создаем новую запись; журнал начинается с полного снимка
+            game_type = game_type or self.game_type
+            state = GameState(
                 id=game_id,
-                deck=self.deck,
-                player_cards=self.players["player"],
-                opponent_cards=self.players["opponent"],
-                discard_pile=self.discard_pile,
-                current_turn=self.current_turn,
                 player_name=player_name,
                 opponent_name=opponent_name,
                 game_type=game_type,
-                no_valid_moves_count=self.no_valid_moves_count,
                 game_status='waiting' if game_type == 'multiplayer' and not opponent_name else 'active',
-                auto_draw_cards=auto_draw_cards
+                auto_draw_cards=auto_draw_cards,
+                bot_strategy=self.bot_strategy,
+                seed=self.seed,
+                move_seq=1,
+                snapshot_seq=1,
+                **current
             )
-            db.session.add(game_state)
+            db.session.add(state)
+            db.session.add(GameMove(game_id=game_id, seq=1, kind='create', data=current,
+                                    current_turn=self.current_turn, no_valid_moves_count=self.no_valid_moves_count))
         
-        # Сохраняем изменения
+        # Сохраняем изменения; версию записи увеличивает SQLAlchemy (version_id_col).
+        # Версию читаем до коммита, чтобы не перечитывать запись после него
+        started = time.perf_counter()
+        try:
+            db.session.flush()
+            version = state.version
+            db.session.commit()
+        except (StaleDataError, IntegrityError):
+            # IntegrityError — другой воркер уже записал ход с тем же номером
+            db.session.rollback()
+            raise StaleGameError(game_id)
+        finally:
+            save_seconds.observe(time.perf_counter() - started)
+        self.version = version
+        self.auto_draw_cards = auto_draw_cards
+        self.pending_moves = []
+        self._saved = current
+        game_notifier.publish(game_id, version)
+
+class FirstCardBot:
+    """Первая подходящая карта в руке (Hand.playable_card)"""
+
+    def choose(self, game):
+        return game.players["opponent"].playable_card(game.discard_pile[-1])
+
+    def stats(self):
+        return {}
+
+class RolloutGame(Game):
+    """Копия позиции для разыгрывания: без журнала ходов, бот ходит первой подходящей картой"""
+    record_moves = False
+
+    def __init__(self, deck, player_cards, opponent_cards, discard_pile, rng, pass_limit):
+        self.rng = rng
+        self.deck = deck
+        self.players = {"player": player_cards, "opponent": opponent_cards}
+        self.discard_pile = discard_pile
+        self.current_turn = "player"
+        self.game_type = "bot"
+        self.no_valid_moves_count = 0
+        self.pending_moves = []
+        self.bot_strategy = 'first'
+        self.PASS_LIMIT = pass_limit
+
+class MonteCarloBot:
+    """Перебирает подходящие карты и оценивает каждую случайными доигрываниями.
+
+    Неизвестные боту карты (все, кроме его руки и сброса) раздаются в руку
+    игрока и в колоду случайно, дальше оба ходят первой подходящей картой
+    не больше depth раундов. Лучшая карта — с наибольшей долей побед бота.
+    Оценка укладывается в budget_ms: доигрывания идут по кругу по всем
+    кандидатам, пока не выйдет время. Выбор для позиции запоминается
+    (LRU на cache_size позиций). Генератор для позиции засевается ею самой,
+    поэтому выбор воспроизводим.
+    """
+
+    def __init__(self, budget_ms=50, cache_size=10000, depth=40):
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self.depth = depth
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rollouts = 0
+        self.timeouts = 0
+
+    def choose(self, game):
+        hand = game.players["opponent"]
+        top = game.discard_pile[-1]
+        candidates = [card for card in hand if is_playable_on(card, top)]
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        key = (
+            tuple(sorted(encode_cards(hand))),
+            tuple(encode_cards(game.discard_pile)),
+            len(game.players["player"]),
+            len(game.deck),
+            game.no_valid_moves_count
+        )
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return verb_registry.card(self._cache[key])
+            self.misses += 1
+        card = self.evaluate(game, candidates, random.Random(repr(key)))
+        with self._lock:
+            self._cache[key] = encode_card(card)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return card
+
+    def evaluate(self, game, candidates, rng):
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        known = set(game.players["opponent"]) | set(game.discard_pile)
+        hidden = [card for card in verb_registry.deck_template if card not in known]
+        player_size = len(game.players["player"])
+        wins = [0] * len(candidates)
+        played = [0] * len(candidates)
+        while time.perf_counter() < deadline:
+            for index, card in enumerate(candidates):
+                rng.shuffle(hidden)
+                wins[index] += self.rollout(game, card, hidden[:player_size], hidden[player_size:], rng)
+                played[index] += 1
+                if time.perf_counter() >= deadline:
+                    break
+        # Бота делят потоки BOT_WORKERS, счетчики обновляем под блокировкой один раз за ход
+        with self._lock:
+            self.rollouts += sum(played)
+            if not played[-1]:
+                self.timeouts += 1
+        if not played[-1]:
+            # Не успели оценить все карты — ход без перебора
+            if not played[0]:
+                return candidates[0]
+        scored = [(wins[index] / played[index], -index) for index in range(len(candidates)) if played[index]]
+        return candidates[-max(scored)[1]]
+
+    def rollout(self, game, card, player_cards, deck, rng):
+        """1, если бот выиграл доигрывание после хода card, 0 — если проиграл, 0.5 — ничья"""
+        opponent_cards = list(game.players["opponent"])
+        opponent_cards.remove(card)
+        if not opponent_cards:
+            return 1
+        position = RolloutGame(list(deck), list(player_cards), opponent_cards, game.discard_pile + [card],
+                               rng, game.PASS_LIMIT)
+        for _ in range(self.depth):
+            human = position.players["player"].playable_card(position.discard_pile[-1])
+            if human is not None:
+                position.play_card("player", human)
+            else:
+                position.pass_turn("player")
+                if position.current_turn == "opponent":
+                    position.bot_move()
+            if position.current_turn == "over":
+                return 0 if not position.players["player"] else 1
+        # Доигрывание не закончилось: чем меньше карт у бота относительно игрока, тем лучше
+        player_left = len(position.players["player"])
+        return player_left / (player_left + len(position.players["opponent"]))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cache_size": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "rollouts": self.rollouts,
+                "timeouts": self.timeouts
+            }
+
+BOT_STRATEGIES = {
+    'first': FirstCardBot(),
+    'montecarlo': MonteCarloBot(app.config['BOT_MOVE_BUDGET_MS'], app.config['BOT_CACHE_SIZE']),
+}
+
+def bot_strategy(name=None):
+    """Стратегия бота по имени; None — BOT_STRATEGY из конфигурации"""
+    return BOT_STRATEGIES[name or app.config['BOT_STRATEGY']]
+
+class GameRepository:
+    """Игры, загруженные в память процесса, поверх таблицы GameState.
+
+    Каждый воркер gunicorn держит свои копии игр. Перед использованием копия
+    сверяется с версией записи в базе и при расхождении загружается заново,
+    поэтому запрос может прийти в любой воркер. Изменения одной игры внутри
+    процесса выполняются под её блокировкой (см. lock). Общая блокировка
+    кэша берется только на операции со словарем: загрузка игры из базы и
+    запись вытесненной игры идут под блокировкой этой игры, чтобы промах по
+    одной игре не задерживал запросы к остальным.
+
+    Кэш ограничен: не больше max_size игр, неактивные дольше ttl секунд
+    вытесняются первыми (LRU). Просроченные игры вытесняются при каждой
+    загрузке и в фоновой архивации (см. expire), а не только при добавлении
+    новых. Игру с несохраненными изменениями перед вытеснением записывают в базу.
+    """
+
+    def __init__(self, max_size=1000, ttl=1800.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # game_id -> [игра, время последнего обращения, блокировка];
+        # порядок — от давно использованных к недавним
+        self._games = OrderedDict()
+        # Блокировка живет, пока её кто-то держит или пока игра в кэше
+        self._locks = weakref.WeakValueDictionary()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.writebacks = 0
+
+    def load(self, game_id, game_state=None):
+        """Актуальная игра по id или None, если такой игры нет в базе"""
+        self.expire()
+        if game_state is None:
+            game_state = GameState.query.get(game_id)
+        if game_state is None:
+            return None
+        game = self._current(game_id, game_state.version)
+        if game is not None:
+            return game
+        with self.lock(game_id):
+            # Пока ждали блокировку, игру мог загрузить другой поток
+            game = self._current(game_id, game_state.version)
+            if game is not None:
+                return game
+            with self._lock:
+                self.misses += 1
+            game = Game.from_state(game_state)
+            self.add(game_id, game)
+            return game
+
+    def _current(self, game_id, version):
+        """Игра из памяти, если она той же версии, что запись в базе"""
+        with self._lock:
+            game = self.get(game_id)
+            if game is None or game.version != version:
+                return None
+            self.hits += 1
+            return game
+
+    def add(self, game_id, game):
+        with self._lock:
+            self._games.pop(game_id, None)
+            # Освобождаем место до вставки, чтобы не вытеснить только что добавленную игру
+            evicted = self._evict(reserve=1)
+            self._games[game_id] = [game, time.monotonic(), self._locks.get(game_id)]
+        self._write_back(evicted)
+
+    def expire(self):
+        """Вытесняет просроченные игры и записывает в базу их несохраненные изменения"""
+        with self._lock:
+            evicted = self._evict()
+        self._write_back(evicted)
+
+    def get(self, game_id):
+        """Игра из памяти процесса без обращения к базе (может быть устаревшей)"""
+        with self._lock:
+            entry = self._games.get(game_id)
+            if entry is None:
+                return None
+            entry[1] = time.monotonic()
+            self._games.move_to_end(game_id)
+            return entry[0]
+
+    def discard(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+
+    def lock(self, game_id):
+        """Блокировка для изменения игры потоками одного процесса"""
+        with self._lock:
+            lock = self._locks.get(game_id)
+            if lock is None:
+                lock = self._locks[game_id] = threading.RLock()
+            entry = self._games.get(game_id)
+            if entry is not None:
+                entry[2] = lock
+            return lock
+
+    def _evict(self, reserve=0):
+        """Вытесняет просроченные игры, затем самые давние, пока не останется места для reserve игр.
+
+        Возвращает вытесненные игры: записать их в базу (_write_back) нужно
+        уже после освобождения общей блокировки.
+        """
+        deadline = time.monotonic() - self.ttl
+        evicted = []
+        while self._games:
+            game_id, (game, last_used, _) = next(iter(self._games.items()))
+            expired = last_used < deadline
+            if not expired and len(self._games) + reserve <= self.max_size:
+                break
+            self._games.popitem(last=False)
+            if expired:
+                self.expirations += 1
+            else:
+                self.evictions += 1
+            if game.is_dirty():
+                evicted.append((game_id, game))
+        return evicted
+
+    def _write_back(self, evicted):
+        """Записывает в базу вытесненные игры с несохраненными изменениями"""
+        for game_id, game in evicted:
+            lock = self.lock(game_id)
+            # Игру, которую сейчас меняет другой поток, сохранит он сам
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                game.save_state(game_id, game_type=game.game_type, auto_draw_cards=game.auto_draw_cards)
+                with self._lock:
+                    self.writebacks += 1
+            except StaleGameError:
+                # В базе уже более новая версия, несохраненные изменения устарели
+                db.session.rollback()
+            finally:
+                lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._games),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "writebacks": self.writebacks
+            }
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+
+    def __contains__(self, game_id):
+        return game_id in self._games
+
+    def __len__(self):
+        return len(self._games)
+
+games = GameRepository(app.config['GAME_CACHE_SIZE'], app.config['GAME_CACHE_TTL'])
+
+class WaitingRoom:
+    """Мультиплеерные игры, ожидающие второго игрока, для лобби.
+
+    Игры, созданные и занятые в этом процессе, добавляются и удаляются сразу.
+    Изменения из других воркеров подхватываются при обновлении из базы по
+    индексу ix_game_state_lobby не чаще раза в refresh_interval секунд.
+    Лобби отдается из памяти и не зависит от числа завершенных игр в таблице.
+    """
+
+    def __init__(self, refresh_interval=2.0, max_size=200):
+        self.refresh_interval = refresh_interval
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # game_id -> описание игры; порядок — от новых к старым
+        self._games = OrderedDict()
+        self._refreshed_at = None
+        # Пока идет обновление из базы — добавления и удаления из этого процесса
+        # (game_id, описание или None), которые нужно применить к новому списку
+        self._changes = None
+
+    @staticmethod
+    def entry(game_id, player_name, auto_draw_cards, created_at):
+        """Описание ожидающей игры в лобби"""
+        return {
+            "game_id": game_id,
+            "player_name": player_name,
+            "auto_draw_cards": bool(auto_draw_cards),
+            "created_at": created_at.isoformat() if created_at else None
+        }
+
+    def add(self, game_id, player_name, auto_draw_cards, created_at):
+        entry = self.entry(game_id, player_name, auto_draw_cards, created_at)
+        with self._lock:
+            self._apply(self._games, game_id, entry)
+            if self._changes is not None:
+                self._changes.append((game_id, entry))
+
+    def remove(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+            if self._changes is not None:
+                self._changes.append((game_id, None))
+
+    def _apply(self, games, game_id, entry):
+        if entry is None:
+            games.pop(game_id, None)
+            return
+        games[game_id] = entry
+        games.move_to_end(game_id, last=False)
+        while len(games) > self.max_size:
+            games.popitem()
+
+    def refresh(self, force=False):
+        """Перечитывает ожидающие игры из базы, если список устарел.
+
+        Новый список собирается без блокировки и подменяет старый целиком, так
+        что page() не видит лобби пустым или собранным наполовину.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+                return
+            self._refreshed_at = now
+            self._changes = []
+        try:
+            rows = db.session.query(
+                GameState.id, GameState.player_name, GameState.auto_draw_cards, GameState.created_at
+            ).filter(
+                GameState.game_type == 'multiplayer',
+                GameState.game_status == 'waiting'
+            ).order_by(GameState.created_at.desc()).limit(self.max_size).all()
+            games = OrderedDict((row.id, self.entry(*row)) for row in rows)
+            with self._lock:
+                for game_id, entry in self._changes:
+                    self._apply(games, game_id, entry)
+                self._games = games
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def page(self, offset, limit):
+        with self._lock:
+            return list(islice(self._games.values(), offset, offset + limit)), len(self._games)
+
+    def __contains__(self, game_id):
+        with self._lock:
+            return game_id in self._games
+
+    def __len__(self):
+        with self._lock:
+            return len(self._games)
+
+waiting_room = WaitingRoom(app.config['LOBBY_REFRESH'], app.config['LOBBY_SIZE'])
+
+class BotMoveExecutor:
+    """Ходы бота вне запроса игрока.
+
+    Запрос игрока сохраняет его ход и ставит игру в очередь; поток пула берет
+    блокировку игры, делает ход бота и сохраняет его. Новая версия игры
+    публикуется через game_notifier, и клиент получает ход бота по /events или
+    длинному опросу /state. Поэтому время ответа /play не зависит от того,
+    сколько думает бот. Игра, уже стоящая в очереди, второй раз не ставится.
+
+    С workers=0 ход бота делается сразу в потоке вызывающего.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bot') if workers > 0 else None
+        self._condition = threading.Condition()
+        # Игры, ждущие свободного потока
+        self._queued = set()
+        # Поставлено в очередь и еще не выполнено
+        self._active = 0
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def asynchronous(self):
+        return self._pool is not None
+
+    def submit(self, game_id):
+        """Ставит ход бота в игре game_id в очередь (или делает его сразу без пула)"""
+        if not self.asynchronous:
+            return self.run(game_id)
+        with self._condition:
+            if game_id in self._queued:
+                self.coalesced += 1
+                return None
+            self._queued.add(game_id)
+            self._active += 1
+            self.submitted += 1
+        self._pool.submit(self._run_queued, game_id)
+        return None
+
+    def _run_queued(self, game_id):
+        # Убираем из очереди до хода: ход игрока, пришедший во время хода бота,
+        # снова поставит игру в очередь
+        with self._condition:
+            self._queued.discard(game_id)
+        failed = False
+        with app.app_context():
+            try:
+                self.run(game_id)
+            except Exception:
+                failed = True
+                db.session.rollback()
+                games.discard(game_id)
+                game_log.exception("Ошибка хода бота", game_id)
+            finally:
+                db.session.remove()
+        with self._condition:
+            self._active -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self._condition.notify_all()
+
+    def run(self, game_id):
+        """Делает ход бота, если сейчас его очередь. Возвращает сообщение хода или None.
+
+        Стратегия думает без блокировки игры, чтобы /state и /events не ждали
+        бота: пока ход за ботом, игру никто не меняет, а новая версия в базе
+        загружается в другой объект. Ход применяется под блокировкой, только
+        если игра осталась той же.
+        """
+        with games.lock(game_id):
+            # Тип игры берем из свежей записи в базе, а не из того, что видел вызвавший
+            game_state = GameState.query.get(game_id)
+            if game_state is None or game_state.game_type != "bot":
+                return None
+            game = games.load(game_id, game_state)
+            if game.current_turn != "opponent":
+                return None
+            version = game.version
+        card = game.choose_bot_card()
+        with games.lock(game_id):
+            if games.load(game_id) is not game or game.version != version:
+                # Игру успели изменить — ставим ход заново по свежему состоянию
+                return self.submit(game_id) if self.asynchronous else self.run(game_id)
+            bot_success, bot_message = game.apply_bot_move(card)
+            game.save_state(game_id, auto_draw_cards=game.auto_draw_cards)
+            return bot_message
+
+    def wait(self, timeout=None):
+        """Ждет, пока очередь опустеет. False, если не дождались за timeout секунд"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._active == 0, timeout)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "completed": self.completed,
+                "failed": self.failed
+            }
+
+bot_moves = BotMoveExecutor(app.config['BOT_WORKERS'])
+
+# Состояние игры с точки зрения игрока, уже сериализованное в JSON
+StateView = namedtuple('StateView', 'version body finished')
+
+class StateViewCache:
+    """Готовые ответы /state и /events по играм и местам игроков.
+
+    Ответ зависит только от версии игры, имени игрока и формата карточек,
+    поэтому сериализованное состояние хранится до следующей версии игры:
+    опросы без изменений не загружают игру и не собирают ответ заново.
+    Одинаковые запросы, пришедшие одновременно, ждут одного вычисления.
+    Хранятся ответы не больше чем для max_size игр (LRU).
+    """
+
+    def __init__(self, max_size=2000):
+        self.max_size = max_size
+        # game_id -> {(player_name, card_format): StateView}; только последняя версия игры
+        self._games = OrderedDict()
+        # (game_id, version, player_name, card_format) -> Future идущего вычисления
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, game_id, version, player_name, card_format, build):
+        """Ответ для версии version игры; при промахе его считает build().
+
+        version=None — ответ из кэша не подходит (опрос сам изменит игру).
+        build возвращает StateView, возможно более новой версии, или None,
+        если игры нет.
+        """
+        seat = (player_name, card_format)
+        key = (game_id, version) + seat
+        with self._lock:
+            view = self._games.get(game_id, {}).get(seat)
+            if view is not None and version is not None and view.version == version:
+                self._games.move_to_end(game_id)
+                self.hits += 1
+                return view
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Future()
+                self.misses += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            return flight.result()
+        try:
+            view = build()
+        except BaseException as error:
+            with self._lock:
+                del self._flights[key]
+            flight.set_exception(error)
+            raise
+        with self._lock:
+            del self._flights[key]
+            if view is not None:
+                self._store(game_id, seat, view)
+        flight.set_result(view)
+        return view
+
+    def _store(self, game_id, seat, view):
+        # Ответы для прежних версий игры больше не понадобятся
+        views = {other: stored for other, stored in self._games.pop(game_id, {}).items()
+                 if stored.version >= view.version}
+        views.setdefault(seat, view)
+        self._games[game_id] = views
+        while len(self._games) > self.max_size:
+            self._games.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._games),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions
+            }
+
+state_views = StateViewCache(app.config['STATE_CACHE_SIZE'])
+
+def row_size(row):
+    """Примерный объем данных строки в байтах (JSON-колонки — по длине сериализации)"""
+    size = 0
+    for column in row.__table__.columns:
+        value = getattr(row, column.key)
+        if value is None:
+            continue
+        if isinstance(value, (list, dict)):
+            size += len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        else:
+            size += len(str(value).encode('utf-8'))
+    return size
+
+def archive_games(batch_size=500):
+    """Переносит завершенные и брошенные ожидающие игры из game_state в game_archive.
+
+    Завершенная игра архивируется через FINISHED_GAME_GRACE секунд после
+    последнего хода, мультиплеерная игра без второго игрока — через
+    WAITING_GAME_TTL секунд после создания (тогда же удаляются билеты
+    подбора, так и не дождавшиеся соперника). Возвращает число
+    заархивированных игр, удаленных строк и освобожденных байт.
+    """
+    now = utcnow()
+    waiting_cutoff = now - timedelta(seconds=app.config['WAITING_GAME_TTL'])
+    finished_cutoff = now - timedelta(seconds=app.config['FINISHED_GAME_GRACE'])
+    report = {"finished": 0, "expired": 0, "rows": 0, "bytes": 0}
+
+    candidates = GameState.query.filter(db.or_(
+        GameState.game_status == 'finished',
+        db.and_(
+            GameState.game_type == 'multiplayer',
+            GameState.game_status == 'waiting',
+            db.or_(GameState.created_at.is_(None), GameState.created_at < waiting_cutoff)
+        )
+    )).limit(batch_size).all()
+    moves_by_game = {}
+    if candidates:
+        for move in GameMove.query.filter(
+            GameMove.game_id.in_([game_state.id for game_state in candidates])
+        ).order_by(GameMove.game_id, GameMove.seq):
+            moves_by_game.setdefault(move.game_id, []).append(move)
+
+    archived_ids = []
+    for game_state in candidates:
+        moves = moves_by_game.get(game_state.id, [])
+        if game_state.game_status == 'finished':
+            if moves and moves[-1].created_at and moves[-1].created_at > finished_cutoff:
+                continue  # Игроки еще могут смотреть итог
+            game = Game.from_state(game_state, [move for move in moves if move.seq > game_state.snapshot_seq])
+            outcome = 'player' if not game.players["player"] else 'opponent'
+            report["finished"] += 1
+        else:
+            outcome = 'expired'
+            report["expired"] += 1
+        archive = GameArchive(
+            id=game_state.id,
+            player_name=game_state.player_name,
+            opponent_name=game_state.opponent_name,
+            game_type=game_state.game_type,
+            outcome=outcome,
+            moves=[[move.seq, move.kind, move.actor, move.card, move.data, move.current_turn,
+                    move.no_valid_moves_count] for move in moves],
+            created_at=game_state.created_at,
+            archived_at=now
+        )
+        db.session.add(archive)
+        report["bytes"] += row_size(game_state) + sum(row_size(move) for move in moves) - row_size(archive)
+        report["rows"] += 1 + len(moves)
+        db.session.delete(game_state)
+        archived_ids.append(game_state.id)
+
+    if archived_ids:
+        db.session.execute(db.delete(GameMove).where(GameMove.game_id.in_(archived_ids)),
+                           execution_options={"synchronize_session": False})
+    tickets = db.session.execute(db.delete(MatchTicket).where(db.or_(
+        MatchTicket.game_id.in_(archived_ids),
+        MatchTicket.created_at < waiting_cutoff
+    )), execution_options={"synchronize_session": False})
+    report["rows"] += tickets.rowcount
+    try:
         db.session.commit()
+    except (StaleDataError, IntegrityError):
+        # Игру успел изменить или заархивировать другой запрос — повторим в следующий раз
+        db.session.rollback()
+        return {"finished": 0, "expired": 0, "rows": 0, "bytes": 0}
+
+    for game_id in archived_ids:
+        games.discard(game_id)
+        waiting_room.remove(game_id)
+    return report
+
+# Итоги архивации с момента запуска процесса (см. /health)
+archive_stats = {"runs": 0, "finished": 0, "expired": 0, "rows": 0, "bytes": 0}
+
+def run_archiver(interval):
+    """Фоновый поток: раз в interval секунд архивирует игры пачками, пока есть что архивировать"""
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                # Воркер без новых запросов тоже сохраняет и вытесняет просроченные игры
+                games.expire()
+                while True:
+                    report = archive_games()
+                    archive_stats["runs"] += 1
+                    for key, value in report.items():
+                        archive_stats[key] += value
+                    if report["finished"] + report["expired"] == 0:
+                        break
+                    game_log.info("Архивация", **report)
+            except Exception:
+                db.session.rollback()
+                game_log.exception("Ошибка архивации")
+            finally:
+                db.session.remove()
+
+@app.cli.command('archive-games')
+def archive_games_command():
+    """Однократная архивация завершенных и брошенных игр"""
+    total = {"finished": 0, "expired": 0, "rows": 0, "bytes": 0}
+    while True:
+        report = archive_games()
+        for key, value in report.items():
+            total[key] += value
+        if report["finished"] + report["expired"] == 0:
+            break
+    print(f"Заархивировано {total['finished']} завершенных и {total['expired']} брошенных игр, "
+          f"удалено {total['rows']} строк, освобождено {total['bytes']} байт")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Число запросов к базе и их суммарное время (см. record_query_time)
+    g.db_timing = [0, 0.0]
 
-games = {}
+@app.after_request
+def record_request_metrics(response):
+    """Время запроса по маршруту. Для потоков SSE — время до начала ответа"""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.endpoint or 'unknown'
+        request_seconds.observe(time.perf_counter() - started, route, request.method)
+        request_total.inc(route, request.method, response.status_code)
+        queries, db_seconds = g.db_timing
+        request_queries.observe(queries, route)
+        request_db_seconds.observe(db_seconds, route)
+    return response
+
+def locked_game(view):
+    """Выполняет обработчик маршрута под блокировкой игры game_id"""
+    @functools.wraps(view)
+    def wrapper(game_id, *args, **kwargs):
+        with games.lock(game_id):
+            return view(game_id, *args, **kwargs)
+    return wrapper
+
+@app.errorhandler(StaleGameError)
+def handle_stale_game(error):
+    """Параллельный запрос успел изменить игру: просим клиента повторить действие"""
+    db.session.rollback()
+    games.discard(error.args[0])
+    return jsonify({"success": False, "message": "Состояние игры изменилось, попробуйте еще раз"})
 
 @app.route("/game/new", methods=["POST"])
 def create_new_game():
@@ -245,30 +2157,134 @@ def create_new_game():
     player_name = data.get('player_name')
     game_type = data.get('game_type', 'bot')  # по умолчанию игра с ботом
     auto_draw_cards = data.get('auto_draw_cards', False)  # По умолчанию не добирать карты автоматически
+    strategy = data.get('bot_strategy')
+    # seed — сыграть партию с той же раздачей и тем же генератором, что и раньше
+    seed = data.get('seed')
     
     if not player_name:
         return jsonify({"success": False, "message": "Имя игрока обязательно"})
     if player_name.lower() == 'bot':
         return jsonify({"success": False, "message": "Имя 'bot' зарезервировано"})
+    if strategy is not None and strategy not in BOT_STRATEGIES:
+        return jsonify({"success": False, "message": "Неизвестная стратегия бота"})
+    if seed is not None and parse_seed(seed) is None:
+        return jsonify({"success": False, "message": "Сид должен быть целым числом от 0 до 2**63 - 1"})
     
     game_id = shortuuid.uuid()[:8]
-    games[game_id] = Game()
-    games[game_id].game_type = game_type
+    game = Game(seed=seed)
+    game.game_type = game_type
+    game.bot_strategy = strategy
     
     # Явно гарантируем, что в игре с ботом первый ход за игроком
     if game_type == 'bot':
-        games[game_id].current_turn = "player"
+        game.current_turn = "player"
     
-    games[game_id].save_state(game_id, player_name, game_type=game_type, auto_draw_cards=auto_draw_cards)
+    game.save_state(game_id, player_name, game_type=game_type, auto_draw_cards=auto_draw_cards)
+    games.add(game_id, game)
+    if game_type == 'multiplayer':
+        waiting_room.add(game_id, player_name, auto_draw_cards, utcnow())
     
     return jsonify({
         "success": True, 
         "game_id": game_id,
         "game_type": game_type,
-        "auto_draw_cards": auto_draw_cards
+        "auto_draw_cards": auto_draw_cards,
+        "seed": game.seed
     })
 
+def claim_match(player_name, game_id):
+    """Забирает из очереди самый давний чужой билет, отдавая его игре game_id.
+
+    Поиск и захват — один UPDATE, поэтому билет не достанется двум запросам.
+    Возвращает захваченный билет или None, если очередь пуста.
+    """
+    head = db.select(MatchTicket.id).where(
+        MatchTicket.game_id.is_(None),
+        MatchTicket.player_name != player_name
+    ).order_by(MatchTicket.id).limit(1).scalar_subquery()
+    result = db.session.execute(
+        db.update(MatchTicket).where(MatchTicket.id == head, MatchTicket.game_id.is_(None)).values(game_id=game_id),
+        execution_options={"synchronize_session": False}
+    )
+    if result.rowcount == 0:
+        return None
+    return MatchTicket.query.filter_by(game_id=game_id).one()
+
+@app.route("/game/matchmake", methods=["POST"])
+def matchmake():
+    """Подбор соперника: пара с самым давним игроком из очереди или постановка в очередь.
+
+    Ожидающий игрок узнает о найденной игре через GET /game/matchmake/<ticket>.
+    В SQLite первый UPDATE транзакции берет блокировку базы на запись до
+    коммита, поэтому поиск соперника и постановка в очередь атомарны и между
+    воркерами: два одновременно пришедших игрока не окажутся оба в очереди.
+    """
+    data = request.json
+    player_name = data.get('player_name')
+    auto_draw_cards = data.get('auto_draw_cards', False)
+    
+    if not player_name:
+        return jsonify({"success": False, "message": "Имя игрока обязательно"})
+    if player_name.lower() == 'bot':
+        return jsonify({"success": False, "message": "Имя 'bot' зарезервировано"})
+    
+    game_id = shortuuid.uuid()[:8]
+    ticket = claim_match(player_name, game_id)
+    if ticket is None:
+        # Соперника нет — встаем в очередь (повторный запрос возвращает тот же билет)
+        ticket = MatchTicket.query.filter_by(player_name=player_name, game_id=None).first()
+        if ticket is None:
+            ticket = MatchTicket(player_name=player_name, auto_draw_cards=auto_draw_cards)
+            db.session.add(ticket)
+        db.session.commit()
+        return jsonify({"success": True, "status": "queued", "ticket": ticket.id})
+    
+    # Первым ходит тот, кто дольше ждал в очереди
+    game = Game()
+    game.game_type = 'multiplayer'
+    game.save_state(game_id, ticket.player_name, player_name, game_type='multiplayer',
+                    auto_draw_cards=ticket.auto_draw_cards)
+    games.add(game_id, game)
+    
+    return jsonify({
+        "success": True,
+        "status": "matched",
+        "game_id": game_id,
+        "game_type": 'multiplayer',
+        "opponent_name": ticket.player_name,
+        "auto_draw_cards": ticket.auto_draw_cards
+    })
+
+@app.route("/game/matchmake/<int:ticket_id>", methods=["GET"])
+def matchmake_status(ticket_id):
+    """Состояние билета в очереди подбора соперника"""
+    ticket = MatchTicket.query.get(ticket_id)
+    if ticket is None:
+        return jsonify({"success": False, "message": "Билет не найден"})
+    if ticket.game_id is None:
+        return jsonify({"success": True, "status": "queued", "ticket": ticket.id})
+    return jsonify({
+        "success": True,
+        "status": "matched",
+        "game_id": ticket.game_id,
+        "game_type": 'multiplayer',
+        "auto_draw_cards": ticket.auto_draw_cards
+    })
+
+@app.route("/game/matchmake/<int:ticket_id>", methods=["DELETE"])
+def leave_matchmaking(ticket_id):
+    """Выход из очереди, пока соперник не найден"""
+    result = db.session.execute(
+        db.delete(MatchTicket).where(MatchTicket.id == ticket_id, MatchTicket.game_id.is_(None)),
+        execution_options={"synchronize_session": False}
+    )
+    db.session.commit()
+    if result.rowcount == 0:
+        return jsonify({"success": False, "message": "Билет не найден или соперник уже найден"})
+    return jsonify({"success": True})
+
 @app.route("/game/<game_id>/join", methods=["POST"])
+@locked_game
 def join_game(game_id):
     data = request.json
     player_name = data.get('player_name')
@@ -294,7 +2310,17 @@ def join_game(game_id):
     if not game_state.opponent_name:
         game_state.opponent_name = player_name
         game_state.game_status = 'active'
-        db.session.commit()
+        game_state.move_seq += 1
+        db.session.add(GameMove(game_id=game_id, seq=game_state.move_seq, kind='join', actor='opponent',
+                                data={"player_name": player_name}, current_turn=game_state.current_turn,
+                                no_valid_moves_count=game_state.no_valid_moves_count))
+        try:
+            db.session.commit()
+        except (StaleDataError, IntegrityError):
+            # Другой воркер успел изменить игру или записать ход с тем же номером
+            raise StaleGameError(game_id)
+        waiting_room.remove(game_id)
+        game_notifier.publish(game_id, game_state.version)
     
     return jsonify({
         "success": True,
@@ -303,37 +2329,118 @@ def join_game(game_id):
         "auto_draw_cards": game_state.auto_draw_cards
     })
 
-@app.route("/game/<game_id>/state", methods=["GET"])
-def get_game_state(game_id):
-    player_name = request.args.get('player_name')
-    if not player_name:
-        return jsonify({"success": False, "message": "Не указано имя игрока"})
+@app.route("/game/lobby", methods=["GET"])
+def game_lobby():
+    """Мультиплеерные игры, ожидающие второго игрока, от новых к старым"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    waiting_room.refresh()
+    lobby, total = waiting_room.page((page - 1) * per_page, per_page)
+    return jsonify({
+        "success": True,
+        "games": lobby,
+        "page": page,
+        "per_page": per_page,
+        "total": total
+    })
 
-    if game_id not in games:
-        games[game_id] = Game(game_id)
-    
-    game = games[game_id]
+def state_etag(version, player_name, card_format):
+    """ETag ответа /state: версия игры плюс место игрока и формат карточек"""
+    view = hashlib.sha1(f"{player_name}|{card_format or ''}".encode('utf-8')).hexdigest()[:8]
+    return f"{version}-{view}"
+
+def state_response(body, etag):
+    response = app.response_class(body, mimetype=app.json.mimetype)
+    response.set_etag(etag)
+    # Клиент может хранить ответ, но обязан перепроверять его по ETag
+    response.cache_control.no_cache = True
+    return response
+
+def auto_draw_pending(game_id, version, game_type, current_turn, auto_draw_cards):
+    """Будет ли при опросе автоматически взята карта (тогда 304 отдавать нельзя)"""
+    if game_type != 'bot' or current_turn != 'player' or not auto_draw_cards:
+        return False
+    game = games.get(game_id)
+    return game is None or game.version != version or not game.check_if_playable()
+
+def read_state_header(game_id):
+    """Версия и служебные поля игры без загрузки колоды и рук (None, если игры нет)"""
+    return db.session.query(
+        GameState.version, GameState.game_type, GameState.current_turn, GameState.auto_draw_cards
+    ).filter_by(id=game_id).first()
+
+def wait_for_version(game_id, since, timeout):
+    """Длинный опрос: ждет версию игры больше since не дольше timeout секунд.
+
+    Возвращает свежий заголовок игры (см. read_state_header). Ожидание
+    прерывается сразу, если при опросе будет выполнен автоматический добор.
+    """
+    deadline = time.monotonic() + timeout
+    recheck = app.config['STATE_RECHECK']
+    header = read_state_header(game_id)
+    while header is not None and header.version <= since and not auto_draw_pending(game_id, *header):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # Не держим соединение с базой, пока ждем
+        db.session.remove()
+        game_notifier.wait(game_id, since, min(recheck, remaining))
+        header = read_state_header(game_id)
+    return header
+
+def build_state_view(game_id, player_name, card_format=None):
+    """Состояние игры с точки зрения игрока player_name (None, если игры нет).
+
+    Общая часть для /state, /events и длинного опроса. Для игры с ботом здесь
+    же выполняется автоматический добор карты, если он включен.
+    """
+    with games.lock(game_id):
+        return _build_state_view(game_id, player_name, card_format)
+
+def serialize_state_view(state):
+    if state is None:
+        return None
+    finished = bool(state.get("game_over")) or state.get("game_status") == 'finished'
+    return StateView(state["version"], app.json.dumps(state), finished)
+
+def cached_state_view(game_id, header, player_name, card_format=None, pending=False):
+    """Сериализованное состояние игры для игрока (None, если игры нет); см. StateViewCache.
+
+    header — заголовок игры из read_state_header, pending — будет ли при
+    опросе автоматический добор (тогда ответ считается заново).
+    """
+    view = state_views.get(game_id, None if pending else header.version, player_name, card_format,
+                           lambda: serialize_state_view(build_state_view(game_id, player_name, card_format)))
+    # Ответ из кэша не ставит ход бота в очередь, как _build_state_view
+    if header.game_type == 'bot' and header.current_turn == 'opponent' and bot_moves.asynchronous:
+        bot_moves.submit(game_id)
+    return view
+
+def _build_state_view(game_id, player_name, card_format):
     game_state = GameState.query.get(game_id)
-    
-    # Отладка
-    print(f"Получен запрос состояния игры: {game_id}, игрок: {player_name}, текущий ход: {game.current_turn}")
+    if game_state is None:
+        return None
+    game = games.load(game_id, game_state)
+    game_log.debug("Запрос состояния", game_id, player=player_name, turn=game.current_turn)
     
     # Для мультиплеерной игры
-    if game_state and game_state.game_type == 'multiplayer':
+    if game_state.game_type == 'multiplayer':
         if game_state.game_status == 'waiting':
-            return jsonify({
+            return {
                 "status": "waiting",
-                "message": "Ожидание подключения второго игрока..."
-            })
+                "message": "Ожидание подключения второго игрока...",
+                "version": game_state.version
+            }
         
         # Определяем, является ли текущий игрок первым или вторым игроком
         is_first_player = game_state.player_name == player_name
         
         # Формируем состояние игры с точки зрения текущего игрока
-        # Используем глубокие копии для предотвращения случайных изменений
-        player_cards = game_state.player_cards.copy() if is_first_player else game_state.opponent_cards.copy()
-        opponent_cards = game_state.opponent_cards.copy() if is_first_player else game_state.player_cards.copy()
-        discard_pile = game_state.discard_pile.copy() if game_state.discard_pile else []
+        first_cards = game.players["player"]
+        second_cards = game.players["opponent"]
+        player_cards = list(first_cards if is_first_player else second_cards)
+        opponent_cards = second_cards if is_first_player else first_cards
+        discard_pile = game.discard_pile
         
         # Проверка на случай, если сброс пуст
         top_card = discard_pile[-1] if discard_pile else None
@@ -349,44 +2456,152 @@ def get_game_state(game_id):
             "opponent_name": game_state.opponent_name if is_first_player else game_state.player_name,
             "is_my_turn": (game_state.current_turn == "player" and is_first_player) or 
                         (game_state.current_turn == "opponent" and not is_first_player),
-            "auto_draw_cards": game_state.auto_draw_cards
-        }
-        
-        # Обновляем состояние игры в памяти
-        game.players = {
-            "player": game_state.player_cards.copy(),
-            "opponent": game_state.opponent_cards.copy()
+            "auto_draw_cards": game_state.auto_draw_cards,
+            "version": game_state.version
         }
-        game.discard_pile = discard_pile
-        game.current_turn = game_state.current_turn
-        game.no_valid_moves_count = game_state.no_valid_moves_count
         
-        return jsonify(state)
+        return format_state_cards(state, card_format)
     
     # Для игры с ботом
     if game.game_type == 'bot':
-        # Отладка
-        print(f"Игра с ботом, ход: {game.current_turn}")
-        
         # Проверяем возможность хода игрока и настройку автоматического добора карт
         if game.current_turn == "player" and not game.check_if_playable() and game_state.auto_draw_cards:
-            print("У игрока нет возможности сделать ход, берет карту автоматически")
+            game_log.debug("Автоматический добор карты игроком", game_id)
             game.pull_one_more_card("player")
-            bot_success, bot_message = game.bot_move()
+            if not bot_moves.asynchronous:
+                game.bot_move()
             game.save_state(game_id, auto_draw_cards=game_state.auto_draw_cards)
         
+        # Ход бота делает фоновый пул; очередь бота здесь значит, что его ход
+        # еще не сделан (или потерян при перезапуске процесса) — ставим снова
+        if game.current_turn == "opponent" and bot_moves.asynchronous:
+            bot_moves.submit(game_id)
+        
         state = game.get_state()
         state["auto_draw_cards"] = game_state.auto_draw_cards
-        print(f"Возвращаемое состояние: {state}")
-        return jsonify(state)
+        state["version"] = game_state.version
+        if game_log.enabled(logging.DEBUG, game_id):
+            game_log.debug("Состояние отправлено", game_id, version=state["version"], turn=state["current_turn"],
+                           player_cards=list(state["player_cards"]), discard_pile=state["discard_pile"],
+                           opponent_cards_count=state["opponent_cards_count"])
+        return format_state_cards(state, card_format)
         
     # Сохраняем состояние для обычной игры (не с ботом)
     game.save_state(game_id, auto_draw_cards=game_state.auto_draw_cards)
-    return jsonify(game.get_state())
+    state = game.get_state()
+    state["version"] = game_state.version
+    return format_state_cards(state, card_format)
+
+@app.route("/game/<game_id>/state", methods=["GET"])
+def get_game_state(game_id):
+    player_name = request.args.get('player_name')
+    if not player_name:
+        return jsonify({"success": False, "message": "Не указано имя игрока"})
+    # cards=ids — вместо карточек отдаем их номера (см. /verbs/catalog)
+    card_format = request.args.get('cards')
+    # since=<версия>&wait=<секунды> — длинный опрос до изменения версии
+    since = request.args.get('since', type=int)
+    wait = min(request.args.get('wait', 0, type=float), app.config['LONG_POLL_MAX_WAIT'])
+
+    # Условный запрос: сначала читаем только версию, без колоды и рук
+    # Если ждущих опросов уже LONG_POLL_MAX_WAITERS, отвечаем без ожидания
+    # (304 с Retry-After: клиент повторит опрос позже)
+    throttled = False
+    if since is not None and wait > 0:
+        throttled = not long_poll_slots.acquire()
+    if since is not None and wait > 0 and not throttled:
+        try:
+            header = wait_for_version(game_id, since, wait)
+        finally:
+            long_poll_slots.release()
+    else:
+        header = read_state_header(game_id)
+    if header is None:
+        return jsonify({"success": False, "message": "Игра не найдена"})
+    etag = state_etag(header.version, player_name, card_format)
+    pending = auto_draw_pending(game_id, *header)
+    if not pending and (request.if_none_match.contains(etag) or (since is not None and header.version <= since)):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        if throttled:
+            response.headers['Retry-After'] = '2'
+        return response
+
+    view = cached_state_view(game_id, header, player_name, card_format, pending)
+    if view is None:
+        return jsonify({"success": False, "message": "Игра не найдена"})
+    return state_response(view.body, state_etag(view.version, player_name, card_format))
+
+@app.route("/game/<game_id>/events", methods=["GET"])
+def game_events(game_id):
+    """Поток Server-Sent Events: новое состояние игры после каждого изменения.
+
+    Пока игра не меняется, раз в SSE_HEARTBEAT секунд уходит комментарий-пульс,
+    а версия в базе перечитывается раз в STATE_RECHECK секунд.
+    Поток закрывается через SSE_MAX_AGE секунд (браузер переподключится сам,
+    передав Last-Event-ID) и после окончания игры — тогда отправляется событие end.
+    Если открыто SSE_MAX_STREAMS потоков, отвечаем 503: клиент переходит на опрос /state.
+    """
+    player_name = request.args.get('player_name')
+    if not player_name:
+        return jsonify({"success": False, "message": "Не указано имя игрока"})
+    card_format = request.args.get('cards')
+    if read_state_header(game_id) is None:
+        return jsonify({"success": False, "message": "Игра не найдена"})
+
+    heartbeat = app.config['SSE_HEARTBEAT']
+    max_age = app.config['SSE_MAX_AGE']
+    recheck = app.config['STATE_RECHECK']
+    if not sse_slots.acquire():
+        response = jsonify({"success": False, "message": "Слишком много открытых потоков, используйте опрос"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    try:
+        last_version = int(request.headers.get('Last-Event-ID', -1))
+    except ValueError:
+        last_version = -1
+
+    def watch():
+        version = last_version
+        opened_at = last_sent = time.monotonic()
+        # Совет браузеру, через сколько миллисекунд переподключаться
+        yield "retry: 2000\n\n"
+        while time.monotonic() - opened_at < max_age:
+            header = read_state_header(game_id)
+            if header is None:
+                break
+            pending = auto_draw_pending(game_id, *header)
+            if header.version > version or pending:
+                view = cached_state_view(game_id, header, player_name, card_format, pending)
+                if view is None:
+                    break
+                version = view.version
+                last_sent = time.monotonic()
+                yield f"id: {version}\nevent: state\ndata: {view.body}\n\n"
+                if view.finished:
+                    yield "event: end\ndata: {}\n\n"
+                    break
+            # Не держим соединение с базой и старые объекты сессии, пока ждем
+            db.session.remove()
+            if time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield ": heartbeat\n\n"
+            game_notifier.wait(game_id, version, min(recheck, heartbeat))
+
+    response = app.response_class(stream_with_context(watch()), mimetype='text/event-stream')
+    # Место освобождается, когда сервер закрывает ответ, даже если поток не начинался
+    response.call_on_close(sse_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Отключаем буферизацию ответа в nginx
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route("/game/<game_id>/play", methods=["POST"])
+@locked_game
 def play_card(game_id):
-    if game_id not in games:
+    game_state = GameState.query.get(game_id)
+    if game_state is None:
         return jsonify({"success": False, "message": "Игра не найдена!"})
     
     data = request.json
@@ -394,8 +2609,7 @@ def play_card(game_id):
     if not player_name:
         return jsonify({"success": False, "message": "Не указано имя игрока"})
     
-    game = games[game_id]
-    game_state = GameState.query.get(game_id)
+    game = games.load(game_id, game_state)
     
     # Определяем, является ли текущий игрок первым или вторым игроком
     is_first_player = game_state.player_name == player_name
@@ -405,50 +2619,24 @@ def play_card(game_id):
     if game_state.current_turn != current_role:
         return jsonify({"success": False, "message": "Сейчас не ваш ход!"})
     
+    # Карточка приходит номером или списком (форма, инфинитив, индекс формы, перевод)
+    received_card = parse_card(data.get("card"))
+    if received_card is None:
+        return jsonify({"success": False, "message": "У вас нет такой карты!"})
+    
     # Для мультиплеерной игры
     if game_state.game_type == 'multiplayer':
-        # Получаем карты текущего игрока
-        player_cards = game_state.player_cards.copy() if is_first_player else game_state.opponent_cards.copy()
-        received_card = data["card"]
-        
-        # Преобразуем полученную карту в тот же формат, который используется в БД
-        received_card = [str(received_card[0]), str(received_card[1]), int(received_card[2]), str(received_card[3])]
+        # Карты текущего игрока (игра в памяти сверена с базой по версии)
+        player_cards = game.players[current_role]
         
         # Ищем соответствующую карту в руке игрока
-        card_found = False
-        card_index = -1
-        
-        for i, card in enumerate(player_cards):
-            # Убедимся, что типы данных в карте совпадают
-            card_check = [str(card[0]), str(card[1]), int(card[2]), str(card[3])]
-            
-            if (card_check[0] == received_card[0] and 
-                card_check[1] == received_card[1] and 
-                card_check[2] == received_card[2] and 
-                card_check[3] == received_card[3]):
-                card_found = True
-                card_index = i
-                break
-        
-        if not card_found:
+        if received_card not in player_cards:
             return jsonify({"success": False, "message": "У вас нет такой карты!"})
         
         # Проверяем, можно ли сыграть эту карту
-        top_card = game_state.discard_pile[-1]
-        top_card_check = [str(top_card[0]), str(top_card[1]), int(top_card[2]), str(top_card[3])]
-        
-        if received_card[2] == top_card_check[2] or received_card[1] == top_card_check[1]:
-            # Удаляем карту из руки игрока
-            played_card = player_cards.pop(card_index)
-            
-            # Обновляем состояние игры в памяти
-            if is_first_player:
-                game.players["player"] = player_cards
-            else:
-                game.players["opponent"] = player_cards
-            
-            # Добавляем карту в сброс
-            game.discard_pile.append(played_card)
+        if is_playable_on(received_card, game.discard_pile[-1]):
+            # Перекладываем карту из руки игрока в сброс
+            game.discard_card(current_role, received_card)
             
             # Меняем ход
             game.current_turn = "opponent" if game.current_turn == "player" else "player"
@@ -460,18 +2648,22 @@ def play_card(game_id):
             return jsonify({"success": True, "message": "Карта успешно сыграна"})
         return jsonify({"success": False, "message": "Недопустимый ход!"})
     
-    # Для игры с ботом
-    success, message = game.play_card("player", tuple(data["card"]))
+    # Для игры с ботом: при фоновом пуле ответ бота не ждем
+    success, message = game.play_card("player", received_card, bot_reply=not bot_moves.asynchronous)
     if success:
         # Сохраняем текущее значение auto_draw_cards
         game.save_state(game_id, auto_draw_cards=game_state.auto_draw_cards)
+        if game.current_turn == "opponent":
+            bot_moves.submit(game_id)
         return jsonify({"success": success, "message": message})
     return jsonify({"success": success, "message": message})
 
 @app.route("/game/<game_id>/draw", methods=["POST"])
+@locked_game
 def draw_card(game_id):
     """Маршрут для случая, когда игрок не может сделать ход и хочет взять карту"""
-    if game_id not in games:
+    game_state = GameState.query.get(game_id)
+    if game_state is None:
         return jsonify({"success": False, "message": "Игра не найдена!"})
     
     data = request.json
@@ -479,8 +2671,7 @@ def draw_card(game_id):
     if not player_name:
         return jsonify({"success": False, "message": "Не указано имя игрока"})
     
-    game = games[game_id]
-    game_state = GameState.query.get(game_id)
+    game = games.load(game_id, game_state)
     
     # Определяем, является ли текущий игрок первым или вторым игроком
     is_first_player = game_state.player_name == player_name
@@ -491,69 +2682,74 @@ def draw_card(game_id):
         return jsonify({"success": False, "message": "Сейчас не ваш ход!"})
     
     # Проверяем, действительно ли у игрока нет возможности сделать ход
-    player_cards = game_state.player_cards.copy() if is_first_player else game_state.opponent_cards.copy()
-    top_card = game_state.discard_pile[-1]
-    
-    # Проверяем все карты игрока
-    has_valid_move = False
-    for card in player_cards:
-        if card[2] == top_card[2] or card[1] == top_card[1]:
-            has_valid_move = True
-            break
-    
-    if has_valid_move:
+    if game.check_if_playable(current_role):
         return jsonify({"success": False, "message": "У вас есть возможность сделать ход!"})
     
-    # Берем карту из колоды
-    if len(game.deck) > 0:
-        new_card = game.deck.pop()
-        if is_first_player:
-            game.players["player"].append(new_card)
-            game_state.player_cards.append(new_card)
-        else:
-            game.players["opponent"].append(new_card)
-            game_state.opponent_cards.append(new_card)
-    
-    # Увеличиваем счетчик безвыходных ситуаций
-    game.no_valid_moves_count += 1
-    game_state.no_valid_moves_count += 1
-    
-    # Если было 2 хода (вместо 3) без возможности сходить, меняем верхнюю карту
-    if game.no_valid_moves_count >= 2:
-        new_card = game.replace_top_card()
-        if new_card:
-            # Обновляем состояние в БД
-            game_state.discard_pile = game.discard_pile
-        game.no_valid_moves_count = 0
-        game_state.no_valid_moves_count = 0
-        message = "После двух ходов без возможности сходить, верхняя карточка заменена"
-    else:
-        # Передаем ход другому игроку
-        game.current_turn = "opponent" if current_role == "player" else "player"
-        game_state.current_turn = game.current_turn
-        message = "Карта взята, ход переходит к другому игроку"
-    
-    # Сохраняем изменения
-    db.session.commit()
+    # Берем карту из колоды и передаем ход (или меняем верхнюю карту после Game.PASS_LIMIT попыток)
+    message = game.pass_turn(current_role)
     
+    # Изменения сохраняются в базу одним save_state ниже
     # Для игры с ботом
-    if game.game_type == "bot" and game.current_turn == "opponent":
+    if game.game_type == "bot" and game.current_turn == "opponent" and not bot_moves.asynchronous:
         bot_success, bot_message = game.bot_move()
-        game.save_state(game_id, auto_draw_cards=game_state.auto_draw_cards)
+        game.save_state(game_id, game_state.player_name, game_state.opponent_name, game_state.game_type, game_state.auto_draw_cards)
         return jsonify({"success": True, "message": message, "bot_message": bot_message})
-    else:
-        # Сохраняем состояние для обычной игры (не с ботом)
-        game.save_state(game_id, auto_draw_cards=game_state.auto_draw_cards)
+    
+    game.save_state(game_id, game_state.player_name, game_state.opponent_name, game_state.game_type, game_state.auto_draw_cards)
+    # Ход бота сделает фоновый пул, клиент увидит его по новой версии игры
+    if game.game_type == "bot" and game.current_turn == "opponent":
+        bot_moves.submit(game_id)
     
     return jsonify({"success": True, "message": message})
 
+@app.route("/verbs/catalog", methods=["GET"])
+def get_card_catalog():
+    """Каталог карточек: номер карточки — индекс в списке cards. Кэшируется клиентом"""
+    catalog = verb_registry.catalog
+    version = catalog.version
+    if request.if_none_match.contains(version):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({
+            "version": version,
+            "cards": catalog.deck_template
+        })
+    response.set_etag(version)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
+
 @app.route("/health", methods=["GET"])
 def health_check():
     """Endpoint для проверки работоспособности сервиса"""
-    return jsonify({"status": "healthy"}), 200
+    return jsonify({
+        "status": "healthy",
+        "games_cache": games.stats(),
+        "archive": archive_stats,
+        "bots": {name: strategy.stats() for name, strategy in BOT_STRATEGIES.items()},
+        "bot_moves": bot_moves.stats(),
+        "state_views": state_views.stats()
+    }), 200
+
+metrics.gauge('game_cache_size', 'Игр в памяти процесса', function=lambda: len(games))
+metrics.gauge('state_view_cache_size', 'Игр с готовыми ответами /state', function=lambda: state_views.stats()["size"])
+metrics.gauge('bot_moves_active', 'Ходы бота в очереди и в работе', function=lambda: bot_moves.stats()["active"])
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return app.response_class(metrics.expose(), mimetype='text/plain; version=0.0.4')
 
 with app.app_context():
+    if app.config['GAME_STORAGE'] == 'sqlite' and db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+    event.listen(db.engine, 'before_cursor_execute', start_query_timer)
+    event.listen(db.engine, 'after_cursor_execute', record_query_time)
     db.create_all()
+    upgrade_schema()
+
+if app.config['ARCHIVE_INTERVAL'] > 0:
+    threading.Thread(target=run_archiver, args=(app.config['ARCHIVE_INTERVAL'],), daemon=True).start()
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8085, debug=True)
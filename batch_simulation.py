@@ -0,0 +1,293 @@
+"""Пакетная симуляция тысяч партий бот против бота на массивах NumPy.
+
+Партии хранятся массивами: колоды и сбросы — строками номеров карточек
+(verb_id * 4 + form_index, см. VerbRegistry), руки — временем получения
+каждой карточки плюс счетчиками карточек по глаголу и по форме. По этим
+счетчикам проверка «есть ли чем сходить» (Game.check_if_playable) делается
+сразу для всех партий. За один шаг все незаконченные партии проходят один
+раунд по тем же правилам, что и simulation.play_game.
+
+Случайные места возврата карты в колоду (replace_top_card) берутся из
+генератора NumPy; с insert_positions=python_positions(...) — из тех же
+random.Random, что у Game, и результаты совпадают с движком партия в партию.
+
+Требует numpy (в requirements.txt не входит: нужен только для анализа правил).
+
+Запуск:
+    python batch_simulation.py [--games 100000] [--hand-size 10] [--pass-limit 2] [--opening-only]
+"""
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+os.environ.setdefault('GAME_STORAGE', 'memory')
+
+from app import Game, FORMS_PER_VERB, verb_registry  # noqa: E402
+
+PLAYER, OPPONENT, STALEMATE = 0, 1, 2
+# Время получения для карточки, которой нет в руке
+ABSENT = np.iinfo(np.int32).max
+
+
+def random_decks(games, rng):
+    """Перемешанные колоды номеров карточек, по строке на партию"""
+    cards = len(verb_registry.deck_template)
+    return rng.permuted(np.tile(np.arange(cards, dtype=np.int16), (games, 1)), axis=1)
+
+
+def seeded_decks(seeds):
+    """Колоды тех же партий, что Game(seed=...), и генераторы в том же состоянии"""
+    template = np.array([verb_registry.card_id(card) for card in verb_registry.deck_template], dtype=np.int16)
+    decks = np.empty((len(seeds), len(template)), dtype=np.int16)
+    rngs = []
+    for row, seed in enumerate(seeds):
+        rng = random.Random(seed)
+        order = list(range(len(template)))
+        # Перестановка зависит только от длины списка, как в Game.build_deck
+        rng.shuffle(order)
+        decks[row] = template[order]
+        rngs.append(rng)
+    return decks, rngs
+
+
+def python_positions(rngs):
+    """Места возврата карты в колоду из генераторов random.Random, как в Game.replace_top_card"""
+    def positions(rows, lengths):
+        return np.array([rngs[row].randrange(length + 1) for row, length in zip(rows, lengths)], dtype=np.int64)
+    return positions
+
+
+def numpy_positions(rng):
+    def positions(rows, lengths):
+        return rng.integers(0, lengths + 1)
+    return positions
+
+
+def opening_no_playable(decks, hand_size=Game.HAND_SIZE):
+    """Для каждой колоды: нечем ли игроку сходить с начальной руки"""
+    size = decks.shape[1]
+    hand = decks[:, size - 1 - 2 * np.arange(hand_size)]
+    top = decks[:, size - 1 - 2 * hand_size][:, None]
+    playable = (hand // FORMS_PER_VERB == top // FORMS_PER_VERB) | (hand % FORMS_PER_VERB == top % FORMS_PER_VERB)
+    return ~playable.any(axis=1)
+
+
+class BatchSimulation:
+    """Партии с колодами decks (карты берутся с конца строки), сыгранные все разом"""
+
+    def __init__(self, decks, hand_size=Game.HAND_SIZE, pass_limit=Game.PASS_LIMIT, insert_positions=None):
+        self.games, self.cards = decks.shape
+        self.verbs = self.cards // FORMS_PER_VERB
+        self.hand_size = hand_size
+        self.pass_limit = pass_limit
+        self.insert_positions = insert_positions or numpy_positions(np.random.default_rng())
+        self.deck = decks.astype(np.int16, copy=True)
+        self.deck_len = np.full(self.games, self.cards, dtype=np.int64)
+        self.discard = np.zeros_like(self.deck)
+        self.discard_len = np.zeros(self.games, dtype=np.int64)
+        # По игроку и боту: когда получена каждая карточка, сколько карт каждого глагола и каждой формы
+        self.received = np.full((2, self.games, self.cards), ABSENT, dtype=np.int32)
+        self.verb_count = np.zeros((2, self.games, self.verbs), dtype=np.int16)
+        self.form_count = np.zeros((2, self.games, FORMS_PER_VERB), dtype=np.int16)
+        self.hand_len = np.zeros((2, self.games), dtype=np.int64)
+        self.no_valid_moves = np.zeros(self.games, dtype=np.int64)
+        self.clock = 0
+        self.deal()
+        self.no_playable_start = self.hand_len[PLAYER] > hand_size
+
+    def top(self, rows):
+        return self.discard[rows, self.discard_len[rows] - 1]
+
+    def add(self, side, rows, cards):
+        self.received[side, rows, cards] = self.clock
+        self.clock += 1
+        self.verb_count[side, rows, cards // FORMS_PER_VERB] += 1
+        self.form_count[side, rows, cards % FORMS_PER_VERB] += 1
+        self.hand_len[side, rows] += 1
+
+    def remove(self, side, rows, cards):
+        self.received[side, rows, cards] = ABSENT
+        self.verb_count[side, rows, cards // FORMS_PER_VERB] -= 1
+        self.form_count[side, rows, cards % FORMS_PER_VERB] -= 1
+        self.hand_len[side, rows] -= 1
+
+    def pop_deck(self, rows):
+        self.deck_len[rows] -= 1
+        return self.deck[rows, self.deck_len[rows]]
+
+    def push_discard(self, rows, cards):
+        self.discard[rows, self.discard_len[rows]] = cards
+        self.discard_len[rows] += 1
+
+    def deal(self):
+        rows = np.arange(self.games)
+        for _ in range(self.hand_size):
+            self.add(PLAYER, rows, self.pop_deck(rows))
+            self.add(OPPONENT, rows, self.pop_deck(rows))
+        self.push_discard(rows, self.pop_deck(rows))
+        # Как в Game.deal_cards: без подходящей карты игрок сразу добирает одну
+        self.draw(PLAYER, rows[~self.has_playable(PLAYER, rows)])
+
+    def has_playable(self, side, rows):
+        """Game.check_if_playable для всех партий rows"""
+        top = self.top(rows)
+        return ((self.verb_count[side, rows, top // FORMS_PER_VERB] > 0)
+                | (self.form_count[side, rows, top % FORMS_PER_VERB] > 0))
+
+    def playable_card(self, side, rows):
+        """Hand.playable_card: самая давняя карта того же глагола, иначе самая давняя той же формы"""
+        top = self.top(rows)[:, None]
+        by_verb = top // FORMS_PER_VERB * FORMS_PER_VERB + np.arange(FORMS_PER_VERB)
+        by_form = np.arange(self.verbs) * FORMS_PER_VERB + top % FORMS_PER_VERB
+        verb_received = self.received[side, rows[:, None], by_verb]
+        form_received = self.received[side, rows[:, None], by_form]
+        index = np.arange(len(rows))
+        verb_card = by_verb[index, verb_received.argmin(axis=1)]
+        form_card = by_form[index, form_received.argmin(axis=1)]
+        return np.where(verb_received.min(axis=1) < ABSENT, verb_card, form_card)
+
+    def play(self, side, rows):
+        cards = self.playable_card(side, rows)
+        self.remove(side, rows, cards)
+        self.push_discard(rows, cards)
+
+    def draw(self, side, rows):
+        rows = rows[self.deck_len[rows] > 0]
+        self.add(side, rows, self.pop_deck(rows))
+
+    def replace_top(self, rows):
+        """Game.replace_top_card"""
+        rows = rows[self.deck_len[rows] > 0]
+        returned = rows[self.discard_len[rows] > 1]
+        if len(returned):
+            below = self.discard_len[returned] - 2
+            cards = self.discard[returned, below]
+            self.discard[returned, below] = self.discard[returned, below + 1]
+            self.discard_len[returned] -= 1
+            self.insert_into_deck(returned, cards)
+        self.push_discard(rows, self.pop_deck(rows))
+
+    def insert_into_deck(self, rows, cards):
+        lengths = self.deck_len[rows]
+        positions = self.insert_positions(rows, lengths)[:, None]
+        columns = np.arange(self.cards)[None, :]
+        decks = self.deck[rows]
+        shifted = decks[:, np.maximum(columns[0] - 1, 0)]
+        self.deck[rows] = np.where(columns < positions, decks, np.where(columns == positions, cards[:, None], shifted))
+        self.deck_len[rows] += 1
+
+    def pass_or_replace(self, side, rows):
+        """Добор карты; после pass_limit таких ходов подряд — замена верхней карты.
+        Возвращает строки, где карта заменена"""
+        self.draw(side, rows)
+        self.no_valid_moves[rows] += 1
+        replaced = rows[self.no_valid_moves[rows] >= self.pass_limit]
+        self.replace_top(replaced)
+        self.no_valid_moves[replaced] = 0
+        return replaced
+
+    def run(self, max_rounds=1000):
+        """Доигрывает все партии. Возвращает массивы исходов (PLAYER, OPPONENT, STALEMATE) и числа раундов"""
+        outcome = np.full(self.games, -1, dtype=np.int8)
+        rounds = np.zeros(self.games, dtype=np.int64)
+        active = np.arange(self.games)
+        while len(active):
+            position = np.stack([self.hand_len[PLAYER, active], self.hand_len[OPPONENT, active], self.top(active)])
+
+            # Ход игрока: карта (Game.play_card) или добор (Game.pass_turn)
+            can_play = self.has_playable(PLAYER, active)
+            playing = active[can_play]
+            self.play(PLAYER, playing)
+            outcome[playing[self.hand_len[PLAYER, playing] == 0]] = PLAYER
+            played = playing[self.hand_len[PLAYER, playing] > 0]
+            self.no_valid_moves[played] = 0
+            passing = active[~can_play]
+            replaced = self.pass_or_replace(PLAYER, passing)
+
+            # Ответ бота (Game.bot_move), если ход перешел к нему
+            bot = np.concatenate([played, np.setdiff1d(passing, replaced, assume_unique=True)])
+            can_play = self.has_playable(OPPONENT, bot)
+            playing = bot[can_play]
+            self.play(OPPONENT, playing)
+            outcome[playing[self.hand_len[OPPONENT, playing] == 0]] = OPPONENT
+            self.no_valid_moves[playing] = 0
+            self.pass_or_replace(OPPONENT, bot[~can_play])
+
+            rounds[active] += 1
+            # Ничья: колода пуста и за раунд ничего не изменилось, или кончился лимит раундов
+            going = outcome[active] < 0
+            unchanged = (self.deck_len[active] == 0) & (position == np.stack([
+                self.hand_len[PLAYER, active], self.hand_len[OPPONENT, active], self.top(active)])).all(axis=0)
+            outcome[active[going & (unchanged | (rounds[active] >= max_rounds))]] = STALEMATE
+            active = active[outcome[active] < 0]
+        return outcome, rounds
+
+
+def summarize(outcome, rounds, no_playable_start, elapsed):
+    games = len(outcome)
+    return {
+        "games": games,
+        "player_win_rate": float(np.mean(outcome == PLAYER)),
+        "opponent_win_rate": float(np.mean(outcome == OPPONENT)),
+        "stalemate_rate": float(np.mean(outcome == STALEMATE)),
+        "no_playable_start_rate": float(np.mean(no_playable_start)),
+        "rounds_mean": float(rounds.mean()),
+        "rounds_p50": int(np.percentile(rounds, 50, method='lower')),
+        "rounds_p90": int(np.percentile(rounds, 90, method='lower')),
+        "rounds_max": int(rounds.max()),
+        "seconds": elapsed,
+        "games_per_second": games / elapsed if elapsed else float('inf')
+    }
+
+
+def run_batches(games, chunk=20000, seed=None, hand_size=Game.HAND_SIZE, pass_limit=Game.PASS_LIMIT, max_rounds=1000):
+    """Играет games партий пачками по chunk (память — около 1,5 КБ на партию)"""
+    rng = np.random.default_rng(seed)
+    outcomes, lengths, starts = [], [], []
+    started = time.perf_counter()
+    for offset in range(0, games, chunk):
+        batch = BatchSimulation(random_decks(min(chunk, games - offset), rng), hand_size, pass_limit,
+                                numpy_positions(rng))
+        outcome, rounds = batch.run(max_rounds)
+        outcomes.append(outcome)
+        lengths.append(rounds)
+        starts.append(batch.no_playable_start)
+    return summarize(np.concatenate(outcomes), np.concatenate(lengths), np.concatenate(starts),
+                     time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--chunk', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--hand-size', type=int, default=Game.HAND_SIZE)
+    parser.add_argument('--pass-limit', type=int, default=Game.PASS_LIMIT)
+    parser.add_argument('--max-rounds', type=int, default=1000)
+    parser.add_argument('--opening-only', action='store_true', help='только сдача: доля начальных рук без хода')
+    args = parser.parse_args()
+
+    if args.opening_only:
+        rng = np.random.default_rng(args.seed)
+        started = time.perf_counter()
+        hits = sum(int(opening_no_playable(random_decks(min(args.chunk, args.games - offset), rng),
+                                           args.hand_size).sum())
+                   for offset in range(0, args.games, args.chunk))
+        elapsed = time.perf_counter() - started
+        print(f"{args.games} сдач за {elapsed:.2f} с: нет хода с начальной руки в {hits / args.games:.2%}")
+        return
+
+    result = run_batches(args.games, args.chunk, args.seed, args.hand_size, args.pass_limit, args.max_rounds)
+    print(f"{result['games']} партий за {result['seconds']:.1f} с ({result['games_per_second']:.0f} партий/с)")
+    print(f"победы игрока {result['player_win_rate']:.1%}, бота {result['opponent_win_rate']:.1%}, "
+          f"ничьи {result['stalemate_rate']:.1%}")
+    print(f"нет хода с начальной руки: {result['no_playable_start_rate']:.1%}")
+    print(f"длина партии в раундах: среднее {result['rounds_mean']:.1f}, медиана {result['rounds_p50']}, "
+          f"p90 {result['rounds_p90']}, максимум {result['rounds_max']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Бенчмарк создания игры: сколько игр в секунду строит create_new_game.
+
+Сравниваются два способа сборки колоды:
+  * template — копия эталонной колоды из каталога + перемешивание (текущий);
+  * legacy   — сборка колоды из словарей глаголов кортеж за кортежем.
+
+Перед замерами оба варианта прогоняются без учета времени, затем замеры
+повторяются --repeats раз с чередованием порядка вариантов. Печатаются
+медианы скоростей и медиана отношения template/legacy по повторам.
+
+Запуск:
+    python benchmarks/bench_create_game.py [--games 2000] [--repeats 5] [--engine-only]
+
+База данных по умолчанию — SQLite в памяти (GAME_STORAGE=memory).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault('GAME_STORAGE', 'memory')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, Game, games  # noqa: E402
+
+
+def legacy_build_deck(self):
+    """Сборка колоды так, как это делалось до появления эталонной колоды"""
+    deck = []
+    for verb in self.verbs:
+        deck.extend([
+            (verb['infinitive'], verb['infinitive'], 0, verb['translation']),
+            (verb['prasens_3'], verb['infinitive'], 1, verb['translation']),
+            (verb['prateritum'], verb['infinitive'], 2, verb['translation']),
+            (verb['partizip_2'], verb['infinitive'], 3, verb['translation'])
+        ])
+    self.rng.shuffle(deck)
+    return deck
+
+
+def bench_engine(count):
+    start = time.perf_counter()
+    for _ in range(count):
+        Game()
+    return count / (time.perf_counter() - start)
+
+
+def bench_route(client, count):
+    payload = {'player_name': 'Bench', 'game_type': 'bot'}
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.post('/game/new', json=payload)
+        assert response.get_json()['success']
+    elapsed = time.perf_counter() - start
+    games.clear()
+    return count / elapsed
+
+
+def measure(client, build_deck, count, engine_only):
+    template_build_deck = Game.build_deck
+    Game.build_deck = build_deck
+    try:
+        rates = {'engine': bench_engine(count)}
+        if not engine_only:
+            rates['route'] = bench_route(client, count)
+    finally:
+        Game.build_deck = template_build_deck
+    return rates
+
+
+def run(count, repeats, engine_only):
+    variants = (('legacy', legacy_build_deck), ('template', Game.build_deck))
+    samples = {name: [] for name, _ in variants}
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        # Прогрев без учета времени, чтобы второй вариант не выигрывал на теплых кэшах
+        for _, build_deck in variants:
+            measure(client, build_deck, min(count, 200), engine_only)
+        for repeat in range(repeats):
+            order = variants if repeat % 2 == 0 else variants[::-1]
+            for name, build_deck in order:
+                samples[name].append(measure(client, build_deck, count, engine_only))
+    results = {
+        name: {kind: statistics.median(rates[kind] for rates in runs) for kind in runs[0]}
+        for name, runs in samples.items()
+    }
+    speedup = statistics.median(
+        template['engine'] / legacy['engine']
+        for legacy, template in zip(samples['legacy'], samples['template'])
+    )
+    return results, speedup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=5, help='повторов замера каждого варианта')
+    parser.add_argument('--engine-only', action='store_true',
+                        help='измерять только Game() без маршрута и базы данных')
+    args = parser.parse_args()
+
+    results, speedup = run(args.games, max(args.repeats, 1), args.engine_only)
+    for name, values in results.items():
+        line = ', '.join(f'{kind}: {rate:,.0f} игр/с' for kind, rate in values.items())
+        print(f'{name:>8}: {line}')
+    print(f'Ускорение Game() (медиана по повторам): x{speedup:.2f}')
+
+
+if __name__ == '__main__':
+    main()
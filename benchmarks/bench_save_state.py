@@ -0,0 +1,178 @@
+"""Бенчмарк сохранения хода: сколько байт пишется в базу и сколько длится сохранение.
+
+Сравниваются два варианта Game.save_state:
+  * legacy — перезапись всех полей записи и коммит на каждый вызов (как раньше);
+  * delta  — текущий: ходы дописываются в журнал GameMove, полный снимок
+    записывается раз в GAME_SNAPSHOT_INTERVAL ходов; без коммита, если изменений нет.
+
+Ходы делаются через маршруты /play и /draw тестовым клиентом Flask, поэтому
+в замер попадает и запрос /state, который клиент делает перед каждым ходом.
+Игры создаются с сидами 0, 1, 2..., так что оба варианта играют одни и те же
+партии. Бот ходит внутри запроса (BOT_WORKERS=0), как и раньше.
+
+Запуск:
+    python benchmarks/bench_save_state.py [--games 50] [--max-moves 40]
+
+По умолчанию используется SQLite во временном файле (переменная DATABASE_URL),
+чтобы время коммита включало запись на диск.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+if 'DATABASE_URL' not in os.environ:
+    _db_dir = tempfile.mkdtemp(prefix='bench_save_state_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_db_dir, 'bench.db')
+os.environ.setdefault('BOT_WORKERS', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import app, db, Game, GameState, StaleGameError, decode_card, encode_cards, games, game_notifier  # noqa: E402
+
+
+def legacy_save_state(self, game_id, player_name=None, opponent_name=None, game_type="bot", auto_draw_cards=False):
+    """save_state до перехода на запись изменений: все поля и коммит каждый раз"""
+    existing_state = GameState.query.get(game_id)
+    if existing_state and self.version is not None and existing_state.version != self.version:
+        raise StaleGameError(game_id)
+    if existing_state:
+        existing_state.deck = encode_cards(self.deck)
+        existing_state.player_cards = encode_cards(self.players["player"])
+        existing_state.opponent_cards = encode_cards(self.players["opponent"])
+        existing_state.discard_pile = encode_cards(self.discard_pile)
+        existing_state.current_turn = self.current_turn
+        existing_state.no_valid_moves_count = self.no_valid_moves_count
+        if len(self.players["player"]) == 0 or len(self.players["opponent"]) == 0:
+            existing_state.game_status = 'finished'
+        if player_name:
+            existing_state.player_name = player_name
+        if game_type:
+            existing_state.game_type = game_type
+        existing_state.auto_draw_cards = auto_draw_cards
+        state = existing_state
+    else:
+        state = GameState(id=game_id, player_name=player_name, game_type=game_type,
+                          game_status='active', auto_draw_cards=auto_draw_cards, **self.snapshot())
+        db.session.add(state)
+    db.session.commit()
+    self.version = state.version
+    self.auto_draw_cards = auto_draw_cards
+    self._saved = self.snapshot()
+    game_notifier.publish(game_id, self.version)
+
+
+class WriteMeter:
+    """Считает запросы и байты параметров INSERT/UPDATE, коммиты и время save_state"""
+
+    def __init__(self):
+        self.bytes_written = 0
+        self.writes = 0
+        self.selects = 0
+        self.commits = 0
+        self.saves = []
+
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+        event.listen(Session, 'after_commit', self.on_commit)
+
+    def remove(self, engine):
+        event.remove(engine, 'before_cursor_execute', self.on_execute)
+        event.remove(Session, 'after_commit', self.on_commit)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip()[:6].upper()
+        if verb == 'SELECT':
+            self.selects += 1
+        elif verb in ('INSERT', 'UPDATE'):
+            self.writes += 1
+            self.bytes_written += self.size(parameters)
+
+    def size(self, parameters):
+        """Байты значений параметров; при вставке нескольких строк они бывают вложенными"""
+        if isinstance(parameters, dict):
+            parameters = parameters.values()
+        if isinstance(parameters, (list, tuple)) or hasattr(parameters, 'values'):
+            return sum(self.size(value) for value in parameters)
+        return len(str(parameters).encode('utf-8'))
+
+    def on_commit(self, session):
+        self.commits += 1
+
+    def timed(self, save_state):
+        """Оборачивает save_state, замеряя полное время сохранения (flush + commit)"""
+        def wrapper(game, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return save_state(game, *args, **kwargs)
+            finally:
+                self.saves.append(time.perf_counter() - started)
+        return wrapper
+
+
+def play_game(client, max_moves, seed):
+    """Играет одну игру с ботом, выбирая первую подходящую карту. Возвращает число ходов"""
+    game_id = client.post('/game/new', json={'player_name': 'Bench', 'game_type': 'bot', 'seed': seed}).get_json()['game_id']
+    moves = 0
+    while moves < max_moves:
+        state = client.get(f'/game/{game_id}/state?player_name=Bench&cards=ids').get_json()
+        if state.get('game_over'):
+            break
+        top = decode_card(state['discard_pile'])
+        playable = [card for card in state['player_cards']
+                    if decode_card(card)[1] == top[1] or decode_card(card)[2] == top[2]]
+        if playable:
+            client.post(f'/game/{game_id}/play', json={'player_name': 'Bench', 'card': playable[0]})
+        else:
+            client.post(f'/game/{game_id}/draw', json={'player_name': 'Bench'})
+        moves += 1
+    return moves
+
+
+def run(mode, game_count, max_moves):
+    current_save_state = Game.save_state
+    meter = WriteMeter()
+    Game.save_state = meter.timed(legacy_save_state if mode == 'legacy' else current_save_state)
+    try:
+        with app.app_context():
+            db.create_all()
+            meter.install(db.engine)
+            client = app.test_client()
+            moves = sum(play_game(client, max_moves, seed) for seed in range(game_count))
+            meter.remove(db.engine)
+            games.clear()
+    finally:
+        Game.save_state = current_save_state
+    saves = sorted(meter.saves)
+    return {
+        'moves': moves,
+        'bytes_per_move': meter.bytes_written / moves,
+        'writes_per_move': meter.writes / moves,
+        'selects_per_move': meter.selects / moves,
+        'commits_per_move': meter.commits / moves,
+        'save_p50_ms': statistics.median(saves) * 1000,
+        'save_p99_ms': saves[max(int(len(saves) * 0.99) - 1, 0)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--max-moves', type=int, default=40)
+    args = parser.parse_args()
+
+    for mode in ('legacy', 'delta'):
+        result = run(mode, args.games, args.max_moves)
+        print(f"{mode:>6}: {result['moves']} ходов, "
+              f"{result['bytes_per_move']:.0f} байт/ход, "
+              f"INSERT/UPDATE {result['writes_per_move']:.2f}, SELECT {result['selects_per_move']:.2f}, "
+              f"коммитов {result['commits_per_move']:.2f} на ход; "
+              f"save_state p50 {result['save_p50_ms']:.2f} мс, p99 {result['save_p99_ms']:.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""Набор бенчмарков движка и маршрутов с порогами регрессии.
+
+Микробенчмарки движка (Game без базы данных):
+  * engine.deal_cards        — раздача из перемешанной колоды;
+  * engine.check_if_playable — поиск подходящей карты в руке игрока;
+  * engine.play_card         — ход игрока подходящей картой (без ответа бота);
+  * engine.bot_move          — ход бота стратегией BOT_STRATEGY;
+  * engine.replace_top_card  — замена верхней карты сброса.
+Время операции движка — среднее по пачке из 10 позиций (см. measure).
+
+Макробенчмарки маршрутов через тестовый клиент Flask на базе в памяти:
+  * route.new   — POST /game/new;
+  * route.state — GET /game/<id>/state;
+  * route.play  — POST /game/<id>/play (вместе с ответом бота);
+  * route.draw  — POST /game/<id>/draw (вместе с ответом бота).
+
+Все позиции и партии строятся по сидам 0, 1, 2..., поэтому каждый запуск
+измеряет одну и ту же нагрузку. Для каждого замера считаются p50, p99 и среднее
+в микросекундах. Результаты можно записать в JSON (--output) и сравнить с
+сохраненными ранее (--baseline): если p50 или p99 какого-либо замера выросли
+больше чем на порог, скрипт завершается с кодом 1.
+
+Запуск:
+    python benchmarks/bench_suite.py [--iterations 2000] [--games 40]
+        [--output results.json] [--baseline benchmarks/baseline.json]
+        [--p50-threshold 0.25] [--p99-threshold 0.75] [--only engine]
+
+Базовые результаты зависят от машины: их записывают на той же машине,
+на которой потом сравнивают (make bench-baseline, затем make bench).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+# Маршруты измеряем на базе в памяти; бот ходит внутри запроса, чтобы фоновые
+# потоки не добавляли шума и ход партии не зависел от планировщика
+os.environ.setdefault('GAME_STORAGE', 'memory')
+os.environ.setdefault('BOT_WORKERS', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, Game, decode_card, games, is_playable_on  # noqa: E402
+
+
+class EngineGame(Game):
+    """Игра только в памяти: ходы не копятся в журнале между замерами"""
+    record_moves = False
+
+
+def percentile(samples, fraction):
+    """Перцентиль отсортированной выборки (ближайший ранг)"""
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def summarize(samples):
+    """p50, p99 и среднее в микросекундах по замерам в наносекундах"""
+    samples = sorted(samples)
+    return {
+        "samples": len(samples),
+        "p50_us": percentile(samples, 0.5) / 1000,
+        "p99_us": percentile(samples, 0.99) / 1000,
+        "mean_us": statistics.fmean(samples) / 1000
+    }
+
+
+def measure(positions, setup, action, batch=10):
+    """Время action(*setup(position)) на одну позицию; setup в замер не входит.
+
+    Операции движка длятся микросекунды, поэтому время замеряется пачками по
+    batch позиций и делится на batch: так меньше влияют точность таймера и
+    случайные паузы.
+    """
+    samples = []
+    clock = time.perf_counter_ns
+    for start in range(0, len(positions) - batch + 1, batch):
+        prepared = [setup(position) for position in positions[start:start + batch]]
+        started = clock()
+        for args in prepared:
+            action(*args)
+        samples.append((clock() - started) / batch)
+    return samples
+
+
+def engine_positions(iterations):
+    """Партии с сидами 0..iterations-1, доигранные до хода seed % 20"""
+    positions = []
+    for seed in range(iterations):
+        game = EngineGame(seed=seed)
+        for _ in range(seed % 20):
+            if game.current_turn == "over":
+                break
+            if game.current_turn == "opponent":
+                game.bot_move()
+                continue
+            card = game.players["player"].playable_card(game.discard_pile[-1])
+            if card is not None:
+                game.play_card("player", card)
+            else:
+                game.pass_turn("player")
+        if game.current_turn != "over":
+            positions.append(game)
+    return positions
+
+
+def restored(game, current_turn=None):
+    """Копия позиции game, которую замер может менять"""
+    copy = EngineGame.__new__(EngineGame)
+    copy.__dict__.update(game.__dict__)
+    copy.pending_moves = []
+    copy.restore(game.snapshot())
+    if current_turn is not None:
+        copy.current_turn = current_turn
+    return copy
+
+
+def bench_engine(iterations):
+    positions = engine_positions(iterations)
+
+    def fresh_deck(game):
+        game = restored(game)
+        game.deck = game.build_deck()
+        game.players = {"player": [], "opponent": []}
+        game.discard_pile = []
+        return (game,)
+
+    def playable_move(game):
+        game = restored(game, "player")
+        card = game.players["player"].playable_card(game.discard_pile[-1])
+        if card is None:
+            # Подкладываем в руку карту, которую можно сыграть
+            card = game.discard_pile[-1]
+            game.players["player"].append(card)
+        return game, card
+
+    def replaceable(game):
+        game = restored(game)
+        if len(game.discard_pile) < 2:
+            game.discard_pile.insert(0, game.players["player"].pop())
+        return (game,)
+
+    return {
+        "engine.deal_cards": measure(positions, fresh_deck, EngineGame.deal_cards),
+        "engine.check_if_playable": measure(positions, lambda game: (restored(game, "player"),),
+                                            EngineGame.check_if_playable),
+        "engine.play_card": measure(positions, playable_move,
+                                    lambda game, card: game.play_card("player", card, bot_reply=False)),
+        "engine.bot_move": measure(positions, lambda game: (restored(game, "opponent"),), EngineGame.bot_move),
+        "engine.replace_top_card": measure(positions, replaceable, EngineGame.replace_top_card)
+    }
+
+
+def timed_request(samples, send):
+    started = time.perf_counter_ns()
+    response = send()
+    samples.append(time.perf_counter_ns() - started)
+    return response.get_json()
+
+
+def bench_routes(game_count, max_moves):
+    samples = {"route.new": [], "route.state": [], "route.play": [], "route.draw": []}
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        for seed in range(game_count):
+            game_id = timed_request(samples["route.new"], lambda: client.post(
+                '/game/new', json={'player_name': 'Bench', 'game_type': 'bot', 'seed': seed}))['game_id']
+            for _ in range(max_moves):
+                state = timed_request(samples["route.state"], lambda: client.get(
+                    f'/game/{game_id}/state?player_name=Bench&cards=ids'))
+                if state.get('game_over') or state['current_turn'] != 'player':
+                    break
+                top = decode_card(state['discard_pile'])
+                playable = [card for card in state['player_cards'] if is_playable_on(decode_card(card), top)]
+                if playable:
+                    timed_request(samples["route.play"], lambda: client.post(
+                        f'/game/{game_id}/play', json={'player_name': 'Bench', 'card': playable[0]}))
+                else:
+                    timed_request(samples["route.draw"], lambda: client.post(
+                        f'/game/{game_id}/draw', json={'player_name': 'Bench'}))
+        games.clear()
+    return samples
+
+
+def run(iterations, game_count, max_moves, only=None):
+    samples = {}
+    # Первый короткий прогон только прогревает кэши и интерпретатор
+    if only in (None, 'engine'):
+        bench_engine(min(iterations, 200))
+        samples.update(bench_engine(iterations))
+    if only in (None, 'routes'):
+        bench_routes(min(game_count, 3), max_moves)
+        samples.update(bench_routes(game_count, max_moves))
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "iterations": iterations,
+            "games": game_count,
+            "max_moves": max_moves,
+            "bot_strategy": app.config['BOT_STRATEGY']
+        },
+        "results": {name: summarize(values) for name, values in samples.items() if values}
+    }
+
+
+def compare(results, baseline, p50_threshold, p99_threshold):
+    """Список регрессий: (замер, метрика, было, стало) для p50/p99 выше порога"""
+    regressions = []
+    for name, current in results["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        for metric, threshold in (("p50_us", p50_threshold), ("p99_us", p99_threshold)):
+            if current[metric] > previous[metric] * (1 + threshold):
+                regressions.append((name, metric, previous[metric], current[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000, help='позиций для каждого микробенчмарка')
+    parser.add_argument('--games', type=int, default=40, help='партий для бенчмарков маршрутов')
+    parser.add_argument('--max-moves', type=int, default=40)
+    parser.add_argument('--only', choices=('engine', 'routes'))
+    parser.add_argument('--output', help='куда записать результаты в JSON')
+    parser.add_argument('--baseline', help='JSON с базовыми результатами для сравнения')
+    parser.add_argument('--p50-threshold', type=float, default=0.25, help='допустимый рост p50 (доля)')
+    parser.add_argument('--p99-threshold', type=float, default=0.75, help='допустимый рост p99 (доля)')
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.games, args.max_moves, args.only)
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+    for name, result in results["results"].items():
+        line = (f"{name:<26} p50 {result['p50_us']:9.1f} мкс  p99 {result['p99_us']:9.1f} мкс  "
+                f"среднее {result['mean_us']:9.1f} мкс  ({result['samples']} замеров)")
+        previous = baseline["results"].get(name) if baseline else None
+        if previous:
+            line += f"  p50 {result['p50_us'] / previous['p50_us'] - 1:+.0%}, p99 {result['p99_us'] / previous['p99_us'] - 1:+.0%}"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if args.baseline and baseline is None:
+        print(f"Базовых результатов {args.baseline} нет, сравнивать не с чем")
+        return 0
+    if baseline:
+        regressions = compare(results, baseline, args.p50_threshold, args.p99_threshold)
+        for name, metric, previous, current in regressions:
+            print(f"РЕГРЕССИЯ {name} {metric}: {previous:.1f} -> {current:.1f} мкс")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,483 @@
+"""Нагрузочный тест: тысячи одновременных игроков против локального gunicorn.
+
+Клиенты повторяют то, что делает App.js:
+  * игрок против бота — создает игру (/game/new), опрашивает /game/<id>/state,
+    в свой ход играет первой подходящей картой (/play) или берет карту (/draw),
+    после окончания партии начинает новую;
+  * пара игроков — первый создает мультиплеерную игру, второй присоединяется
+    (/join), дальше оба опрашивают состояние и ходят по очереди.
+
+Опрос — раз в --poll-interval секунд с If-None-Match (как старый клиент) или
+длинный опрос since=&wait= (--long-poll, как App.js без SSE; тогда задержка
+/state включает ожидание изменения игры). Карточки приходят номерами и
+расшифровываются по /verbs/catalog.
+
+Для каждой конфигурации воркеров (--configs 1x32,2x16,4x8: воркеров x потоков)
+запускается gunicorn на свободном порту с чистой базой SQLite во временном
+каталоге, клиенты подключаются постепенно за --ramp-up секунд, и нагрузка
+держится --duration секунд. По каждому маршруту печатаются число запросов в
+секунду, p50/p90/p99, гистограмма задержек, доля ошибок и сколько раз сервер
+ответил «Игра не найдена». С --url нагрузка подается на уже запущенный сервер.
+
+Запуск:
+    python benchmarks/load_test.py [--bot-players 1000] [--pairs 250]
+        [--configs 1x32,4x8] [--duration 60] [--ramp-up 20] [--poll-interval 2]
+        [--long-poll] [--think-time 0.5] [--output load.json]
+
+Нужен gunicorn (requirements.txt); клиенты — на asyncio без внешних зависимостей.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ('new', 'join', 'state', 'play', 'draw')
+# Границы корзин гистограммы задержек, мс
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+NOT_FOUND = 'Игра не найдена'
+
+
+class HttpConnection:
+    """HTTP/1.1 с keep-alive поверх asyncio: только то, что нужно для API игры"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None, headers=None):
+        """Возвращает (статус, заголовки, тело). Соединение, закрытое сервером
+        между запросами (keep-alive истек), открывается заново"""
+        for attempt in range(2):
+            reused = self.writer is not None
+            try:
+                if self.writer is None:
+                    self.reader, self.writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port), self.timeout)
+                return await asyncio.wait_for(self._exchange(method, path, payload, headers or {}), self.timeout)
+            except (EmptyResponse, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if not reused or attempt:
+                    raise
+            except BaseException:
+                self.close()
+                raise
+
+    async def _exchange(self, method, path, payload, headers):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+        if payload is not None:
+            lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            # Сервер закрыл соединение, не прочитав запрос: его можно повторить
+            raise EmptyResponse()
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if 'content-length' in response_headers:
+            data = await self.reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding') == 'chunked':
+            data = await self._read_chunked()
+        elif status in (204, 304):
+            data = b''
+        else:
+            data = await self.reader.read()
+            response_headers['connection'] = 'close'
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, data
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await self.reader.readline()
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class EmptyResponse(ConnectionError):
+    """Соединение закрыто до ответа"""
+
+
+class LoadStats:
+    """Задержки, статусы и ошибки по маршрутам за время замера"""
+
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.statuses = {route: Counter() for route in ROUTES}
+        self.errors = Counter()
+        self.not_found = Counter()
+        # Тексты отказов (success: false) по маршрутам
+        self.messages = {route: Counter() for route in ROUTES}
+        self.games_finished = 0
+        self.recording = False
+
+    def record(self, route, seconds, status, data):
+        if not self.recording:
+            return
+        self.latencies[route].append(seconds * 1000)
+        self.statuses[route][status] += 1
+        if status >= 400:
+            self.errors[route] += 1
+        elif isinstance(data, dict) and data.get('success') is False:
+            self.messages[route][data.get('message', '')] += 1
+            if NOT_FOUND in data.get('message', ''):
+                self.not_found[route] += 1
+            else:
+                self.errors[route] += 1
+
+    def failure(self, route, error):
+        if self.recording:
+            self.errors[route] += 1
+            self.statuses[route][type(error).__name__] += 1
+
+    def report(self, elapsed):
+        routes = {}
+        for route in ROUTES:
+            samples = sorted(self.latencies[route])
+            count = sum(self.statuses[route].values())
+            if not count:
+                continue
+            histogram = Counter(BUCKETS[min(bisect.bisect_left(BUCKETS, value), len(BUCKETS) - 1)]
+                                for value in samples)
+            routes[route] = {
+                "requests": count,
+                "per_second": count / elapsed,
+                "p50_ms": percentile(samples, 0.5),
+                "p90_ms": percentile(samples, 0.9),
+                "p99_ms": percentile(samples, 0.99),
+                "max_ms": samples[-1] if samples else None,
+                "error_rate": self.errors[route] / count,
+                "not_found": self.not_found[route],
+                "statuses": {str(status): value for status, value in self.statuses[route].items()},
+                "messages": dict(self.messages[route].most_common(5)),
+                "histogram_ms": {f"<={bucket}": histogram[bucket] for bucket in BUCKETS if histogram[bucket]}
+            }
+        total = sum(route["requests"] for route in routes.values())
+        return {
+            "seconds": elapsed,
+            "requests": total,
+            "requests_per_second": total / elapsed,
+            "errors": sum(self.errors.values()),
+            "not_found": sum(self.not_found.values()),
+            "games_finished": self.games_finished,
+            "routes": routes
+        }
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+class Player:
+    """Один игрок: свое соединение, своя игра, опрос и ходы как в App.js"""
+
+    def __init__(self, name, server, stats, catalog, options):
+        self.name = name
+        self.connection = HttpConnection(*server, options.timeout)
+        self.stats = stats
+        self.catalog = catalog
+        self.options = options
+        self.game_id = None
+        self.etag = None
+        self.version = None
+
+    async def call(self, route, method, path, payload=None, headers=None):
+        started = time.perf_counter()
+        try:
+            status, response_headers, body = await self.connection.request(method, path, payload, headers)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as error:
+            self.stats.failure(route, error)
+            return None, {}, None
+        data = json.loads(body) if body and response_headers.get('content-type', '').startswith('application/json') else None
+        self.stats.record(route, time.perf_counter() - started, status, data)
+        return status, response_headers, data
+
+    async def poll(self):
+        """Состояние игры или None, если оно не изменилось (304) или запрос не удался"""
+        query = {'player_name': self.name, 'cards': 'ids'}
+        if self.options.long_poll and self.version is not None:
+            query.update(since=self.version, wait=self.options.long_poll_wait)
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        status, response_headers, state = await self.call(
+            'state', 'GET', f'/game/{self.game_id}/state?{urllib.parse.urlencode(query)}', headers=headers)
+        if status != 200 or not isinstance(state, dict) or state.get('success') is False:
+            return None
+        self.etag = response_headers.get('etag')
+        self.version = state.get('version', self.version)
+        return state
+
+    async def move(self, state):
+        """Ход: первая подходящая карта, иначе взять карту"""
+        await asyncio.sleep(self.options.think_time * random.random())
+        top = self.catalog[state['discard_pile']]
+        for card in state['player_cards']:
+            form, infinitive, form_index, _ = self.catalog[card]
+            if infinitive == top[1] or form_index == top[2]:
+                await self.call('play', 'POST', f'/game/{self.game_id}/play',
+                                {'player_name': self.name, 'card': card})
+                return
+        await self.call('draw', 'POST', f'/game/{self.game_id}/draw', {'player_name': self.name})
+
+    async def wait_next_poll(self, state):
+        # При длинном опросе сервер сам держит запрос; пауза — только после ошибки
+        if not self.options.long_poll or state is None:
+            await asyncio.sleep(self.options.poll_interval)
+
+    def reset(self, game_id):
+        self.game_id = game_id
+        self.etag = None
+        self.version = None
+
+
+async def bot_player(name, server, stats, catalog, options, deadline):
+    player = Player(name, server, stats, catalog, options)
+    try:
+        while time.monotonic() < deadline:
+            status, _, created = await player.call('new', 'POST', '/game/new',
+                                                   {'player_name': name, 'game_type': 'bot'})
+            if not created or not created.get('success'):
+                await asyncio.sleep(options.poll_interval)
+                continue
+            player.reset(created['game_id'])
+            while time.monotonic() < deadline:
+                state = await player.poll()
+                if state is not None:
+                    if state.get('game_over'):
+                        if stats.recording:
+                            stats.games_finished += 1
+                        break
+                    if state.get('current_turn') == 'player':
+                        await player.move(state)
+                        continue
+                await player.wait_next_poll(state)
+    finally:
+        player.connection.close()
+
+
+async def multiplayer_seat(player, stats, deadline):
+    while time.monotonic() < deadline:
+        state = await player.poll()
+        if state is not None:
+            if state.get('game_status') == 'finished' or state.get('current_turn') == 'over':
+                return
+            if state.get('is_my_turn'):
+                await player.move(state)
+                continue
+        await player.wait_next_poll(state)
+
+
+async def multiplayer_pair(name, server, stats, catalog, options, deadline):
+    first = Player(f'{name}-a', server, stats, catalog, options)
+    second = Player(f'{name}-b', server, stats, catalog, options)
+    try:
+        while time.monotonic() < deadline:
+            status, _, created = await first.call('new', 'POST', '/game/new',
+                                                  {'player_name': first.name, 'game_type': 'multiplayer'})
+            if not created or not created.get('success'):
+                await asyncio.sleep(options.poll_interval)
+                continue
+            game_id = created['game_id']
+            # Второй игрок заходит не сразу, как человек, получивший ссылку
+            await asyncio.sleep(options.think_time * random.random())
+            status, _, joined = await second.call('join', 'POST', f'/game/{game_id}/join',
+                                                  {'player_name': second.name})
+            if not joined or not joined.get('success'):
+                continue
+            first.reset(game_id)
+            second.reset(game_id)
+            await asyncio.gather(multiplayer_seat(first, stats, deadline), multiplayer_seat(second, stats, deadline))
+            if stats.recording and time.monotonic() < deadline:
+                stats.games_finished += 1
+    finally:
+        first.connection.close()
+        second.connection.close()
+
+
+async def run_load(server, catalog, options):
+    """Подключает клиентов за ramp_up секунд и держит нагрузку duration секунд"""
+    stats = LoadStats()
+    started = time.monotonic()
+    deadline = started + options.ramp_up + options.duration
+    clients = options.bot_players + options.pairs
+    tasks = []
+    for index in range(clients):
+        start_at = started + options.ramp_up * index / max(clients, 1)
+        await asyncio.sleep(max(0.0, start_at - time.monotonic()))
+        if index < options.bot_players:
+            tasks.append(asyncio.create_task(bot_player(f'load{index}', server, stats, catalog, options, deadline)))
+        else:
+            tasks.append(asyncio.create_task(multiplayer_pair(f'pair{index}', server, stats, catalog, options, deadline)))
+    await asyncio.sleep(max(0.0, started + options.ramp_up - time.monotonic()))
+    # Считаем только установившийся режим, после подключения всех клиентов
+    stats.recording = True
+    measured_from = time.monotonic()
+    await asyncio.sleep(max(0.0, deadline - measured_from))
+    stats.recording = False
+    elapsed = time.monotonic() - measured_from
+    # Клиенты заканчивают по сроку; зависшие запросы не ждем дольше таймаута
+    await asyncio.wait(tasks, timeout=options.timeout)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats.report(elapsed)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_healthy(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'{base_url}/health', timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'сервер {base_url} не ответил на /health за {timeout} с')
+
+
+def start_gunicorn(port, workers, threads, options, directory):
+    """gunicorn с чистой базой в directory; вывод приложения — в directory/gunicorn.log"""
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + os.path.join(directory, 'load.db'),
+               ARCHIVE_INTERVAL='0')
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--worker-class', 'gthread', '--threads', str(threads),
+               '--worker-connections', str(options.bot_players + 2 * options.pairs + 100),
+               '--keep-alive', str(options.keep_alive), '--timeout', '120', 'app:app']
+    log = open(os.path.join(directory, 'gunicorn.log'), 'w')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    process.log = log
+    return process
+
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    process.log.close()
+
+
+def load_catalog(base_url):
+    with urllib.request.urlopen(f'{base_url}/verbs/catalog', timeout=10) as response:
+        return [tuple(card) for card in json.load(response)['cards']]
+
+
+def run_config(base_url, options):
+    wait_until_healthy(base_url)
+    catalog = load_catalog(base_url)
+    parsed = urllib.parse.urlsplit(base_url)
+    return asyncio.run(run_load((parsed.hostname, parsed.port or 80), catalog, options))
+
+
+def print_report(name, report):
+    print(f"\n== {name}: {report['requests_per_second']:.0f} запросов/с, "
+          f"ошибок {report['errors']}, «игра не найдена» {report['not_found']}, "
+          f"доиграно партий {report['games_finished']}")
+    for route, result in report['routes'].items():
+        print(f"  {route:<6} {result['per_second']:8.1f}/с  p50 {result['p50_ms'] or 0:8.1f} мс  "
+              f"p90 {result['p90_ms'] or 0:8.1f} мс  p99 {result['p99_ms'] or 0:8.1f} мс  "
+              f"ошибки {result['error_rate']:.2%}  не найдена {result['not_found']}")
+        if result['histogram_ms']:
+            print('         ' + '  '.join(f"{bucket}: {count}" for bucket, count in result['histogram_ms'].items()))
+        for message, count in result['messages'].items():
+            print(f"         отказ x{count}: {message}")
+
+
+def raise_open_files_limit(connections):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, max(soft, connections + 256))
+    if wanted > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bot-players', type=int, default=1000, help='игроков против бота')
+    parser.add_argument('--pairs', type=int, default=250, help='мультиплеерных пар')
+    parser.add_argument('--configs', default='1x32,2x16,4x8', help='конфигурации gunicorn: воркеров x потоков')
+    parser.add_argument('--url', help='нагружать уже запущенный сервер вместо запуска gunicorn')
+    parser.add_argument('--duration', type=float, default=60, help='секунд замера после подключения всех клиентов')
+    parser.add_argument('--ramp-up', type=float, default=20, help='за сколько секунд подключаются клиенты')
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    parser.add_argument('--long-poll', action='store_true', help='длинный опрос since=&wait= вместо опроса по таймеру')
+    parser.add_argument('--long-poll-wait', type=float, default=25)
+    parser.add_argument('--think-time', type=float, default=0.5, help='максимальная пауза перед ходом, с')
+    parser.add_argument('--timeout', type=float, default=60, help='таймаут запроса, с')
+    parser.add_argument('--keep-alive', type=int, default=5, help='keep-alive gunicorn, с')
+    parser.add_argument('--output', help='куда записать результаты в JSON')
+    options = parser.parse_args()
+
+    raise_open_files_limit(options.bot_players + 2 * options.pairs)
+    results = {"options": vars(options), "runs": {}}
+    if options.url:
+        report = run_config(options.url.rstrip('/'), options)
+        results["runs"][options.url] = report
+        print_report(options.url, report)
+    else:
+        if shutil.which('gunicorn') is None and subprocess.call(
+                [sys.executable, '-c', 'import gunicorn'], stderr=subprocess.DEVNULL):
+            parser.error('gunicorn не установлен (pip install -r requirements.txt)')
+        for config in options.configs.split(','):
+            workers, threads = (int(value) for value in config.lower().split('x'))
+            port = free_port()
+            with tempfile.TemporaryDirectory(prefix='load_test_') as directory:
+                process = start_gunicorn(port, workers, threads, options, directory)
+                try:
+                    report = run_config(f'http://127.0.0.1:{port}', options)
+                finally:
+                    stop_gunicorn(process)
+            name = f'{workers} воркеров x {threads} потоков'
+            results["runs"][config] = report
+            print_report(name, report)
+
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
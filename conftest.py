@@ -0,0 +1,8 @@
+"""Общие настройки pytest.
+
+Тесты работают с SQLite в памяти (GAME_STORAGE=memory), чтобы не трогать
+instance/game.db. Переменная должна быть задана до импорта app.
+"""
+import os
+
+os.environ.setdefault('GAME_STORAGE', 'memory')
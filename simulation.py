@@ -0,0 +1,150 @@
+"""Быстрая симуляция партий бот против бота без Flask-запросов и базы данных.
+
+Правила берутся из app.Game (play_card, bot_move, pass_turn, replace_top_card);
+за игрока ходит та же стратегия, что и у бота: первая подходящая карта,
+иначе взять карту. Партии разбиваются на пачки и считаются в пуле процессов.
+
+Запуск:
+    python simulation.py [--games 100000] [--workers 8] [--hand-size 10] [--pass-limit 2] [--bot-strategy first]
+
+С --bot-strategy бот играет выбранной стратегией (см. app.BOT_STRATEGIES),
+а игрок — по-прежнему первой подходящей картой: так видно, насколько
+стратегия сильнее простой.
+"""
+import argparse
+import os
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Движку база не нужна, но app создает таблицы при импорте — держим их в памяти
+os.environ.setdefault('GAME_STORAGE', 'memory')
+
+from app import Game  # noqa: E402
+
+
+class SimulatedGame(Game):
+    """Игра только в памяти, без журнала ходов"""
+    record_moves = False
+
+
+def game_class(hand_size=Game.HAND_SIZE, pass_limit=Game.PASS_LIMIT):
+    """Класс игры с заданными правилами"""
+    return type('SimulatedGame', (SimulatedGame,), {"HAND_SIZE": hand_size, "PASS_LIMIT": pass_limit})
+
+
+def play_game(game, max_rounds=1000):
+    """Доигрывает партию. Возвращает исход ('player', 'opponent' или 'stalemate') и число раундов.
+
+    Раунд — ход игрока и ответ бота. Ничья, если колода пуста и за раунд
+    ничего не изменилось (дальше игра зациклится), или раундов больше max_rounds.
+    """
+    rounds = 0
+    while game.current_turn != "over" and rounds < max_rounds:
+        rounds += 1
+        position = (len(game.players["player"]), len(game.players["opponent"]), game.discard_pile[-1])
+        if game.current_turn == "opponent":
+            game.bot_move()
+        else:
+            card = game.players["player"].playable_card(game.discard_pile[-1])
+            if card is not None:
+                # После хода игрока бот отвечает внутри play_card
+                game.play_card("player", card)
+            else:
+                game.pass_turn("player")
+                if game.current_turn == "opponent":
+                    game.bot_move()
+        if not game.deck and game.current_turn != "over" and position == (
+                len(game.players["player"]), len(game.players["opponent"]), game.discard_pile[-1]):
+            return "stalemate", rounds
+    if game.current_turn != "over":
+        return "stalemate", rounds
+    return ("player" if not game.players["player"] else "opponent"), rounds
+
+
+def simulate_batch(seeds, hand_size=Game.HAND_SIZE, pass_limit=Game.PASS_LIMIT, max_rounds=1000, bot_strategy=None):
+    """Играет партии с сидами seeds; возвращает счетчики для merge_results"""
+    rules = game_class(hand_size, pass_limit)
+    outcomes = Counter()
+    lengths = Counter()
+    no_playable_start = 0
+    for seed in seeds:
+        game = rules(seed=seed)
+        game.bot_strategy = bot_strategy
+        # Без подходящей карты в начальной руке игрок сразу добирает карту
+        if len(game.players["player"]) > hand_size:
+            no_playable_start += 1
+        outcome, rounds = play_game(game, max_rounds)
+        outcomes[outcome] += 1
+        lengths[rounds] += 1
+    return {"outcomes": outcomes, "lengths": lengths, "no_playable_start": no_playable_start}
+
+
+def merge_results(results):
+    total = {"outcomes": Counter(), "lengths": Counter(), "no_playable_start": 0}
+    for result in results:
+        total["outcomes"].update(result["outcomes"])
+        total["lengths"].update(result["lengths"])
+        total["no_playable_start"] += result["no_playable_start"]
+    return total
+
+
+def summarize(total, elapsed):
+    """Итоговая статистика: доли исходов, длины партий в раундах, партий в секунду"""
+    games = sum(total["outcomes"].values())
+    lengths = sorted(total["lengths"].elements())
+    return {
+        "games": games,
+        "player_win_rate": total["outcomes"]["player"] / games,
+        "opponent_win_rate": total["outcomes"]["opponent"] / games,
+        "stalemate_rate": total["outcomes"]["stalemate"] / games,
+        "no_playable_start_rate": total["no_playable_start"] / games,
+        "rounds_mean": statistics.fmean(lengths),
+        "rounds_p50": lengths[len(lengths) // 2],
+        "rounds_p90": lengths[min(int(len(lengths) * 0.9), len(lengths) - 1)],
+        "rounds_max": lengths[-1],
+        "seconds": elapsed,
+        "games_per_second": games / elapsed if elapsed else float('inf')
+    }
+
+
+def run_simulation(games, workers=None, batch_size=1000, first_seed=0, **rules):
+    """Играет games партий с сидами first_seed... в workers процессах (1 — в текущем)"""
+    seeds = range(first_seed, first_seed + games)
+    batches = [seeds[start:start + batch_size] for start in range(0, games, batch_size)]
+    started = time.perf_counter()
+    if workers == 1:
+        results = [simulate_batch(batch, **rules) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(simulate_batch, batch, **rules) for batch in batches]
+            results = [future.result() for future in futures]
+    return summarize(merge_results(results), time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0, help='сид первой партии')
+    parser.add_argument('--hand-size', type=int, default=Game.HAND_SIZE)
+    parser.add_argument('--pass-limit', type=int, default=Game.PASS_LIMIT)
+    parser.add_argument('--max-rounds', type=int, default=1000)
+    parser.add_argument('--bot-strategy', default=None, help='стратегия бота (по умолчанию BOT_STRATEGY)')
+    args = parser.parse_args()
+
+    result = run_simulation(args.games, args.workers, args.batch_size, args.seed,
+                            hand_size=args.hand_size, pass_limit=args.pass_limit, max_rounds=args.max_rounds,
+                            bot_strategy=args.bot_strategy)
+    print(f"{result['games']} партий за {result['seconds']:.1f} с ({result['games_per_second']:.0f} партий/с)")
+    print(f"победы игрока {result['player_win_rate']:.1%}, бота {result['opponent_win_rate']:.1%}, "
+          f"ничьи {result['stalemate_rate']:.1%}")
+    print(f"нет хода с начальной руки: {result['no_playable_start_rate']:.1%}")
+    print(f"длина партии в раундах: среднее {result['rounds_mean']:.1f}, медиана {result['rounds_p50']}, "
+          f"p90 {result['rounds_p90']}, максимум {result['rounds_max']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,23 @@ let currentGameId = null;
 let playerName = null;
 let gameType = 'bot';
 let isMyTurn = false;
+// Каталог карточек: сервер присылает номера карточек, а не сами карточки
+let cardCatalog = null;
+// ETag последнего полученного состояния: сервер ответит 304, если игра не менялась
+let stateEtag = null;
+// Версия последнего полученного состояния для длинного опроса
+let stateVersion = null;
+// Сколько секунд сервер может держать запрос состояния
+const LONG_POLL_WAIT = 25;
+
+async function loadCardCatalog() {
+    if (!cardCatalog) {
+        const response = await fetch('/verbs/catalog');
+        const data = await response.json();
+        cardCatalog = data.cards;
+    }
+    return cardCatalog;
+}
 
 async function createNewGame() {
     try {
@@ -31,6 +48,8 @@ async function createNewGame() {
         if (data.success) {
             currentGameId = data.game_id;
             playerName = name;
+            stateEtag = null;
+            stateVersion = null;
             document.getElementById('current-game-id').textContent = currentGameId;
             document.getElementById('game-setup').style.display = 'none';
             document.getElementById('game-table').style.display = 'flex';
@@ -80,6 +99,8 @@ async function joinGame() {
         if (data.success) {
             currentGameId = gameId;
             playerName = name;
+            stateEtag = null;
+            stateVersion = null;
             gameType = data.game_type;
             document.getElementById('current-game-id').textContent = currentGameId;
             document.getElementById('game-setup').style.display = 'none';
@@ -96,21 +117,42 @@ async function joinGame() {
     }
 }
 
-async function updateGameState() {
-    if (!currentGameId || !playerName) return;
+// Запрашивает состояние игры; при longPoll сервер ждет изменения версии.
+// Возвращает false, если запрос не удался.
+async function updateGameState(longPoll = false) {
+    if (!currentGameId || !playerName) return true;
 
     try {
-        const url = `/game/${currentGameId}/state?player_name=${encodeURIComponent(playerName)}&t=${Date.now()}`;
-        const response = await fetch(url, {
-            method: 'GET',
-            headers: {
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '0'
-            }
-        });
+        const catalog = await loadCardCatalog();
+        let url = `/game/${currentGameId}/state?player_name=${encodeURIComponent(playerName)}&cards=ids`;
+        if (longPoll && stateVersion !== null) {
+            url += `&since=${stateVersion}&wait=${LONG_POLL_WAIT}`;
+        }
+        const headers = stateEtag ? { 'If-None-Match': stateEtag } : {};
+        const response = await fetch(url, { method: 'GET', cache: 'no-store', headers });
+        
+        // Состояние не изменилось с прошлого опроса
+        if (response.status === 304) {
+            // Retry-After: сервер не стал ждать (слишком много опросов) и просит повторить позже
+            const retryAfter = Number(response.headers.get('Retry-After'));
+            if (retryAfter) await sleep(retryAfter * 1000);
+            return true;
+        }
         
         const state = await response.json();
+        stateEtag = response.headers.get('ETag');
+        if (state.version !== undefined) {
+            stateVersion = state.version;
+        }
+        
+        // Превращаем номера карточек обратно в карточки, номера сохраняем для хода
+        if (Array.isArray(state.player_cards)) {
+            state.player_card_ids = state.player_cards;
+            state.player_cards = state.player_cards.map(cardId => catalog[cardId]);
+        }
+        if (state.discard_pile !== undefined && state.discard_pile !== null) {
+            state.discard_pile = catalog[state.discard_pile];
+        }
         
         // Логирование состояния для отладки
         console.log('Получено состояние игры:', state);
@@ -119,7 +161,7 @@ async function updateGameState() {
             document.getElementById('waiting-message').style.display = 'block';
             document.querySelector('.opponent-hand').style.display = 'none';
             document.getElementById('opponent-name').textContent = 'Ожидание противника...';
-            return;
+            return true;
         }
         
         document.getElementById('waiting-message').style.display = 'none';
@@ -189,8 +231,10 @@ async function updateGameState() {
         } else {
             document.getElementById('draw-button').style.display = 'none';
         }
+        return true;
     } catch (error) {
         console.error('Error updating game state:', error);
+        return false;
     }
 }
 
@@ -276,7 +320,7 @@ function updateUI(state) {
     playerHand.innerHTML = '';
     
     if (state.player_cards && Array.isArray(state.player_cards)) {
-        state.player_cards.forEach(card => {
+        state.player_cards.forEach((card, position) => {
             const cardElement = document.createElement('div');
             cardElement.className = 'card';
             if (!isMyTurn || state.game_over) {
@@ -296,9 +340,9 @@ function updateUI(state) {
             cardElement.dataset.difficulty = card[2];
             cardElement.dataset.translation = card[3];
             
-            // При клике отправляем карту в точном формате как она получена с сервера
+            // При клике отправляем номер карточки, полученный с сервера
             if (!state.game_over) {
-                cardElement.onclick = () => playCard(card);
+                cardElement.onclick = () => playCard(state.player_card_ids[position]);
             }
             playerHand.appendChild(cardElement);
         });
@@ -350,9 +394,22 @@ function updateUI(state) {
     }
 }
 
-// Автоматическое обновление состояния игры каждые 2 секунды
-setInterval(() => {
-    if (currentGameId) {
-        updateGameState();
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+// Автоматическое обновление состояния игры длинным опросом:
+// сервер отвечает, как только игра изменится, либо через LONG_POLL_WAIT секунд
+async function pollGameState() {
+    while (true) {
+        if (!currentGameId) {
+            await sleep(500);
+            continue;
+        }
+        const ok = await updateGameState(true);
+        if (!ok) {
+            // При ошибке не долбим сервер, а ждем как при обычном опросе
+            await sleep(2000);
+        }
     }
-}, 2000); 
\ No newline at end of file
+}
+
+pollGameState(); 
\ No newline at end of file
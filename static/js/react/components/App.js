@@ -1,8 +1,23 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import GameSetup from './GameSetup';
 import GameTable from './GameTable';
 import Notification from './Notification';
 
+// Каталог карточек загружается один раз: сервер присылает только номера карточек
+let cardCatalogPromise = null;
+const loadCardCatalog = () => {
+  if (!cardCatalogPromise) {
+    cardCatalogPromise = fetch('/verbs/catalog')
+      .then(response => response.json())
+      .then(data => data.cards)
+      .catch(error => {
+        cardCatalogPromise = null;
+        throw error;
+      });
+  }
+  return cardCatalogPromise;
+};
+
 const App = () => {
   // Состояние игры
   const [gameState, setGameState] = useState({
@@ -20,6 +35,12 @@ const App = () => {
     autoDrawCards: false
   });
 
+  const [cardCatalog, setCardCatalog] = useState(null);
+  // ETag последнего состояния: при неизменной игре сервер отвечает 304 без тела
+  const stateEtag = useRef(null);
+  // Версия последнего состояния для длинного опроса
+  const stateVersion = useRef(null);
+
   // Состояние уведомлений
   const [notification, setNotification] = useState(null);
 
@@ -35,23 +56,45 @@ const App = () => {
     }
   };
 
-  // Обновление состояния игры с сервера
-  const updateGameState = async () => {
-    if (!gameState.currentGameId || !gameState.playerName) return;
+  // Длинный опрос состояния (резервный режим, если SSE недоступен):
+  // сервер держит запрос, пока версия игры не изменится. Возвращает false при ошибке.
+  const updateGameState = async (signal) => {
+    if (!gameState.currentGameId || !gameState.playerName) return true;
 
     try {
-      const url = `/game/${gameState.currentGameId}/state?player_name=${encodeURIComponent(gameState.playerName)}&t=${Date.now()}`;
-      const response = await fetch(url, {
-        method: 'GET',
-        headers: {
-          'Cache-Control': 'no-cache, no-store, must-revalidate',
-          'Pragma': 'no-cache',
-          'Expires': '0'
-        }
-      });
+      let url = `/game/${gameState.currentGameId}/state?player_name=${encodeURIComponent(gameState.playerName)}&cards=ids`;
+      if (stateVersion.current !== null) {
+        url += `&since=${stateVersion.current}&wait=25`;
+      }
+      const headers = stateEtag.current ? { 'If-None-Match': stateEtag.current } : {};
+      const response = await fetch(url, { method: 'GET', cache: 'no-store', headers, signal });
       
-      const state = await response.json();
+      // Состояние не изменилось с прошлого опроса
+      if (response.status === 304) {
+        // Retry-After: сервер не стал ждать (слишком много опросов) и просит повторить позже
+        const retryAfter = Number(response.headers.get('Retry-After'));
+        if (retryAfter) await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        return true;
+      }
       
+      const state = await response.json();
+      stateEtag.current = response.headers.get('ETag');
+      if (state.version !== undefined) {
+        stateVersion.current = state.version;
+      }
+      applyGameState(state);
+      return true;
+    } catch (error) {
+      if (error.name !== 'AbortError') {
+        console.error('Error updating game state:', error);
+      }
+      return false;
+    }
+  };
+
+  // Применение состояния, полученного опросом или из потока событий
+  const applyGameState = (state) => {
+    try {
       // Обработка статуса ожидания
       if (state.status === 'waiting') {
         setGameState(prevState => ({
@@ -121,7 +164,7 @@ const App = () => {
         } : prevState;
       });
     } catch (error) {
-      console.error('Error updating game state:', error);
+      console.error('Error applying game state:', error);
     }
   };
 
@@ -220,7 +263,7 @@ const App = () => {
     }
   };
 
-  // Игровые действия
+  // Игровые действия (card — номер карточки из каталога)
   const playCard = async (card) => {
     if (!gameState.isMyTurn) {
       showNotification('Сейчас не ваш ход!');
@@ -286,14 +329,14 @@ const App = () => {
 
   // Функция для проверки наличия валидного хода
   const hasValidMove = () => {
-    if (!gameState.playerCards || !gameState.discardPile) return false;
+    if (!cardCatalog || !gameState.playerCards || gameState.discardPile === null || gameState.discardPile === undefined) return false;
     
-    const topCard = gameState.discardPile;
+    const topCard = cardCatalog[gameState.discardPile];
     const topForm = topCard[0];
     const topVerb = topCard[1];
     const topIndex = topCard[2];
     
-    for (const card of gameState.playerCards) {
+    for (const card of gameState.playerCards.map(cardId => cardCatalog[cardId])) {
       if (card[2] === topIndex || card[1] === topVerb) {
         return true;
       }
@@ -302,15 +345,54 @@ const App = () => {
     return false;
   };
 
-  // Регулярное обновление состояния игры
   useEffect(() => {
-    if (gameState.currentGameId) {
-      updateGameState();
-      
-      const intervalId = setInterval(updateGameState, 2000);
-      
-      return () => clearInterval(intervalId);
+    loadCardCatalog().then(setCardCatalog).catch(error => {
+      console.error('Error loading card catalog:', error);
+    });
+  }, []);
+
+  // Получение обновлений игры: поток событий сервера, а при его недоступности — длинный опрос
+  useEffect(() => {
+    stateEtag.current = null;
+    stateVersion.current = null;
+    if (!gameState.currentGameId) return;
+
+    let polling = false;
+    let source = null;
+    const abortController = new AbortController();
+
+    const startPolling = async () => {
+      if (polling) return;
+      polling = true;
+      while (polling) {
+        const ok = await updateGameState(abortController.signal);
+        if (!ok && polling) {
+          await new Promise(resolve => setTimeout(resolve, 2000));
+        }
+      }
+    };
+
+    if (window.EventSource) {
+      const url = `/game/${gameState.currentGameId}/events?player_name=${encodeURIComponent(gameState.playerName)}&cards=ids`;
+      source = new EventSource(url);
+      source.addEventListener('state', event => applyGameState(JSON.parse(event.data)));
+      // Игра окончена — сервер больше ничего не пришлет
+      source.addEventListener('end', () => source.close());
+      source.onerror = () => {
+        // Обрыв соединения браузер восстановит сам; если поток закрыт окончательно — опрашиваем
+        if (source.readyState === EventSource.CLOSED) {
+          startPolling();
+        }
+      };
+    } else {
+      startPolling();
     }
+
+    return () => {
+      polling = false;
+      abortController.abort();
+      if (source) source.close();
+    };
   }, [gameState.currentGameId, gameState.playerName]);
 
   return (
@@ -332,6 +414,7 @@ const App = () => {
       ) : (
         <GameTable 
           gameState={gameState}
+          cardCatalog={cardCatalog}
           onPlayCard={playCard}
           onDrawCard={drawCard}
           hasValidMove={hasValidMove}
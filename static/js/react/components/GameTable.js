@@ -3,7 +3,7 @@ import Card from './Card';
 import OpponentCard from './OpponentCard';
 
 // Используем React.memo для предотвращения ненужных перерисовок
-const GameTable = memo(({ gameState, onPlayCard, onDrawCard, hasValidMove }) => {
+const GameTable = memo(({ gameState, cardCatalog, onPlayCard, onDrawCard, hasValidMove }) => {
   const { 
     currentGameId, 
     playerName, 
@@ -20,14 +20,15 @@ const GameTable = memo(({ gameState, onPlayCard, onDrawCard, hasValidMove }) =>
 
   // Отображение карт игрока
   const renderPlayerCards = () => {
-    if (!playerCards || !Array.isArray(playerCards)) return null;
+    if (!cardCatalog || !playerCards || !Array.isArray(playerCards)) return null;
     
-    return playerCards.map((card, index) => (
+    // playerCards содержит номера карточек из каталога
+    return playerCards.map((cardId, index) => (
       <Card 
-        key={`player-card-${index}-${card[0]}`}
-        card={card} 
+        key={`player-card-${index}-${cardId}`}
+        card={cardCatalog[cardId]} 
         disabled={!isMyTurn || gameOver}
-        onClick={() => onPlayCard(card)}
+        onClick={() => onPlayCard(cardId)}
       />
     ));
   };
@@ -69,8 +70,8 @@ const GameTable = memo(({ gameState, onPlayCard, onDrawCard, hasValidMove }) =>
       {/* Центральная область */}
       <div className="play-area">
         <div className="discard-pile">
-          {discardPile && (
-            <Card card={discardPile} isDiscard={true} />
+          {cardCatalog && discardPile !== null && discardPile !== undefined && (
+            <Card card={cardCatalog[discardPile]} isDiscard={true} />
           )}
         </div>
         <div className="turn-indicator">{getTurnText()}</div>
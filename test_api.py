@@ -1,12 +1,13 @@
 import unittest
 import json
-from app import app, db, GameState
+import threading
+from sqlalchemy import event
+from app import app, db, GameState, Game, games, bot_moves, StaleGameError, verb_registry, encode_card, decode_card, state_views, StateViewCache, StateView, WaitingRoom
 
 class TestAPI(unittest.TestCase):
     def setUp(self):
         # Настраиваем тестовый клиент и контекст приложения
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         self.app_context = app.app_context()
         self.app_context.push()
         db.create_all()
@@ -39,6 +40,134 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(game_state.player_name, 'TestPlayer')
         self.assertEqual(game_state.game_type, 'bot')
     
+    def test_create_game_with_bot_strategy(self):
+        """Проверка выбора стратегии бота при создании игры"""
+        data = self.client.post('/game/new', json={'player_name': 'TestPlayer', 'bot_strategy': 'montecarlo'}).get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual(GameState.query.get(data['game_id']).bot_strategy, 'montecarlo')
+        
+        data = self.client.post('/game/new', json={'player_name': 'TestPlayer', 'bot_strategy': 'genius'}).get_json()
+        self.assertFalse(data['success'])
+    
+    def test_create_game_from_seed(self):
+        """Проверка, что игра с одним и тем же сидом начинается одинаково"""
+        states = []
+        for _ in range(2):
+            data = self.client.post('/game/new', json={'player_name': 'TestPlayer', 'seed': 12345}).get_json()
+            self.assertEqual(data['seed'], 12345)
+            states.append(self.client.get(f"/game/{data['game_id']}/state?player_name=TestPlayer&cards=ids").get_json())
+        for field in ('player_cards', 'opponent_cards_count', 'discard_pile', 'current_turn'):
+            self.assertEqual(states[0][field], states[1][field])
+        
+        # Без сида он выбирается случайно и возвращается, чтобы партию можно было повторить
+        data = self.client.post('/game/new', json={'player_name': 'TestPlayer'}).get_json()
+        self.assertEqual(GameState.query.get(data['game_id']).seed, data['seed'])
+        
+        for seed in ('42', -1, 2 ** 63, True):
+            data = self.client.post('/game/new', json={'player_name': 'TestPlayer', 'seed': seed}).get_json()
+            self.assertFalse(data['success'])
+    
+    def test_metrics_endpoint(self):
+        """Проверка метрик в текстовом формате Prometheus"""
+        game_id = self.client.post('/game/new', json={'player_name': 'TestPlayer'}).get_json()['game_id']
+        self.client.get(f'/game/{game_id}/state?player_name=TestPlayer')
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.data.decode('utf-8')
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_requests_total{route="create_new_game",method="POST",status="200"}', text)
+        self.assertIn('http_request_db_queries_count{route="get_game_state"}', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="get_game_state",method="GET",le="+Inf"}', text)
+        self.assertIn('game_save_seconds_count', text)
+        self.assertIn('game_cache_size', text)
+        self.assertIn('sse_streams_active 0', text)
+    
+    def test_join_conflict_asks_to_retry(self):
+        """Проверка, что присоединение к игре, измененной другим воркером, просит повторить"""
+        game_id = self.client.post('/game/new', json={'player_name': 'Player1', 'game_type': 'multiplayer'}).get_json()['game_id']
+        
+        def bump_version(session, flush_context, instances):
+            # Другой воркер меняет запись между чтением и записью
+            with db.engine.begin() as connection:
+                connection.execute(db.text("UPDATE game_state SET version = version + 1 WHERE id = :id"), {"id": game_id})
+        
+        event.listen(db.session, 'before_flush', bump_version, once=True)
+        conflict = self.client.post(f'/game/{game_id}/join', json={'player_name': 'Player2'})
+        self.assertEqual(conflict.status_code, 200)
+        self.assertFalse(conflict.get_json()['success'])
+        
+        joined = self.client.post(f'/game/{game_id}/join', json={'player_name': 'Player2'}).get_json()
+        self.assertTrue(joined['success'])
+        db.session.expire_all()
+        self.assertEqual(GameState.query.get(game_id).opponent_name, 'Player2')
+    
+    def test_state_view_cache(self):
+        """Проверка, что /state без изменений игры отдается из кэша, а после хода собирается заново"""
+        create = self.client.post('/game/new', json={'player_name': 'Player1', 'game_type': 'multiplayer'}).get_json()
+        game_id = create['game_id']
+        self.client.post(f'/game/{game_id}/join', json={'player_name': 'Player2'})
+        
+        before = state_views.stats()
+        first = self.client.get(f'/game/{game_id}/state?player_name=Player1')
+        second = self.client.get(f'/game/{game_id}/state?player_name=Player1')
+        other = self.client.get(f'/game/{game_id}/state?player_name=Player2')
+        after = state_views.stats()
+        self.assertEqual(after["misses"] - before["misses"], 2)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertNotEqual(first.get_json()['player_cards'], other.get_json()['player_cards'])
+        
+        state = first.get_json()
+        player = 'Player1' if state['is_my_turn'] else 'Player2'
+        hand = state['player_cards'] if player == 'Player1' else other.get_json()['player_cards']
+        top = decode_card(state['discard_pile'])
+        card = next((card for card in hand if decode_card(card)[1] == top[1] or decode_card(card)[2] == top[2]), None)
+        if card is None:
+            self.client.post(f'/game/{game_id}/draw', json={'player_name': player})
+        else:
+            self.client.post(f'/game/{game_id}/play', json={'player_name': player, 'card': card})
+        changed = self.client.get(f'/game/{game_id}/state?player_name=Player1').get_json()
+        self.assertGreater(changed['version'], state['version'])
+    
+    def test_state_view_cache_coalesces_concurrent_requests(self):
+        """Проверка, что одновременные одинаковые запросы ждут одного вычисления"""
+        cache = StateViewCache()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        
+        def build():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return StateView(3, '{"version": 3}', False)
+        
+        results = []
+        leader = threading.Thread(target=lambda: results.append(cache.get('g', 3, 'A', None, build)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(cache.get('g', 3, 'A', None, build)))
+                     for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while cache.stats()["coalesced"] < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertIs(cache.get('g', 3, 'A', None, build), results[0])
+        self.assertEqual(len(calls), 1)
+        # Новая версия игры вытесняет ответы для старой
+        cache.get('g', 4, 'A', None, lambda: StateView(4, '{"version": 4}', False))
+        self.assertEqual(cache.get('g', 4, 'A', None, build).version, 4)
+    
     def test_create_multiplayer_game(self):
         """Проверка создания многопользовательской игры"""
         response = self.client.post('/game/new', 
@@ -74,6 +203,80 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(game_state.game_status, 'active')
         self.assertEqual(game_state.opponent_name, 'Player2')
     
+    def test_matchmake_pairs_oldest_waiting_player(self):
+        """Проверка очереди подбора соперника"""
+        first = self.client.post('/game/matchmake', json={'player_name': 'Queue1'}).get_json()
+        self.assertEqual(first['status'], 'queued')
+        # Повторный запрос не ставит игрока в очередь второй раз
+        again = self.client.post('/game/matchmake', json={'player_name': 'Queue1'}).get_json()
+        self.assertEqual(again['ticket'], first['ticket'])
+        
+        second = self.client.post('/game/matchmake', json={'player_name': 'Queue2'}).get_json()
+        self.assertEqual(second['status'], 'matched')
+        self.assertEqual(second['opponent_name'], 'Queue1')
+        
+        status = self.client.get(f"/game/matchmake/{first['ticket']}").get_json()
+        self.assertEqual(status['status'], 'matched')
+        self.assertEqual(status['game_id'], second['game_id'])
+        
+        game_state = GameState.query.get(second['game_id'])
+        self.assertEqual((game_state.player_name, game_state.opponent_name), ('Queue1', 'Queue2'))
+        self.assertEqual(game_state.game_status, 'active')
+        self.assertEqual(game_state.game_type, 'multiplayer')
+        
+        # Следующий игрок снова ждет и может выйти из очереди
+        third = self.client.post('/game/matchmake', json={'player_name': 'Queue3'}).get_json()
+        self.assertEqual(third['status'], 'queued')
+        self.assertTrue(self.client.delete(f"/game/matchmake/{third['ticket']}").get_json()['success'])
+        self.assertFalse(self.client.delete(f"/game/matchmake/{third['ticket']}").get_json()['success'])
+    
+    def test_lobby_lists_waiting_games(self):
+        """Проверка, что лобби показывает ожидающие игры и скрывает занятые"""
+        first_id = self.client.post('/game/new', json={'player_name': 'Lobby1', 'game_type': 'multiplayer'}).get_json()['game_id']
+        second_id = self.client.post('/game/new', json={'player_name': 'Lobby2', 'game_type': 'multiplayer'}).get_json()['game_id']
+        bot_id = self.client.post('/game/new', json={'player_name': 'Lobby3', 'game_type': 'bot'}).get_json()['game_id']
+        
+        data = self.client.get('/game/lobby?per_page=100').get_json()
+        self.assertTrue(data['success'])
+        lobby_ids = [game['game_id'] for game in data['games']]
+        self.assertIn(first_id, lobby_ids)
+        self.assertIn(second_id, lobby_ids)
+        self.assertNotIn(bot_id, lobby_ids)
+        # Новые игры идут первыми
+        self.assertLess(lobby_ids.index(second_id), lobby_ids.index(first_id))
+        
+        first_page = self.client.get('/game/lobby?per_page=1').get_json()
+        self.assertEqual(len(first_page['games']), 1)
+        self.assertEqual(first_page['total'], data['total'])
+        
+        self.client.post(f'/game/{first_id}/join', json={'player_name': 'Lobby4'})
+        lobby_ids = [game['game_id'] for game in self.client.get('/game/lobby?per_page=100').get_json()['games']]
+        self.assertNotIn(first_id, lobby_ids)
+        self.assertIn(second_id, lobby_ids)
+    
+    def test_lobby_refresh_swaps_list_atomically(self):
+        """Проверка, что во время обновления лобби из базы оно не пустеет и не теряет игры этого процесса"""
+        waiting_id = self.client.post('/game/new', json={'player_name': 'Lobby1', 'game_type': 'multiplayer'}).get_json()['game_id']
+        room = WaitingRoom(refresh_interval=60)
+        room.refresh()
+        self.assertIn(waiting_id, room)
+        seen = []
+        
+        def during_refresh(*args):
+            # Запрос к базе идет: лобби еще старое, а новая игра добавляется параллельно
+            seen.append(room.page(0, 100)[1])
+            room.add('local', 'Local', False, None)
+            room.remove(waiting_id)
+        
+        event.listen(db.engine, 'before_cursor_execute', during_refresh, once=True)
+        room.refresh(force=True)
+        self.assertGreater(seen[0], 0)
+        self.assertIn('local', room)
+        self.assertNotIn(waiting_id, room)
+        # Обновление не чаще refresh_interval
+        room.refresh()
+        self.assertIn('local', room)
+    
     def test_get_game_state(self):
         """Проверка получения состояния игры"""
         # Создаем игру
@@ -149,6 +352,141 @@ class TestAPI(unittest.TestCase):
         self.assertIn('success', draw_data)
         self.assertIn('message', draw_data)
     
+    def test_multiplayer_draw_keeps_game_type(self):
+        """Проверка, что взятие карты в игре двух игроков не превращает ее в игру с ботом"""
+        game_id = self.client.post('/game/new', json={'player_name': 'Player1', 'game_type': 'multiplayer'}).get_json()['game_id']
+        self.client.post(f'/game/{game_id}/join', json={'player_name': 'Player2'})
+        
+        # Оставляем первому игроку только карту, которую нельзя положить
+        game = games.load(game_id)
+        top = game.discard_pile[-1]
+        card = next(card for card in verb_registry.deck_template if card[1] != top[1] and card[2] != top[2])
+        game.current_turn = "player"
+        game.players["player"] = [card]
+        game.save_state(game_id)
+        self.assertEqual(GameState.query.get(game_id).game_type, 'multiplayer')
+        
+        response = self.client.post(f'/game/{game_id}/draw', json={'player_name': 'Player1'}).get_json()
+        self.assertTrue(response['success'])
+        self.assertTrue(bot_moves.wait(5))
+        db.session.expire_all()
+        game_state = GameState.query.get(game_id)
+        self.assertEqual(game_state.game_type, 'multiplayer')
+        self.assertEqual(game_state.current_turn, 'opponent')
+        state = self.client.get(f'/game/{game_id}/state?player_name=Player2').get_json()
+        self.assertTrue(state['is_my_turn'])
+        self.assertEqual(state['opponent_name'], 'Player1')
+    
+    def test_card_catalog(self):
+        """Проверка каталога карточек и его кэширования по ETag"""
+        response = self.client.get('/verbs/catalog')
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['cards']), len(verb_registry.deck_template))
+        for card_id, card in enumerate(data['cards'][:8]):
+            self.assertEqual(encode_card(card), card_id)
+        
+        cached = self.client.get('/verbs/catalog', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b'')
+    
+    def test_state_with_card_ids(self):
+        """Проверка состояния игры с номерами карточек и хода номером карточки"""
+        create_response = self.client.post('/game/new', 
+                         json={'player_name': 'TestPlayer', 'game_type': 'bot'})
+        game_id = json.loads(create_response.data)['game_id']
+        
+        # В базе карточки хранятся номерами
+        game_state = GameState.query.get(game_id)
+        self.assertTrue(all(isinstance(card, int) for card in game_state.player_cards))
+        
+        full = json.loads(self.client.get(f'/game/{game_id}/state?player_name=TestPlayer').data)
+        compact = json.loads(self.client.get(f'/game/{game_id}/state?player_name=TestPlayer&cards=ids').data)
+        self.assertEqual([list(decode_card(card)) for card in compact['player_cards']], full['player_cards'])
+        self.assertEqual(list(decode_card(compact['discard_pile'])), full['discard_pile'])
+        
+        top = decode_card(compact['discard_pile'])
+        playable = [card for card in compact['player_cards']
+                    if decode_card(card)[1] == top[1] or decode_card(card)[2] == top[2]]
+        if playable:
+            play_response = self.client.post(f'/game/{game_id}/play', 
+                              json={'card': playable[0], 'player_name': 'TestPlayer'})
+            self.assertTrue(json.loads(play_response.data)['success'])
+    
+    def test_play_unknown_card(self):
+        """Проверка хода несуществующей карточкой"""
+        create_response = self.client.post('/game/new', 
+                         json={'player_name': 'TestPlayer', 'game_type': 'bot'})
+        game_id = json.loads(create_response.data)['game_id']
+        
+        for card in (10 ** 6, ['x', 'nichtda', 0, 'y'], None):
+            response = self.client.post(f'/game/{game_id}/play', 
+                             json={'card': card, 'player_name': 'TestPlayer'})
+            self.assertFalse(json.loads(response.data)['success'])
+    
+    def test_state_not_modified(self):
+        """Проверка условного запроса состояния по ETag"""
+        create_response = self.client.post('/game/new', 
+                         json={'player_name': 'TestPlayer', 'game_type': 'multiplayer'})
+        game_id = json.loads(create_response.data)['game_id']
+        url = f'/game/{game_id}/state?player_name=TestPlayer'
+        
+        first = self.client.get(url)
+        etag = first.headers['ETag']
+        cached = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b'')
+        
+        # После подключения соперника версия растет и состояние отдается заново
+        self.client.post(f'/game/{game_id}/join', json={'player_name': 'Player2'})
+        changed = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+        self.assertGreater(json.loads(changed.data)['version'], json.loads(first.data)['version'])
+        
+        # ETag зависит от места игрока
+        second_seat = self.client.get(f'/game/{game_id}/state?player_name=Player2',
+                                      headers={'If-None-Match': changed.headers['ETag']})
+        self.assertEqual(second_seat.status_code, 200)
+    
+    def test_request_on_another_worker(self):
+        """Проверка хода в игре, которой нет в памяти этого процесса (другой воркер)"""
+        create_response = self.client.post('/game/new', 
+                         json={'player_name': 'TestPlayer', 'game_type': 'bot'})
+        game_id = json.loads(create_response.data)['game_id']
+        games.clear()
+        
+        draw_response = self.client.post(f'/game/{game_id}/draw', 
+                             json={'player_name': 'TestPlayer'})
+        draw_data = json.loads(draw_response.data)
+        self.assertNotEqual(draw_data['message'], "Игра не найдена!")
+        self.assertIn(game_id, games)
+    
+    def test_stale_copy_is_reloaded(self):
+        """Проверка, что устаревшая копия игры в памяти перечитывается из базы"""
+        create_response = self.client.post('/game/new', 
+                         json={'player_name': 'Player1', 'game_type': 'multiplayer'})
+        game_id = json.loads(create_response.data)['game_id']
+        cached = games.get(game_id)
+        
+        # Другой воркер меняет игру в базе
+        other_worker_copy = Game(game_id)
+        other_worker_copy.current_turn = "opponent"
+        other_worker_copy.save_state(game_id, game_type='multiplayer')
+        
+        loaded = games.load(game_id)
+        self.assertIsNot(loaded, cached)
+        self.assertEqual(loaded.current_turn, "opponent")
+        self.assertEqual(loaded.version, GameState.query.get(game_id).version)
+        
+        # Сохранение устаревшей копии не затирает чужие изменения
+        cached.current_turn = "player"
+        with self.assertRaises(StaleGameError):
+            cached.save_state(game_id, game_type='multiplayer')
+        db.session.rollback()
+        self.assertEqual(GameState.query.get(game_id).current_turn, "opponent")
+    
     def test_join_nonexistent_game(self):
         """Проверка попытки присоединиться к несуществующей игре"""
         response = self.client.post('/game/nonexistent/join', 
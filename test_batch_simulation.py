@@ -0,0 +1,47 @@
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from simulation import game_class, play_game
+
+OUTCOMES = {"player": 0, "opponent": 1, "stalemate": 2}
+
+@unittest.skipIf(np is None, "нужен numpy")
+class TestBatchSimulation(unittest.TestCase):
+    def assert_matches_engine(self, seeds, hand_size=10, pass_limit=2):
+        from batch_simulation import BatchSimulation, seeded_decks, python_positions
+        decks, rngs = seeded_decks(seeds)
+        batch = BatchSimulation(decks, hand_size, pass_limit, python_positions(rngs))
+        outcome, rounds = batch.run()
+
+        rules = game_class(hand_size, pass_limit)
+        for row, seed in enumerate(seeds):
+            game = rules(seed=seed)
+            no_playable_start = len(game.players["player"]) > hand_size
+            result, length = play_game(game)
+            self.assertEqual(
+                (OUTCOMES[result], length, no_playable_start),
+                (outcome[row], rounds[row], batch.no_playable_start[row]),
+                f"партия с сидом {seed}"
+            )
+
+    def test_matches_scalar_engine(self):
+        """Проверка, что пакетная симуляция играет партии так же, как Game"""
+        self.assert_matches_engine(range(200))
+
+    def test_matches_scalar_engine_with_other_rules(self):
+        """Проверка совпадения с Game при другом размере сдачи и лимите пропусков"""
+        self.assert_matches_engine(range(100), hand_size=6, pass_limit=3)
+
+    def test_opening_check(self):
+        """Проверка быстрой оценки начальных рук без хода"""
+        from batch_simulation import BatchSimulation, opening_no_playable, random_decks
+        decks = random_decks(500, np.random.default_rng(7))
+        batch = BatchSimulation(decks)
+        np.testing.assert_array_equal(opening_no_playable(decks), batch.no_playable_start)
+
+if __name__ == '__main__':
+    unittest.main()
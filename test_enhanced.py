@@ -1,7 +1,15 @@
 import unittest
-from app import Game, GameState, db, app, load_verbs
+from unittest import mock
+from app import Game, GameState, GameMove, GameRepository, db, app, load_verbs, verb_registry, VerbRegistry, replay_game, configure_storage, set_sqlite_pragmas, archive_games, GameArchive, GameLog, StructuredFormatter
 import shortuuid
+from sqlalchemy import create_engine, event
 import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
 
 class TestGameEnhanced(unittest.TestCase):
     def setUp(self):
@@ -60,6 +68,56 @@ class TestGameEnhanced(unittest.TestCase):
         self.assertIsInstance(verbs, list)
         self.assertTrue(len(verbs) > 0)
     
+    def test_verb_registry_lookups(self):
+        """Проверка поиска в каталоге глаголов по инфинитиву, форме и переводу"""
+        verb = verb_registry.get("gehen")
+        self.assertEqual(verb["prateritum"], "ging")
+        self.assertIs(verb_registry.by_form("ging", 2), verb)
+        self.assertIsNone(verb_registry.by_form("ging", 1))
+        self.assertIn(verb, verb_registry.by_translation("идти"))
+        self.assertEqual(verb_registry.form("gehen", 3), "gegangen")
+        self.assertIn("gehen", verb_registry)
+        self.assertNotIn("nichtda", verb_registry)
+
+    def test_verb_registry_is_shared_and_read_only(self):
+        """Проверка, что игры используют один и тот же неизменяемый каталог"""
+        self.assertIs(Game().verbs, Game().verbs)
+        with self.assertRaises(TypeError):
+            verb_registry.get("gehen")["translation"] = "бежать"
+
+    def test_verb_registry_hot_reload(self):
+        """Проверка перезагрузки каталога при изменении файла"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "verbs.json")
+            verb = {"infinitive": "gehen", "prasens_3": "geht", "prateritum": "ging",
+                    "partizip_2": "gegangen", "translation": "идти"}
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"verbs": [verb]}, f)
+            registry = VerbRegistry(path, check_interval=0)
+            self.assertEqual(len(registry), 1)
+            old = registry.catalog
+
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"verbs": [verb, dict(verb, infinitive="laufen")]}, f)
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+
+            self.assertEqual(len(registry), 2)
+            self.assertIsNotNone(registry.get("laufen"))
+            # Старый снимок не изменился: индексы и версия подменены вместе
+            self.assertIsNot(registry.catalog, old)
+            self.assertEqual(len(old.deck_template), 4)
+            self.assertNotIn("laufen", old.verb_ids)
+            self.assertNotEqual(old.version, registry.catalog_version)
+
+            # Перестановка известных глаголов поменяла бы смысл номеров карточек
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"verbs": [dict(verb, infinitive="laufen"), verb]}, f)
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 2_000_000))
+
+            self.assertFalse(registry.refresh(force=True))
+            self.assertEqual(registry.card_id(("gegangen", "gehen", 3, "идти")), 3)
+            self.assertEqual([verb["infinitive"] for verb in registry], ["gehen", "laufen"])
+
     def test_game_initialization_with_id(self):
         """Проверка инициализации игры с существующим ID"""
         # Создаем тестовую игру и сохраняем ее
@@ -83,6 +141,310 @@ class TestGameEnhanced(unittest.TestCase):
                 db.session.delete(game_state)
                 db.session.commit()
                 
+    def save_test_games(self, count):
+        ids = []
+        for _ in range(count):
+            game_id = "test_" + shortuuid.uuid()[:6]
+            Game().save_state(game_id, "TestPlayer")
+            ids.append(game_id)
+        return ids
+
+    def delete_test_games(self, ids):
+        for game_id in ids:
+            game_state = GameState.query.get(game_id)
+            if game_state:
+                db.session.delete(game_state)
+            GameMove.query.filter_by(game_id=game_id).delete()
+        db.session.commit()
+
+    def test_game_cache_lru_eviction(self):
+        """Проверка вытеснения давно использованных игр из кэша"""
+        ids = self.save_test_games(3)
+        try:
+            cache = GameRepository(max_size=2, ttl=3600)
+            cache.load(ids[0])
+            cache.load(ids[1])
+            cache.load(ids[0])  # ids[1] теперь самая давняя
+            cache.load(ids[2])
+            
+            self.assertIn(ids[0], cache)
+            self.assertNotIn(ids[1], cache)
+            self.assertIn(ids[2], cache)
+            stats = cache.stats()
+            self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (1, 3, 1))
+        finally:
+            self.delete_test_games(ids)
+
+    def test_game_cache_ttl_writes_back_dirty_game(self):
+        """Проверка, что просроченная игра с изменениями записывается в базу при вытеснении"""
+        ids = self.save_test_games(2)
+        try:
+            cache = GameRepository(max_size=10, ttl=0)
+            game = cache.load(ids[0])
+            self.assertFalse(game.is_dirty())
+            initial_cards = len(game.players["player"])
+            game.pull_one_more_card("player")
+            self.assertTrue(game.is_dirty())
+            
+            cache.load(ids[1])  # вытесняет просроченную ids[0]
+            
+            self.assertNotIn(ids[0], cache)
+            stats = cache.stats()
+            self.assertEqual(stats["expirations"], 1)
+            self.assertEqual(stats["writebacks"], 1)
+            self.assertEqual(len(Game(ids[0]).players["player"]), initial_cards + 1)
+        finally:
+            self.delete_test_games(ids)
+
+    def test_game_cache_expire_without_new_games(self):
+        """Проверка, что просроченная игра записывается в базу и без добавления новых игр"""
+        ids = self.save_test_games(1)
+        try:
+            cache = GameRepository(max_size=10, ttl=3600)
+            game = cache.load(ids[0])
+            initial_cards = len(game.players["player"])
+            game.pull_one_more_card("player")
+            
+            cache.ttl = 0
+            cache.expire()
+            
+            self.assertNotIn(ids[0], cache)
+            stats = cache.stats()
+            self.assertEqual((stats["expirations"], stats["writebacks"]), (1, 1))
+            self.assertEqual(len(Game(ids[0]).players["player"]), initial_cards + 1)
+        finally:
+            self.delete_test_games(ids)
+
+    def test_game_cache_miss_does_not_block_other_games(self):
+        """Проверка, что загрузка игры не сдает новую колоду и не ждет блокировку другой игры"""
+        ids = self.save_test_games(2)
+        cache = GameRepository()
+        held = threading.Event()
+        release = threading.Event()
+        
+        def hold_first_game():
+            with cache.lock(ids[0]):
+                held.set()
+                release.wait(5)
+        
+        holder = threading.Thread(target=hold_first_game)
+        holder.start()
+        build_deck = Game.build_deck
+        try:
+            held.wait(5)
+            Game.build_deck = lambda game: self.fail("колода собирается заново при загрузке")
+            started = time.monotonic()
+            game = cache.load(ids[1])
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertEqual(game.snapshot(), Game.from_state(GameState.query.get(ids[1])).snapshot())
+        finally:
+            Game.build_deck = build_deck
+            release.set()
+            holder.join()
+            self.delete_test_games(ids)
+
+    def test_archive_finished_and_abandoned_games(self):
+        """Проверка переноса завершенных и брошенных игр в архив"""
+        finished_id, active_id = self.save_test_games(2)
+        waiting_id = "test_" + shortuuid.uuid()[:6]
+        Game().save_state(waiting_id, "Waiting", game_type="multiplayer")
+        grace, ttl = app.config['FINISHED_GAME_GRACE'], app.config['WAITING_GAME_TTL']
+        app.config['FINISHED_GAME_GRACE'] = 0
+        app.config['WAITING_GAME_TTL'] = 3600
+        try:
+            game = Game(finished_id)
+            game.players["player"] = []
+            game.save_state(finished_id)
+            game_state = GameState.query.get(waiting_id)
+            game_state.created_at = game_state.created_at - timedelta(hours=2)
+            db.session.commit()
+            
+            total = {"finished": 0, "expired": 0, "rows": 0, "bytes": 0}
+            while True:
+                report = archive_games()
+                for key, value in report.items():
+                    total[key] += value
+                if report["finished"] + report["expired"] == 0:
+                    break
+            
+            self.assertGreaterEqual(total["finished"], 1)
+            self.assertGreaterEqual(total["expired"], 1)
+            self.assertGreater(total["bytes"], 0)
+            self.assertIsNone(GameState.query.get(finished_id))
+            self.assertIsNone(GameState.query.get(waiting_id))
+            self.assertIsNotNone(GameState.query.get(active_id))
+            self.assertEqual(GameMove.query.filter_by(game_id=finished_id).count(), 0)
+            
+            archive = GameArchive.query.get(finished_id)
+            self.assertEqual(archive.outcome, 'player')
+            self.assertEqual([move[1] for move in archive.moves], ['create', 'snapshot'])
+            self.assertEqual(GameArchive.query.get(waiting_id).outcome, 'expired')
+        finally:
+            app.config['FINISHED_GAME_GRACE'], app.config['WAITING_GAME_TTL'] = grace, ttl
+            self.delete_test_games([finished_id, active_id, waiting_id])
+            GameArchive.query.filter(GameArchive.id.in_([finished_id, waiting_id])).delete()
+            db.session.commit()
+
+    def test_storage_backends(self):
+        """Проверка выбора хранилища игр по конфигурации"""
+        config = {'DATABASE_POOL_SIZE': 4}
+        configure_storage(config, 'memory', 'sqlite:///ignored.db')
+        self.assertIn('vfs=memdb', config['SQLALCHEMY_DATABASE_URI'])
+        self.assertEqual(config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'], 4)
+        
+        # SQLite в памяти через DATABASE_URL тоже получает хранилище memory
+        for url in ('sqlite://', 'sqlite:///:memory:'):
+            configure_storage(config, 'sqlite', url)
+            self.assertEqual(config['GAME_STORAGE'], 'memory')
+            self.assertIn('vfs=memdb', config['SQLALCHEMY_DATABASE_URI'])
+        
+        configure_storage(config, 'sqlite', 'sqlite:///game.db')
+        self.assertEqual(config['SQLALCHEMY_DATABASE_URI'], 'sqlite:///game.db')
+        self.assertEqual(config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'], 4)
+        self.assertIn('timeout', config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'])
+        
+        with self.assertRaises(ValueError):
+            configure_storage(config, 'redis', 'sqlite:///game.db')
+
+    def test_sqlite_storage_uses_wal(self):
+        """Проверка, что файл SQLite открыт в режиме WAL"""
+        with tempfile.TemporaryDirectory() as tmp:
+            config = {}
+            configure_storage(config, 'sqlite', 'sqlite:///' + os.path.join(tmp, 'game.db'))
+            engine = create_engine(config['SQLALCHEMY_DATABASE_URI'], **config['SQLALCHEMY_ENGINE_OPTIONS'])
+            event.listen(engine, 'connect', set_sqlite_pragmas)
+            try:
+                with engine.connect() as connection:
+                    self.assertEqual(connection.execute(db.text('PRAGMA journal_mode')).scalar(), 'wal')
+            finally:
+                engine.dispose()
+
+    def test_move_log_replays_to_current_state(self):
+        """Проверка, что ходы пишутся в журнал и состояние восстанавливается из снимка и журнала"""
+        ids = self.save_test_games(1)
+        try:
+            game = Game(ids[0])
+            game.pull_one_more_card("player")
+            game.bot_move()
+            game.save_state(ids[0])
+            
+            kinds = [move.kind for move in GameMove.query.filter_by(game_id=ids[0]).order_by(GameMove.seq)]
+            self.assertEqual(kinds[:2], ['create', 'draw'])
+            self.assertIn(kinds[2], ('bot_play', 'bot_draw'))
+            # Снимок в GameState не переписывался, состояние собирается из журнала
+            game_state = GameState.query.get(ids[0])
+            self.assertEqual((game_state.snapshot_seq, game_state.move_seq), (1, len(kinds)))
+            self.assertEqual(Game(ids[0]).snapshot(), game.snapshot())
+            self.assertEqual(replay_game(ids[0]), game.snapshot())
+        finally:
+            self.delete_test_games(ids)
+
+    def test_move_log_periodic_snapshot(self):
+        """Проверка, что полный снимок записывается раз в GAME_SNAPSHOT_INTERVAL ходов"""
+        ids = self.save_test_games(1)
+        interval = app.config['GAME_SNAPSHOT_INTERVAL']
+        app.config['GAME_SNAPSHOT_INTERVAL'] = 2
+        try:
+            game = Game(ids[0])
+            game.pull_one_more_card("player")
+            game.save_state(ids[0])
+            self.assertEqual(GameState.query.get(ids[0]).snapshot_seq, 1)
+            game.pull_one_more_card("opponent")
+            game.save_state(ids[0])
+            
+            game_state = GameState.query.get(ids[0])
+            self.assertEqual(game_state.snapshot_seq, 3)
+            self.assertEqual(game_state.player_cards, game.snapshot()["player_cards"])
+            self.assertEqual(game_state.opponent_cards, game.snapshot()["opponent_cards"])
+        finally:
+            app.config['GAME_SNAPSHOT_INTERVAL'] = interval
+            self.delete_test_games(ids)
+
+    def test_move_log_records_direct_changes_as_snapshot(self):
+        """Проверка, что изменения в обход ходов попадают в журнал полным снимком"""
+        ids = self.save_test_games(1)
+        try:
+            game = Game(ids[0])
+            game.players["player"] = game.players["player"][:1]
+            game.save_state(ids[0])
+            
+            last = GameMove.query.filter_by(game_id=ids[0]).order_by(GameMove.seq.desc()).first()
+            self.assertEqual(last.kind, 'snapshot')
+            self.assertEqual(len(Game(ids[0]).players["player"]), 1)
+            self.assertEqual(replay_game(ids[0], seq=1)["player_cards"], GameMove.query.filter_by(game_id=ids[0], seq=1).one().data["player_cards"])
+        finally:
+            self.delete_test_games(ids)
+
+    def test_seeded_rng_survives_reload(self):
+        """Проверка, что генератор игры с сидом после загрузки из базы продолжает ту же последовательность"""
+        game_id = shortuuid.uuid()[:8]
+        game = Game(seed=7)
+        game.save_state(game_id)
+        try:
+            self.assertEqual(GameState.query.get(game_id).seed, 7)
+            self.assertEqual(Game(seed=7).snapshot(), Game(game_id).snapshot())
+            for _ in range(3):
+                game.discard_card("player", game.players["player"][0])
+                game.replace_top_card()
+            game.save_state(game_id)
+            
+            loaded = Game(game_id)
+            self.assertEqual(loaded.seed, 7)
+            self.assertEqual(loaded.rng.getstate(), game.rng.getstate())
+            game.replace_top_card()
+            loaded.replace_top_card()
+            self.assertEqual(loaded.snapshot(), game.snapshot())
+        finally:
+            self.delete_test_games([game_id])
+
+    def test_seeded_rng_survives_catalog_append(self):
+        """Проверка, что генератор игры с сидом восстанавливается после добавления глаголов в каталог"""
+        game_id = shortuuid.uuid()[:8]
+        game = Game(seed=7)
+        game.save_state(game_id)
+        expected = game.rng.getstate()
+        try:
+            with open(verb_registry.path, encoding="utf-8") as f:
+                data = json.load(f)
+            data["verbs"].append({"infinitive": "zzgehen", "prasens_3": "zzgeht", "prateritum": "zzging",
+                                  "partizip_2": "zzgegangen", "translation": "тест"})
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "verbs.json")
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                with mock.patch('app.verb_registry', VerbRegistry(path)):
+                    self.assertEqual(Game(game_id).rng.getstate(), expected)
+        finally:
+            self.delete_test_games([game_id])
+
+    def test_game_log_levels_sampling_and_trace(self):
+        """Проверка журнала игры: уровень, выборка по маршруту и трассировка одной игры"""
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('game.test')
+        logger.propagate = False
+        logger.addHandler(handler)
+        log = GameLog(logger, logging.INFO, {"get_game_state": 0.0})
+        try:
+            log.debug("Отладка", "a")
+            log.info("Событие", "a", moves=3)
+            with app.test_request_context('/game/a/state'):
+                log.info("Опрос", "a")
+                log.warning("Предупреждение", "a")
+                log.trace("b")
+                log.debug("Трассировка", "b", turn="player")
+            self.assertEqual([record.getMessage() for record in records],
+                             ["Событие", "Предупреждение", "Трассировка"])
+            self.assertEqual(records[0].fields, {"game_id": "a", "moves": 3})
+            self.assertEqual(records[2].fields, {"game_id": "b", "route": "get_game_state", "turn": "player"})
+            line = json.loads(StructuredFormatter('json').format(records[2]))
+            self.assertEqual((line["level"], line["message"], line["game_id"]), ("DEBUG", "Трассировка", "b"))
+            log.trace("b", enabled=False)
+            self.assertFalse(log.enabled(logging.DEBUG, "b"))
+        finally:
+            logger.removeHandler(handler)
+
     def test_replace_top_card(self):
         """Проверка замены верхней карты в колоде сброса"""
         # Запоминаем текущую верхнюю карту
@@ -5,7 +5,6 @@ import json
 class TestErrorHandling(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         self.app_context = app.app_context()
         self.app_context.push()
         db.create_all()
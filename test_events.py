@@ -0,0 +1,217 @@
+import unittest
+import json
+import threading
+import time
+from app import app, db, GameState, game_notifier, games, bot_moves, BOT_STRATEGIES, decode_card, is_playable_on, sse_slots, long_poll_slots
+
+class SlowBot:
+    """Бот, который долго думает и всегда берет карту"""
+    def choose(self, game):
+        time.sleep(0.5)
+        return None
+
+    def stats(self):
+        return {}
+
+class TestGameEvents(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SSE_HEARTBEAT'] = 0.2
+        app.config['STATE_RECHECK'] = 0.05
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = app.test_client()
+    
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+    
+    def create_game(self, game_type='multiplayer'):
+        response = self.client.post('/game/new', 
+                        json={'player_name': 'Player1', 'game_type': game_type})
+        return json.loads(response.data)['game_id']
+    
+    def read_event(self, chunks):
+        """Читает поток до следующего события state и возвращает его данные"""
+        for chunk in chunks:
+            lines = chunk.decode('utf-8').splitlines()
+            if 'event: state' in lines:
+                data = [line for line in lines if line.startswith('data: ')][0]
+                return json.loads(data[len('data: '):])
+        return None
+    
+    def test_notifier_wakes_waiter(self):
+        """Проверка, что публикация новой версии будит ожидающий поток"""
+        results = []
+        waiter = threading.Thread(
+            target=lambda: results.append(game_notifier.wait('game1', 1, timeout=5)))
+        waiter.start()
+        while not game_notifier.waiting():
+            time.sleep(0.01)
+        started = time.monotonic()
+        game_notifier.publish('game1', 2)
+        waiter.join()
+        
+        self.assertEqual(results, [True])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(game_notifier.waiting(), 0)
+    
+    def test_notifier_timeout(self):
+        """Проверка выхода из ожидания по таймауту"""
+        self.assertFalse(game_notifier.wait('game2', 1, timeout=0.05))
+    
+    def test_event_stream_pushes_changes(self):
+        """Проверка, что поток событий присылает состояние после присоединения соперника"""
+        game_id = self.create_game()
+        response = self.client.get(f'/game/{game_id}/events?player_name=Player1&cards=ids',
+                                   buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        
+        first = self.read_event(chunks)
+        self.assertEqual(first['status'], 'waiting')
+        
+        self.client.post(f'/game/{game_id}/join', json={'player_name': 'Player2'})
+        second = self.read_event(chunks)
+        self.assertEqual(second['game_status'], 'active')
+        self.assertGreater(second['version'], first['version'])
+        self.assertTrue(all(isinstance(card, int) for card in second['player_cards']))
+        
+        # Пока ничего не меняется, приходят только пульсы
+        self.assertEqual(next(chunks), b': heartbeat\n\n')
+        response.close()
+    
+    def test_event_stream_resumes_from_last_event_id(self):
+        """Проверка, что переподключение с Last-Event-ID не повторяет уже полученное состояние"""
+        game_id = self.create_game()
+        version = GameState.query.get(game_id).version
+        response = self.client.get(f'/game/{game_id}/events?player_name=Player1',
+                                   headers={'Last-Event-ID': str(version)}, buffered=False)
+        chunks = iter(response.response)
+        next(chunks)  # retry
+        self.assertEqual(next(chunks), b': heartbeat\n\n')
+        response.close()
+    
+    def test_event_stream_limit(self):
+        """Проверка, что сверх SSE_MAX_STREAMS поток не открывается, а место освобождается при закрытии"""
+        game_id = self.create_game()
+        limit = sse_slots.limit
+        sse_slots.limit = sse_slots.active + 1
+        try:
+            response = self.client.get(f'/game/{game_id}/events?player_name=Player1', buffered=False)
+            rejected = self.client.get(f'/game/{game_id}/events?player_name=Player1')
+            self.assertEqual(rejected.status_code, 503)
+            self.assertIn('Retry-After', rejected.headers)
+            self.assertEqual(self.client.get('/health').status_code, 200)
+            
+            response.close()
+            reopened = self.client.get(f'/game/{game_id}/events?player_name=Player1', buffered=False)
+            self.assertEqual(reopened.mimetype, 'text/event-stream')
+            reopened.close()
+        finally:
+            sse_slots.limit = limit
+    
+    def test_long_poll_returns_on_change(self):
+        """Проверка, что длинный опрос отвечает сразу после изменения игры"""
+        game_id = self.create_game()
+        version = GameState.query.get(game_id).version
+        
+        def join_later():
+            time.sleep(0.2)
+            with app.app_context():
+                app.test_client().post(f'/game/{game_id}/join', json={'player_name': 'Player2'})
+        
+        joiner = threading.Thread(target=join_later)
+        joiner.start()
+        started = time.monotonic()
+        response = self.client.get(
+            f'/game/{game_id}/state?player_name=Player1&since={version}&wait=5')
+        joiner.join()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertGreater(json.loads(response.data)['version'], version)
+    
+    def test_long_poll_timeout(self):
+        """Проверка ответа 304, если за время ожидания игра не изменилась"""
+        game_id = self.create_game()
+        version = GameState.query.get(game_id).version
+        response = self.client.get(
+            f'/game/{game_id}/state?player_name=Player1&since={version}&wait=0.2')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        
+        # Если клиент отстал, состояние отдается без ожидания
+        stale = self.client.get(
+            f'/game/{game_id}/state?player_name=Player1&since={version - 1}&wait=5')
+        self.assertEqual(stale.status_code, 200)
+    
+    def test_long_poll_limit(self):
+        """Проверка, что сверх LONG_POLL_MAX_WAITERS опрос отвечает сразу с Retry-After"""
+        game_id = self.create_game()
+        version = GameState.query.get(game_id).version
+        limit = long_poll_slots.limit
+        long_poll_slots.limit = 0
+        try:
+            started = time.monotonic()
+            response = self.client.get(
+                f'/game/{game_id}/state?player_name=Player1&since={version}&wait=5')
+            self.assertEqual(response.status_code, 304)
+            self.assertIn('Retry-After', response.headers)
+            self.assertLess(time.monotonic() - started, 1)
+            
+            # Изменившееся состояние отдается как обычно
+            stale = self.client.get(
+                f'/game/{game_id}/state?player_name=Player1&since={version - 1}&wait=5')
+            self.assertEqual(stale.status_code, 200)
+        finally:
+            long_poll_slots.limit = limit
+    
+    @unittest.skipUnless(bot_moves.asynchronous, "ходы бота выполняются в запросе (BOT_WORKERS=0)")
+    def test_bot_move_off_request_path(self):
+        """Проверка, что ход игрока подтверждается сразу, а ход бота приходит новой версией"""
+        BOT_STRATEGIES['slow'] = SlowBot()
+        self.addCleanup(BOT_STRATEGIES.pop, 'slow')
+        response = self.client.post('/game/new', 
+                        json={'player_name': 'Player1', 'game_type': 'bot', 'bot_strategy': 'slow'})
+        game_id = json.loads(response.data)['game_id']
+        # Добор при раздаче не считаем, чтобы ход точно перешел к боту
+        game = games.load(game_id)
+        game.no_valid_moves_count = 0
+        game.save_state(game_id)
+        state = json.loads(self.client.get(f'/game/{game_id}/state?player_name=Player1&cards=ids').data)
+        
+        top = decode_card(state['discard_pile'])
+        playable = [card for card in state['player_cards'] if is_playable_on(decode_card(card), top)]
+        started = time.monotonic()
+        if playable:
+            response = self.client.post(f'/game/{game_id}/play', 
+                            json={'card': playable[0], 'player_name': 'Player1'})
+        else:
+            response = self.client.post(f'/game/{game_id}/draw', json={'player_name': 'Player1'})
+        self.assertTrue(json.loads(response.data)['success'])
+        self.assertLess(time.monotonic() - started, 0.5)
+        
+        after_move = json.loads(self.client.get(f'/game/{game_id}/state?player_name=Player1').data)
+        self.assertEqual(after_move['current_turn'], 'opponent')
+        
+        # Ход бота клиент получает длинным опросом
+        response = self.client.get(
+            f'/game/{game_id}/state?player_name=Player1&since={after_move["version"]}&wait=5')
+        self.assertEqual(response.status_code, 200)
+        bot_moved = json.loads(response.data)
+        self.assertGreater(bot_moved['version'], after_move['version'])
+        self.assertEqual(bot_moved['current_turn'], 'player')
+        self.assertEqual(bot_moved['opponent_cards_count'], after_move['opponent_cards_count'] + 1)
+        self.assertTrue(bot_moves.wait(5))
+    
+    def test_event_stream_unknown_game(self):
+        """Проверка потока событий для несуществующей игры"""
+        response = self.client.get('/game/nonexistent/events?player_name=Player1')
+        data = json.loads(response.data)
+        self.assertFalse(data['success'])
+
+if __name__ == '__main__':
+    unittest.main()
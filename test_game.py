@@ -1,5 +1,6 @@
 import unittest
-from app import Game
+import time
+from app import Game, Hand, verb_registry, MonteCarloBot, bot_strategy, is_playable_on
 
 class TestGame(unittest.TestCase):
     def setUp(self):
@@ -60,6 +61,85 @@ class TestGame(unittest.TestCase):
         self.game.replace_top_card()
         self.assertEqual(len(self.game.discard_pile), initial_discard_pile + 1)
 
+    def test_deck_built_from_template(self):
+        """Проверка, что колода игры — перемешанная копия эталонной колоды"""
+        template = verb_registry.deck_template
+        game = Game()
+        all_cards = game.deck + game.players["player"] + game.players["opponent"] + game.discard_pile
+        self.assertEqual(sorted(all_cards), sorted(template))
+        self.assertEqual(len(template), 4 * len(verb_registry.verbs))
+        # Раздача карт не должна затрагивать эталонную колоду
+        self.assertIsInstance(template, tuple)
+        self.assertEqual(len(verb_registry.deck_template), len(template))
+
+    def test_hand_playability_index(self):
+        """Проверка индекса руки по глаголу и форме"""
+        gehen = verb_registry.card(0)
+        ging = verb_registry.card(2)
+        sieht = verb_registry.card(5)
+        hand = Hand([gehen, sieht])
+        
+        self.assertTrue(hand.has_playable(ging))
+        self.assertEqual(hand.playable_card(ging), gehen)
+        self.assertEqual(hand.playable_card(verb_registry.card(6)), sieht)
+        self.assertIsNone(hand.playable_card(verb_registry.card(10)))
+        
+        hand.remove(gehen)
+        self.assertFalse(hand.has_playable(ging))
+        self.assertNotIn(gehen, hand)
+        hand.append(ging)
+        self.assertIn(ging, hand)
+        self.assertEqual(hand.pop(), ging)
+        self.assertEqual(hand, [sieht])
+        
+    def test_assigned_hand_is_indexed(self):
+        """Проверка, что присвоенный список карточек становится индексированной рукой"""
+        top_card = self.game.discard_pile[-1]
+        self.game.players["player"] = [top_card]
+        self.assertIsInstance(self.game.players["player"], Hand)
+        self.assertTrue(self.game.check_if_playable())
+        self.game.players = {"player": [], "opponent": [top_card]}
+        self.assertFalse(self.game.check_if_playable())
+        self.assertTrue(self.game.check_if_playable("opponent"))
+
+    def montecarlo_position(self):
+        """Позиция, где у бота две подходящие карты: по глаголу и по форме"""
+        template = list(verb_registry.deck_template)
+        top_card = template[0]
+        bot_cards = [template[1], template[4], template[9]]
+        self.game.discard_pile = [top_card]
+        self.game.players = {"player": template[10:20], "opponent": bot_cards}
+        self.game.deck = [card for card in template if card not in bot_cards and card != top_card][18:]
+        self.game.current_turn = "opponent"
+        return top_card
+
+    def test_default_bot_plays_first_playable_card(self):
+        """Проверка, что стратегия по умолчанию — первая подходящая карта"""
+        self.montecarlo_position()
+        self.assertEqual(bot_strategy().choose(self.game), self.game.players["opponent"].playable_card(self.game.discard_pile[-1]))
+
+    def test_montecarlo_bot_respects_budget(self):
+        """Проверка, что Монте-Карло бот выбирает подходящую карту в пределах бюджета времени"""
+        top_card = self.montecarlo_position()
+        bot = MonteCarloBot(budget_ms=20)
+        started = time.perf_counter()
+        card = bot.choose(self.game)
+        elapsed = time.perf_counter() - started
+        self.assertIn(card, self.game.players["opponent"])
+        self.assertTrue(is_playable_on(card, top_card))
+        self.assertLess(elapsed, 0.1)
+        self.assertGreater(bot.stats()["rollouts"], 0)
+
+    def test_montecarlo_bot_caches_positions(self):
+        """Проверка, что выбор для уже оцененной позиции берется из кэша"""
+        self.montecarlo_position()
+        bot = MonteCarloBot(budget_ms=5)
+        first = bot.choose(self.game)
+        rollouts = bot.stats()["rollouts"]
+        self.assertEqual(bot.choose(self.game), first)
+        self.assertEqual(bot.stats()["hits"], 1)
+        self.assertEqual(bot.stats()["rollouts"], rollouts)
+
     def test_multiplayer_game(self):
         """Проверка создания мультиплеерной игры"""
         # Создаем новый экземпляр Game и сразу устанавливаем тип игры "multiplayer"
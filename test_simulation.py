@@ -0,0 +1,41 @@
+import unittest
+from app import Game
+from simulation import game_class, play_game, simulate_batch, run_simulation
+
+class TestSimulation(unittest.TestCase):
+    def test_seeded_game_is_reproducible(self):
+        """Проверка, что партия с одним и тем же сидом играется одинаково"""
+        rules = game_class()
+        first = rules(seed=42)
+        second = rules(seed=42)
+        self.assertEqual(first.snapshot(), second.snapshot())
+        self.assertEqual(play_game(first), play_game(second))
+        self.assertEqual(first.snapshot(), second.snapshot())
+
+    def test_simulated_game_keeps_no_move_log(self):
+        """Проверка, что в режиме симуляции ходы не копятся в журнале"""
+        game = game_class()(seed=1)
+        play_game(game)
+        self.assertEqual(game.pending_moves, [])
+        self.assertEqual(Game.record_moves, True)
+
+    def test_rules_are_configurable(self):
+        """Проверка размера сдачи из параметров правил"""
+        game = game_class(hand_size=5)(seed=3)
+        self.assertIn(len(game.players["player"]), (5, 6))
+        self.assertEqual(len(game.players["opponent"]), 5)
+        self.assertEqual(Game.HAND_SIZE, 10)
+
+    def test_batch_statistics(self):
+        """Проверка сводной статистики по пачке партий"""
+        result = simulate_batch(range(50))
+        self.assertEqual(sum(result["outcomes"].values()), 50)
+        self.assertEqual(sum(result["lengths"].values()), 50)
+
+        summary = run_simulation(50, workers=1, batch_size=20)
+        self.assertEqual(summary["games"], 50)
+        self.assertAlmostEqual(summary["player_win_rate"] + summary["opponent_win_rate"] + summary["stalemate_rate"], 1.0)
+        self.assertGreater(summary["games_per_second"], 0)
+
+if __name__ == '__main__':
+    unittest.main()